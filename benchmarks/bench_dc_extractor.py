@@ -0,0 +1,143 @@
+'''
+Microbenchmark for Dublin Core extraction from a single ListRecords page, comparing DublinCoreExtractor
+with the original prefix-rewriting find()-based extraction.
+
+Usage: python benchmarks/bench_dc_extractor.py [--page <captured_page.xml>] [--shape GA|CSIRO|ARDC] [--records <n>]
+
+A captured page can be saved with e.g. curl 'http://pid.geoscience.gov.au/sample/oai?verb=ListRecords&metadataPrefix=oai_dc'.
+If no page is given, a synthetic page in the specified shape is used.
+'''
+import os
+import sys
+import re
+import json
+import argparse
+from timeit import default_timer as timer
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from igsn_reader._dc_extractor import DublinCoreExtractor
+from synthetic_oaipmh import SHAPES, SyntheticEndpoint
+
+MIN_BENCHMARK_SECONDS = 1.0 # Minimum time to spend on each measurement
+
+
+def legacy_parse(response_content):
+    '''
+    Original per-page parse: decode, strip ns3: prefix with whole-document regexes, re-encode and parse
+    '''
+    response_content = response_content.decode('utf-8')
+    response_content = re.sub('xmlns:ns3="http://www.openarchives.org/OAI/2.0/"', '', re.sub('ns3:', '', response_content)).encode('utf-8')
+    response_tree = etree.fromstring(response_content)
+    return response_tree, response_tree.find('./ListRecords', namespaces=response_tree.nsmap)
+
+
+def legacy_extract(response_tree, list_records_element):
+    '''
+    Original per-record extraction using find()/findall() with string-formatted paths and per-element nsmap lookups
+    '''
+    sample_rows = []
+    for record_element in list_records_element.findall('./record', namespaces=response_tree.nsmap):
+        insert_params = {}
+        insert_params['identifier'] = record_element.find('./header/identifier', namespaces=response_tree.nsmap).text
+        try:
+            insert_params['datestamp'] = record_element.find('./header/datestamp', namespaces=response_tree.nsmap).text
+        except:
+            insert_params['datestamp'] = None
+
+        dc_element = record_element.find('./metadata/{http://www.openarchives.org/OAI/2.0/oai_dc/}dc', namespaces=response_tree.nsmap)
+        if dc_element is None:
+            dc_element = record_element.find('./metadata', namespaces=response_tree.nsmap)
+
+        insert_params['alt_identifiers'] = ', '.join([element.text for element in dc_element.findall('./dc:identifier', namespaces=dc_element.nsmap)])
+        insert_params['relations'] = ', '.join([element.text for element in dc_element.findall('./dc:relation', namespaces=dc_element.nsmap)])
+
+        for dc_attribute in ['title', 'subject', 'description', 'date', 'type', 'format', 'coverage', 'creator', 'publisher', 'rights']:
+            try:
+                insert_params[dc_attribute] = dc_element.find('./dc:{}'.format(dc_attribute), namespaces=dc_element.nsmap).text
+            except Exception:
+                insert_params[dc_attribute] = None
+
+        sample_rows.append(insert_params)
+    return sample_rows
+
+
+def extractor_parse(dc_extractor, response_content):
+    '''
+    DublinCoreExtractor per-page parse with no text rewriting
+    '''
+    response_tree = etree.fromstring(response_content)
+    return response_tree, dc_extractor.get_list_records_element(response_tree)
+
+
+def extractor_extract(dc_extractor, list_records_element):
+    '''
+    DublinCoreExtractor per-record extraction
+    '''
+    return [dc_extractor.extract(record_element) for record_element in dc_extractor.get_records(list_records_element)]
+
+
+def measure(function, *args):
+    '''
+    Function to return mean seconds per call of function(*args), repeating for at least MIN_BENCHMARK_SECONDS
+    '''
+    iterations = 0
+    start_time = timer()
+    while True:
+        function(*args)
+        iterations += 1
+        elapsed_time = timer() - start_time
+        if elapsed_time >= MIN_BENCHMARK_SECONDS:
+            return elapsed_time / iterations
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark Dublin Core extraction from a ListRecords page')
+    argument_parser.add_argument('--page', help='Path to captured ListRecords response')
+    argument_parser.add_argument('--shape', choices=SHAPES, default='CSIRO', help='Shape of synthetic page if no captured page given')
+    argument_parser.add_argument('--records', type=int, default=1000, help='Number of records in synthetic page')
+    args = argument_parser.parse_args()
+
+    if args.page:
+        with open(args.page, 'rb') as page_file:
+            response_content = page_file.read()
+        source = args.page
+    else:
+        synthetic_endpoint = SyntheticEndpoint(args.shape, record_count=args.records, page_size=args.records)
+        response_content = next(synthetic_endpoint.get_list_records_pages())
+        source = 'synthetic {} page'.format(args.shape)
+
+    dc_extractor = DublinCoreExtractor()
+
+    legacy_tree, legacy_list_records_element = legacy_parse(response_content)
+    extractor_tree, extractor_list_records_element = extractor_parse(dc_extractor, response_content)
+
+    legacy_rows = legacy_extract(legacy_tree, legacy_list_records_element)
+    extractor_rows = extractor_extract(dc_extractor, extractor_list_records_element)
+    record_count = len(extractor_rows)
+    assert record_count, 'No records found in {}'.format(source)
+    assert len(legacy_rows) == record_count, 'Record count mismatch: {} != {}'.format(len(legacy_rows), record_count)
+
+    results = {'source': source,
+               'page_bytes': len(response_content),
+               'records': record_count,
+               'dc_profile': dc_extractor.profile,
+               }
+    for name, parse_seconds, extract_seconds in [
+        ('legacy',
+         measure(legacy_parse, response_content),
+         measure(legacy_extract, legacy_tree, legacy_list_records_element)),
+        ('extractor',
+         measure(extractor_parse, dc_extractor, response_content),
+         measure(extractor_extract, dc_extractor, extractor_list_records_element)),
+        ]:
+        results[name] = {'extract_records_per_sec': round(record_count / extract_seconds),
+                         'parse_and_extract_records_per_sec': round(record_count / (parse_seconds + extract_seconds)),
+                         }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
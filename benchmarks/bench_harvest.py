@@ -0,0 +1,233 @@
+'''
+End-to-end harvest benchmark running read_igsns against a local synthetic OAI-PMH server,
+reporting records/sec, peak RSS and per-page latency percentiles as JSON.
+
+Usage: python benchmarks/bench_harvest.py [--backends SQLite,Postgres] [--parse-modes tree,streaming]
+                                          [--shapes GA,CSIRO,ARDC] [--records <n>] [--page-size <n>]
+                                          [--payload-size <n>] [--latency <seconds>] [--repeat <n>] [--output <path>]
+
+Each case runs in a fresh process so that peak RSS is measured per case, while the synthetic server runs in
+this process. Synthetic endpoints are served with keys prefixed by BENCH_ so they cannot be confused with real
+endpoints, and record identifiers are prefixed by bench. so they cannot conflict with stored samples.
+The Postgres backend uses the configured database, or the --postgres-* options, and is skipped if no
+connection can be made. Any BENCH_ endpoints and their samples are deleted from the Postgres database before
+and after each run.
+'''
+import os
+import sys
+import json
+import tempfile
+import platform
+import argparse
+import resource
+from timeit import default_timer as timer
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from synthetic_oaipmh import SHAPES, SyntheticEndpoint
+from synthetic_server import SyntheticOAIPMHServer
+
+BACKENDS = ['SQLite', 'Postgres']
+PARSE_MODES = ['tree', 'streaming']
+ENDPOINT_KEY_PREFIX = 'BENCH_' # Prefix for synthetic endpoint keys in the OAIPMH table
+LATENCY_PERCENTILES = [50, 90, 99] # Per-page latency percentiles to report
+
+
+def get_percentile(sorted_values, percentile):
+    '''
+    Function to return the nearest-rank percentile of a sorted list of values
+    '''
+    if not sorted_values:
+        return None
+    rank = max(int(round(percentile / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def delete_bench_endpoints(postgres_kwargs):
+    '''
+    Function to delete all BENCH_ endpoints and their samples and harvest state from a Postgres database
+    '''
+    import psycopg2
+
+    db_connection = psycopg2.connect(host=postgres_kwargs['postgres_host'],
+                                     port=postgres_kwargs['postgres_port'],
+                                     dbname=postgres_kwargs['postgres_dbname'],
+                                     user=postgres_kwargs['postgres_user'],
+                                     password=postgres_kwargs['postgres_password'])
+    try:
+        with db_connection:
+            with db_connection.cursor() as cursor:
+                select_sql = 'select oaipmh_id from oaipmh where oaipmh_key like %(key_prefix)s'
+                for table_name in ['sample', 'harvest_state']:
+                    cursor.execute('delete from {} where oaipmh_id in ({})'.format(table_name, select_sql),
+                                   {'key_prefix': ENDPOINT_KEY_PREFIX + '%'})
+                cursor.execute('delete from oaipmh where oaipmh_key like %(key_prefix)s',
+                               {'key_prefix': ENDPOINT_KEY_PREFIX + '%'})
+    finally:
+        db_connection.close()
+
+
+def run_case(backend, parse_mode, endpoint_urls, postgres_kwargs, bulk_load=False):
+    '''
+    Function to run a single harvest case in a fresh process and return a dict of results
+    '''
+    import igsn_reader
+    from igsn_reader import settings
+
+    settings['debug'] = False
+    settings['oai_pmh_endpoints'] = endpoint_urls
+    settings['page_cache_dir'] = None
+
+    temp_dir = None
+    if backend == 'SQLite':
+        temp_dir = tempfile.TemporaryDirectory()
+        igsn_reader_object = igsn_reader.get_IGSNReader('SQLite', sqlite_db_path=os.path.join(temp_dir.name, 'bench.sqlite'))
+    else:
+        delete_bench_endpoints(postgres_kwargs)
+        igsn_reader_object = igsn_reader.get_IGSNReader('Postgres', **postgres_kwargs)
+
+    # Time each ListRecords request, including parsing and, when streaming, extraction
+    page_seconds = []
+    http_client = igsn_reader_object._http_client
+    http_client_get = http_client.get
+
+    def timed_get(oaipmh_url, http_params, read_response, stream=False):
+        start_time = timer()
+        try:
+            return http_client_get(oaipmh_url, http_params, read_response, stream=stream)
+        finally:
+            if http_params.get('verb') == 'ListRecords':
+                page_seconds.append(timer() - start_time)
+
+    http_client.get = timed_get
+
+    try:
+        start_time = timer()
+        harvest_results = igsn_reader_object.read_igsns(list(endpoint_urls.keys()),
+                                                        streaming_parse=(parse_mode == 'streaming'),
+                                                        bulk_load=bulk_load)
+        elapsed_seconds = timer() - start_time
+    finally:
+        igsn_reader_object.close()
+        if backend == 'Postgres':
+            delete_bench_endpoints(postgres_kwargs)
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    record_count = sum(sample_count for sample_count, _written_count in harvest_results.values())
+    written_count = sum(written_count for _sample_count, written_count in harvest_results.values())
+    page_milliseconds = sorted(seconds * 1000.0 for seconds in page_seconds)
+
+    return {'backend': backend,
+            'parse_mode': parse_mode,
+            'bulk_load': bulk_load,
+            'records': record_count,
+            'written': written_count,
+            'elapsed_seconds': round(elapsed_seconds, 3),
+            'records_per_sec': round(record_count / elapsed_seconds, 1) if elapsed_seconds else None,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1), # ru_maxrss is in KB on Linux
+            'page_latency_ms': dict([('pages', len(page_milliseconds))]
+                                    + [('p{}'.format(percentile), round(get_percentile(page_milliseconds, percentile), 2)
+                                        if page_milliseconds else None)
+                                       for percentile in LATENCY_PERCENTILES]
+                                    + [('max', round(page_milliseconds[-1], 2) if page_milliseconds else None)]),
+            }
+
+
+def check_postgres(postgres_kwargs):
+    '''
+    Function to return None if a Postgres connection can be made, or the error message otherwise
+    '''
+    try:
+        delete_bench_endpoints(postgres_kwargs)
+    except Exception as e:
+        return str(e).strip()
+
+
+def main():
+    from igsn_reader import settings
+
+    argument_parser = argparse.ArgumentParser(description='Benchmark end-to-end harvests against a synthetic OAI-PMH server')
+    argument_parser.add_argument('--backends', default=','.join(BACKENDS), help='Comma-separated list of database backends')
+    argument_parser.add_argument('--parse-modes', default=','.join(PARSE_MODES), help='Comma-separated list of parse modes')
+    argument_parser.add_argument('--shapes', default=','.join(SHAPES), help='Comma-separated list of endpoint shapes')
+    argument_parser.add_argument('--records', type=int, default=10000, help='Number of records per endpoint')
+    argument_parser.add_argument('--page-size', type=int, default=100, help='Number of records per ListRecords page')
+    argument_parser.add_argument('--payload-size', type=int, default=200, help='Number of characters in each dc:description')
+    argument_parser.add_argument('--latency', type=float, default=0.0, help='Seconds to delay each response')
+    argument_parser.add_argument('--repeat', type=int, default=1, help='Number of times to run each case')
+    argument_parser.add_argument('--postgres-host', default=settings.get('postgres_server') or 'localhost')
+    argument_parser.add_argument('--postgres-port', type=int, default=settings.get('postgres_port') or 5432)
+    argument_parser.add_argument('--postgres-dbname', default=settings.get('postgres_dbname') or 'IGSN_OAIPMH')
+    argument_parser.add_argument('--postgres-user', default=settings.get('postgres_user') or 'db_user')
+    argument_parser.add_argument('--postgres-password', default=settings.get('postgres_password') or 'db_password')
+    argument_parser.add_argument('--bulk-load', action='store_true', help='Harvest in bulk-load mode')
+    argument_parser.add_argument('--output', help='Path of JSON file to write results to instead of standard output')
+    args = argument_parser.parse_args()
+
+    postgres_kwargs = {'postgres_host': args.postgres_host,
+                       'postgres_port': args.postgres_port,
+                       'postgres_dbname': args.postgres_dbname,
+                       'postgres_user': args.postgres_user,
+                       'postgres_password': args.postgres_password,
+                       }
+
+    synthetic_endpoints = {ENDPOINT_KEY_PREFIX + shape: SyntheticEndpoint(shape,
+                                                                          record_count=args.records,
+                                                                          page_size=args.page_size,
+                                                                          payload_size=args.payload_size,
+                                                                          latency=args.latency,
+                                                                          identifier_prefix=ENDPOINT_KEY_PREFIX.strip('_').lower())
+                           for shape in args.shapes.split(',')
+                           }
+
+    results = []
+    skipped = {}
+    with SyntheticOAIPMHServer(synthetic_endpoints) as synthetic_server:
+        endpoint_urls = {key: synthetic_server.get_url(key) for key in synthetic_endpoints.keys()}
+
+        for backend in args.backends.split(','):
+            assert backend in BACKENDS, 'Unknown backend "{}"'.format(backend)
+            if backend == 'Postgres':
+                postgres_error = check_postgres(postgres_kwargs)
+                if postgres_error:
+                    skipped[backend] = postgres_error
+                    continue
+
+            for parse_mode in args.parse_modes.split(','):
+                assert parse_mode in PARSE_MODES, 'Unknown parse mode "{}"'.format(parse_mode)
+                for repetition in range(args.repeat):
+                    # Fresh spawned process per case so that peak RSS and imports are not shared between cases
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as process_pool:
+                        result = process_pool.submit(run_case, backend, parse_mode, endpoint_urls, postgres_kwargs,
+                                                     args.bulk_load).result()
+                    result['repetition'] = repetition
+                    results.append(result)
+
+    report = {'config': {'shapes': args.shapes.split(','),
+                         'records_per_endpoint': args.records,
+                         'page_size': args.page_size,
+                         'payload_size': args.payload_size,
+                         'latency_seconds': args.latency,
+                         'bulk_load': args.bulk_load,
+                         },
+              'environment': {'python': platform.python_version(),
+                              'platform': platform.platform(),
+                              'cpu_count': os.cpu_count(),
+                              },
+              'results': results,
+              'skipped': skipped,
+              }
+
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report_json + '\n')
+    else:
+        print(report_json)
+
+
+if __name__ == '__main__':
+    main()
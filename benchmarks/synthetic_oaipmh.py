@@ -0,0 +1,217 @@
+'''
+Synthetic OAI-PMH responses in the shapes returned by the GA (bare metadata), CSIRO (ns3-prefixed oai_dc)
+and ARDC (default namespace oai_dc) endpoints, for benchmarking without hitting live servers
+'''
+import random
+import bisect
+from datetime import datetime, timedelta, timezone
+from xml.sax.saxutils import escape
+
+SHAPES = ['GA', 'CSIRO', 'ARDC']
+EPOCH = datetime(2015, 1, 1, tzinfo=timezone.utc) # earliestDatestamp for all synthetic endpoints
+DATESTAMP_SPAN = timedelta(days=365 * 4) # Record datestamps are spread evenly over this period
+DATESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+OAI_PMH_HEADS = {
+    'GA': ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+           '<responseDate>{now}</responseDate><request verb="{verb}">{url}</request>'),
+    'ARDC': ('<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+             '<responseDate>{now}</responseDate><request verb="{verb}">{url}</request>'),
+    'CSIRO': ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<ns3:OAI-PMH xmlns:ns3="http://www.openarchives.org/OAI/2.0/">'
+              '<ns3:responseDate>{now}</ns3:responseDate><ns3:request verb="{verb}">{url}</ns3:request>'),
+    }
+
+
+class _DatestampSequence(object):
+    '''
+    Sequence view of record datestamps for bisection
+    '''
+    def __init__(self, synthetic_endpoint):
+        self.synthetic_endpoint = synthetic_endpoint
+
+    def __len__(self):
+        return self.synthetic_endpoint.record_count
+
+    def __getitem__(self, index):
+        return self.synthetic_endpoint.get_datestamp(index)
+
+
+class SyntheticEndpoint(object):
+    '''
+    Deterministic synthetic OAI-PMH endpoint supporting the Identify, ListRecords and ListIdentifiers verbs
+    with from/until selection and resumptionTokens
+    '''
+    def __init__(self,
+                 shape='GA',
+                 record_count=1000,
+                 page_size=100,
+                 payload_size=200,
+                 latency=0.0,
+                 deleted_every=0,
+                 seed=0,
+                 identifier_prefix='au'
+                 ):
+        '''
+        SyntheticEndpoint class Constructor
+        shape: One of SHAPES
+        record_count: Total number of records
+        page_size: Number of records per ListRecords page
+        payload_size: Number of characters in each dc:description
+        latency: Seconds to delay each response when served over HTTP
+        deleted_every: Mark every nth record as deleted, or 0 for no deleted records
+        identifier_prefix: First component of each record identifier
+        '''
+        assert shape in SHAPES, 'Unknown shape "{}"'.format(shape)
+        self.shape = shape
+        self.record_count = record_count
+        self.page_size = page_size
+        self.payload_size = payload_size
+        self.latency = latency
+        self.deleted_every = deleted_every
+        self.seed = seed
+        self.identifier_prefix = identifier_prefix
+
+        self.prefix = 'ns3:' if shape == 'CSIRO' else ''
+
+    def get_datestamp(self, index):
+        '''
+        Function to return the datestamp for a record, truncated to whole seconds
+        '''
+        return (EPOCH + DATESTAMP_SPAN * index / max(self.record_count, 1)).replace(microsecond=0)
+
+    def get_identifier(self, index):
+        '''
+        Function to return the OAI identifier for a record
+        '''
+        return '{}.{}.{:08d}'.format(self.identifier_prefix, self.shape.lower(), index)
+
+    def get_indices(self, from_datestamp=None, until_datestamp=None):
+        '''
+        Function to return range of record indices with datestamps in the given (inclusive) range
+        '''
+        datestamps = _DatestampSequence(self)
+        start = bisect.bisect_left(datestamps, from_datestamp) if from_datestamp else 0
+        stop = bisect.bisect_right(datestamps, until_datestamp) if until_datestamp else self.record_count
+        return range(start, max(start, stop))
+
+    def get_header_xml(self, index):
+        '''
+        Function to return the header XML for a record
+        '''
+        deleted = self.deleted_every and index % self.deleted_every == self.deleted_every - 1
+        return ('<{p}header{status}><{p}identifier>{identifier}</{p}identifier>'
+                '<{p}datestamp>{datestamp}</{p}datestamp><{p}setSpec>samples</{p}setSpec></{p}header>'
+                ).format(p=self.prefix,
+                         status=' status="deleted"' if deleted else '',
+                         identifier=self.get_identifier(index),
+                         datestamp=self.get_datestamp(index).strftime(DATESTAMP_FORMAT))
+
+    def get_record_xml(self, index):
+        '''
+        Function to return the record XML for a record, with no metadata for deleted records
+        '''
+        header_xml = self.get_header_xml(index)
+        if 'status="deleted"' in header_xml:
+            return '<{p}record>{header}</{p}record>'.format(p=self.prefix, header=header_xml)
+
+        identifier = self.get_identifier(index)
+        rng = random.Random(self.seed * 1000003 + index)
+        longitude = round(rng.uniform(110, 155), 4)
+        latitude = round(rng.uniform(-45, -10), 4)
+        description = ('Sample {} core interval '.format(index) * (self.payload_size // 20 + 1))[:self.payload_size]
+
+        dc_xml = ''.join([
+            '<dc:identifier>http://pid.example.org/{}</dc:identifier>'.format(identifier),
+            '<dc:identifier>IGSN:{}</dc:identifier>'.format(identifier.upper()),
+            '<dc:title>Sample {} &amp; friends</dc:title>'.format(index),
+            '<dc:subject>geology</dc:subject><dc:subject>borehole</dc:subject>',
+            '<dc:description>{}</dc:description>'.format(escape(description)),
+            '<dc:date>{}</dc:date>'.format(self.get_datestamp(index).strftime('%Y-%m-%d')),
+            '<dc:type>{}</dc:type>'.format(rng.choice(['core', 'rock', 'powder'])),
+            '<dc:format>physical</dc:format>',
+            '<dc:coverage>{}</dc:coverage>'.format(rng.choice([
+                'POINT({} {})'.format(longitude, latitude),
+                'east={}; north={}'.format(longitude, latitude),
+                'northlimit={}; southlimit={}; eastlimit={}; westlimit={}'.format(latitude + 0.5, latitude,
+                                                                                   longitude + 0.5, longitude),
+                ])),
+            '<dc:creator>Survey {}</dc:creator><dc:creator>Driller {}</dc:creator>'.format(index % 7, index % 3),
+            '<dc:publisher>Example Survey</dc:publisher>',
+            '<dc:relation>{}</dc:relation>'.format(self.get_identifier(max(index - 1, 0))),
+            '<dc:rights>CC-BY 4.0</dc:rights>',
+            ])
+
+        if self.shape == 'GA':
+            metadata_xml = '<metadata>{}</metadata>'.format(dc_xml)
+        else:
+            metadata_xml = ('<{p}metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+                            'xmlns:dc="http://purl.org/dc/elements/1.1/">{dc}</oai_dc:dc></{p}metadata>'
+                            ).format(p=self.prefix, dc=dc_xml)
+
+        return '<{p}record>{header}{metadata}</{p}record>'.format(p=self.prefix,
+                                                                 header=header_xml,
+                                                                 metadata=metadata_xml)
+
+    def get_response(self, url, params):
+        '''
+        Function to return the UTF-8 encoded OAI-PMH response for a request URL and dict of query parameters
+        '''
+        verb = params.get('verb', 'ListRecords')
+        response_parts = [OAI_PMH_HEADS[self.shape].format(now=datetime.now(timezone.utc).strftime(DATESTAMP_FORMAT),
+                                                           verb=verb,
+                                                           url=escape(url))]
+
+        if verb == 'Identify':
+            response_parts.append('<{p}Identify><{p}earliestDatestamp>{earliest}</{p}earliestDatestamp>'
+                                  '<{p}granularity>YYYY-MM-DDThh:mm:ssZ</{p}granularity></{p}Identify>'.format(
+                                      p=self.prefix, earliest=EPOCH.strftime(DATESTAMP_FORMAT)))
+        else:
+            resumption_token = params.get('resumptionToken')
+            if resumption_token:
+                offset, from_datestamp, until_datestamp = resumption_token.split('|')
+                offset = int(offset)
+            else:
+                offset, from_datestamp, until_datestamp = 0, params.get('from', ''), params.get('until', '')
+
+            indices = self.get_indices(datetime.strptime(from_datestamp, DATESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+                                       if from_datestamp else None,
+                                       datetime.strptime(until_datestamp, DATESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+                                       if until_datestamp else None)
+
+            if not len(indices):
+                response_parts.append('<{p}error code="noRecordsMatch">No matching records</{p}error>'.format(p=self.prefix))
+            else:
+                get_item_xml = self.get_header_xml if verb == 'ListIdentifiers' else self.get_record_xml
+                response_parts.append('<{p}{verb}>'.format(p=self.prefix, verb=verb))
+                response_parts.extend(get_item_xml(index) for index in indices[offset:offset + self.page_size])
+
+                next_offset = offset + self.page_size
+                if next_offset < len(indices):
+                    response_parts.append('<{p}resumptionToken cursor="{cursor}" completeListSize="{size}">{token}</{p}resumptionToken>'.format(
+                        p=self.prefix,
+                        cursor=offset,
+                        size=len(indices),
+                        token='{}|{}|{}'.format(next_offset, from_datestamp, until_datestamp)))
+                elif resumption_token: # Empty resumptionToken marks the last page of an incomplete list
+                    response_parts.append('<{p}resumptionToken cursor="{cursor}" completeListSize="{size}"/>'.format(
+                        p=self.prefix,
+                        cursor=offset,
+                        size=len(indices)))
+
+                response_parts.append('</{p}{verb}>'.format(p=self.prefix, verb=verb))
+
+        response_parts.append('</{p}OAI-PMH>'.format(p=self.prefix))
+        return ''.join(response_parts).encode('utf-8')
+
+    def get_list_records_pages(self):
+        '''
+        Generator yielding each full ListRecords response in turn
+        '''
+        params = {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}
+        for offset in range(0, max(self.record_count, 1), self.page_size):
+            if offset:
+                params = {'verb': 'ListRecords', 'resumptionToken': '{}||'.format(offset)}
+            yield self.get_response('/oai', params)
@@ -0,0 +1,112 @@
+'''
+Local stand-in OAI-PMH server serving SyntheticEndpoint responses over HTTP, with each endpoint at /<key>/oai.
+
+Usage: python benchmarks/synthetic_server.py [--port <port>] [--shapes GA,CSIRO,ARDC] [--records <n>] [--page-size <n>]
+                                             [--payload-size <n>] [--latency <seconds>]
+'''
+import time
+import gzip
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from synthetic_oaipmh import SHAPES, SyntheticEndpoint
+
+GZIP_COMPRESS_LEVEL = 1 # Fast compression for responses to clients accepting gzip
+
+
+class SyntheticOAIPMHServer(object):
+    '''
+    Threaded HTTP server for a dict of SyntheticEndpoint objects keyed by endpoint key.
+    Responses are delayed by each endpoint's latency and gzip compressed if the client accepts it.
+    May be used as a context manager which serves requests in a background thread.
+    '''
+
+    def __init__(self, synthetic_endpoints, host='127.0.0.1', port=0):
+        '''
+        SyntheticOAIPMHServer class Constructor
+        '''
+        self.synthetic_endpoints = synthetic_endpoints
+        self.request_count = 0
+
+        synthetic_server = self
+
+        class SyntheticOAIPMHHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Allow keep-alive connections
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parsed_url = urlparse(self.path)
+                synthetic_endpoint = synthetic_server.synthetic_endpoints.get(parsed_url.path.strip('/').split('/')[0])
+                if synthetic_endpoint is None:
+                    self.send_error(404)
+                    return
+
+                synthetic_server.request_count += 1
+                if synthetic_endpoint.latency:
+                    time.sleep(synthetic_endpoint.latency)
+
+                response_content = synthetic_endpoint.get_response(self.path,
+                                                                   {key: values[0]
+                                                                    for key, values in parse_qs(parsed_url.query).items()
+                                                                    })
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml; charset=utf-8')
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    response_content = gzip.compress(response_content, GZIP_COMPRESS_LEVEL)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(response_content)))
+                self.end_headers()
+                self.wfile.write(response_content)
+
+        self.http_server = ThreadingHTTPServer((host, port), SyntheticOAIPMHHandler)
+        self.http_server.daemon_threads = True
+        self._server_thread = None
+
+    def get_url(self, key):
+        '''
+        Function to return the OAI-PMH base URL for an endpoint key
+        '''
+        host, port = self.http_server.server_address[:2]
+        return 'http://{}:{}/{}/oai'.format(host, port, key)
+
+    def __enter__(self):
+        self._server_thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        self._server_thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Serve synthetic OAI-PMH endpoints')
+    argument_parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    argument_parser.add_argument('--shapes', default=','.join(SHAPES), help='Comma-separated list of endpoint shapes to serve')
+    argument_parser.add_argument('--records', type=int, default=10000, help='Number of records per endpoint')
+    argument_parser.add_argument('--page-size', type=int, default=100, help='Number of records per ListRecords page')
+    argument_parser.add_argument('--payload-size', type=int, default=200, help='Number of characters in each dc:description')
+    argument_parser.add_argument('--latency', type=float, default=0.0, help='Seconds to delay each response')
+    args = argument_parser.parse_args()
+
+    synthetic_endpoints = {shape: SyntheticEndpoint(shape,
+                                                    record_count=args.records,
+                                                    page_size=args.page_size,
+                                                    payload_size=args.payload_size,
+                                                    latency=args.latency)
+                           for shape in args.shapes.split(',')
+                           }
+
+    synthetic_server = SyntheticOAIPMHServer(synthetic_endpoints, port=args.port)
+    for shape in synthetic_endpoints.keys():
+        print('{}: {}'.format(shape, synthetic_server.get_url(shape)))
+    synthetic_server.http_server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,19 +3,47 @@ Created on 3 May 2019
 
 @author: alex
 '''
-from ._igsn_reader import settings, IGSNReader
-from ._igsn_reader_sqlite import IGSNReader_SQLite
-from ._igsn_reader_postgres import IGSNReader_postgres
+import importlib
+
+# Modules and class names of IGSNReader subclasses keyed by db_engine, imported only when requested
+DB_ENGINE_CLASSES = {
+    'SQLite': ('._igsn_reader_sqlite', 'IGSNReader_SQLite'),
+    'Postgres': ('._igsn_reader_postgres', 'IGSNReader_postgres'),
+    'Parquet': ('._igsn_reader_parquet', 'IGSNReader_Parquet'),
+    }
+
+# Modules of names exported lazily, so that importing the package does not load settings or any database driver
+LAZY_EXPORTS = {
+    'settings': '._igsn_reader',
+    'IGSNReader': '._igsn_reader',
+    'IGSNDatabaseReader': '._igsn_reader',
+    'IGSNReader_SQLite': '._igsn_reader_sqlite',
+    'IGSNReader_postgres': '._igsn_reader_postgres',
+    'IGSNReader_Parquet': '._igsn_reader_parquet',
+    }
+
+def __getattr__(name):
+    '''
+    Function to import lazily exported names on first access
+    '''
+    if name in LAZY_EXPORTS:
+        return getattr(importlib.import_module(LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+def get_IGSNReader_class(db_engine=None):
+    '''
+    Function to return the IGSNReader subclass for specified db_engine, importing only its backend module
+    '''
+    db_engine = db_engine or __getattr__('settings')['database_engine']
+    
+    if db_engine not in DB_ENGINE_CLASSES:
+        raise BaseException('Unhandled db_engine "{}"'.format(db_engine))
+    
+    module_name, class_name = DB_ENGINE_CLASSES[db_engine]
+    return getattr(importlib.import_module(module_name, __name__), class_name)
 
 def get_IGSNReader(db_engine=None, *args, **kwargs):  
     '''
     Class factory function to return subclass of DatasetMetadataCache for specified db_engine
     ''' 
-    db_engine = db_engine or settings['database_engine']
-    
-    if db_engine == 'SQLite':
-        return IGSNReader_SQLite(*args, **kwargs)
-    elif db_engine == 'Postgres':
-        return IGSNReader_postgres(*args, **kwargs)
-    else:
-        raise BaseException('Unhandled db_engine "{}"'.format(db_engine))
\ No newline at end of file
+    return get_IGSNReader_class(db_engine)(*args, **kwargs)
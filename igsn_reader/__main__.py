@@ -2,32 +2,287 @@
 Created on 10 Apr 2019
 
 @author: alex
+
+Command line interface for harvesting IGSN metadata from OAI-PMH endpoints.
+
+Usage: python -m igsn_reader {harvest,resume,reconcile,export,status} [--backend SQLite|Postgres|Parquet] [--sqlite-db-path <path>]
+                                                                     [--postgres-host <host>] ... [options]
+
+    harvest: Harvest all configured endpoints, or only those given with --endpoint
+    resume:  Carry on any interrupted harvests from their stored checkpoints
+    reconcile: Mark or remove stored samples whose records have been deleted, using header-only ListIdentifiers requests
+    export:  Stream stored samples to a CSV, JSONL or Parquet file
+    status:  Report stored sample counts, latest datestamps and harvest checkpoints for each endpoint
+
+Only the selected database backend is imported, and the HTTP stack is only loaded by harvest, resume and reconcile,
+so that short cron jobs and status checks start quickly.
 '''
 
-from pprint import pprint
-from igsn_reader import get_IGSNReader
 import sys
+import json
 import logging
+import argparse
 
 root_logger = logging.getLogger()
 
+DB_ENGINES = ['SQLite', 'Postgres', 'Parquet'] # Choices for --backend, which defaults to database_engine from settings
+DATABASE_COMMANDS = ['export', 'status'] # Commands reporting stored samples, which Parquet part files only hold as undeduplicated rows
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR'] # Choices for --log-level
 
-def main():
-    igsn_reader_object = get_IGSNReader('Postgres')
-    pprint(igsn_reader_object.__dict__)
-    
-    #igsn_reader_object.read_igsns('GA', '2011-06-01T00:00:00Z,9999-12-31T23:59:59Z,1990000,oai_dc')
-    igsn_reader_object.read_igsns('GA')
-    
 
-if __name__ == '__main__':
+def get_argument_parser():
+    '''
+    Function to return the ArgumentParser for the command line interface
+    '''
+    argument_parser = argparse.ArgumentParser(prog='python -m igsn_reader',
+                                              description='Harvest IGSN Dublin Core metadata from OAI-PMH endpoints into a database')
+    subparsers = argument_parser.add_subparsers(dest='command', metavar='{harvest,resume,reconcile,export,status}')
+    subparsers.required = True
+
+    # Options shared by all commands
+    database_parser = argparse.ArgumentParser(add_help=False)
+    database_parser.add_argument('--backend', choices=DB_ENGINES,
+                                 help='Database backend (default: database_engine from settings)')
+    database_parser.add_argument('--sqlite-db-path', help='Path of SQLite database file')
+    database_parser.add_argument('--postgres-host', help='Postgres server host')
+    database_parser.add_argument('--postgres-port', type=int, help='Postgres server port')
+    database_parser.add_argument('--postgres-dbname', help='Postgres database name')
+    database_parser.add_argument('--postgres-user', help='Postgres user name')
+    database_parser.add_argument('--parquet-dir', help='Directory of partitioned Parquet files for the Parquet backend')
+    database_parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO', help='Console logging level (default: INFO)')
+
+    # Options shared by harvest and resume
+    harvest_parser = argparse.ArgumentParser(add_help=False, parents=[database_parser])
+    harvest_parser.add_argument('-e', '--endpoint', action='append', dest='endpoints', metavar='KEY',
+                                help='OAI-PMH key of endpoint to harvest, e.g. GA. May be repeated (default: all endpoints)')
+    harvest_parser.add_argument('--batch-size', type=int, help='Minimum number of records written in each transaction')
+    harvest_parser.add_argument('--workers', type=int, dest='max_concurrent_requests',
+                                help='Maximum number of OAI-PMH requests in flight across all endpoints')
+    harvest_parser.add_argument('--page-queue-size', type=int, help='Maximum number of parsed pages waiting for extraction per endpoint')
+    harvest_parser.add_argument('--write-queue-size', type=int, help='Maximum number of batches waiting for the database writer')
+    harvest_parser.add_argument('--streaming', action='store_true', default=None, dest='streaming_parse',
+                                help='Parse each page incrementally as it is received')
+    harvest_parser.add_argument('--no-streaming', action='store_false', dest='streaming_parse',
+                                help='Parse each page only once it has been received in full')
+    harvest_parser.add_argument('--no-skip-unchanged', action='store_false', default=None, dest='skip_unchanged',
+                                help='Write every record, even if its content has not changed since it was stored')
+    harvest_parser.add_argument('--remove-deleted', action='store_true', default=None,
+                                help='Remove samples whose records have been deleted, rather than marking them as deleted')
+    harvest_parser.add_argument('--bulk-load', action='store_true', default=None,
+                                help='Tune the database for bulk ingest, e.g. for the initial load of an empty database')
+    harvest_parser.add_argument('--metrics-format', choices=['json', 'prometheus'], help='Export harvest metrics in this format')
+    harvest_parser.add_argument('--metrics-path', help='Path of Prometheus textfile to write metrics to')
+
+    harvest_subparser = subparsers.add_parser('harvest', parents=[harvest_parser],
+                                              help='Harvest all configured endpoints, or only those given with --endpoint')
+    harvest_subparser.add_argument('--incremental', action='store_true', default=None,
+                                   help='Only request records changed since the latest stored datestamp for each endpoint')
+    harvest_subparser.add_argument('--resumption-token', help='resumptionToken to start from. Requires a single --endpoint')
+    harvest_subparser.add_argument('--replay', action='store_true', help='Read responses from the page cache instead of over HTTP')
+    harvest_subparser.add_argument('--partitions', type=int, dest='window_count',
+                                   help='Harvest a single --endpoint as this many datestamp windows in parallel processes')
+    harvest_subparser.add_argument('--partition-workers', type=int, dest='worker_count',
+                                   help='Number of worker processes for a partitioned harvest')
+
+    subparsers.add_parser('resume', parents=[harvest_parser],
+                          help='Carry on any interrupted harvests from their stored checkpoints')
+
+    reconcile_subparser = subparsers.add_parser('reconcile', parents=[database_parser],
+                                                help='Mark or remove stored samples whose records have been deleted or are no longer listed')
+    reconcile_subparser.add_argument('-e', '--endpoint', action='append', dest='endpoints', metavar='KEY',
+                                     help='OAI-PMH key of endpoint to reconcile. May be repeated (default: all endpoints)')
+    reconcile_subparser.add_argument('--remove-deleted', action='store_true', default=None,
+                                     help='Remove deleted samples, rather than marking them as deleted')
+    reconcile_subparser.add_argument('--max-missing-fraction', type=float,
+                                     help='Maximum fraction of stored samples for an endpoint which may be marked or removed')
+
+    export_subparser = subparsers.add_parser('export', parents=[database_parser],
+                                             help='Export stored samples to a CSV, JSONL or Parquet file')
+    export_subparser.add_argument('export_path', help='Path of file to export to')
+    export_subparser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'], dest='export_format',
+                                  help='Export format (default: determined from file extension)')
+    export_subparser.add_argument('-e', '--endpoint', action='append', dest='endpoints', metavar='KEY',
+                                  help='OAI-PMH key of endpoint to export samples from. May be repeated (default: all endpoints)')
+    export_subparser.add_argument('--from', dest='from_datestamp', help='Earliest datestamp to export, e.g. 2019-01-01')
+    export_subparser.add_argument('--until', dest='until_datestamp', help='Latest datestamp to export, e.g. 2019-12-31')
+    export_subparser.add_argument('--chunk-size', type=int, help='Number of rows read from the database at a time')
+
+    status_subparser = subparsers.add_parser('status', parents=[database_parser],
+                                             help='Report stored samples and harvest checkpoints for each endpoint')
+    status_subparser.add_argument('-e', '--endpoint', action='append', dest='endpoints', metavar='KEY',
+                                  help='OAI-PMH key of endpoint to report on. May be repeated (default: all endpoints)')
+    status_subparser.add_argument('--json', action='store_true', help='Write status as JSON')
+
+    return argument_parser
+
+
+def check_args(argument_parser, args):
+    '''
+    Function to check combinations of arguments which argparse cannot, exiting with a usage message if they are invalid
+    '''
+    if args.command == 'harvest' and (args.window_count or args.worker_count):
+        if not (args.endpoints and len(args.endpoints) == 1):
+            argument_parser.error('a partitioned harvest requires a single --endpoint')
+        if args.resumption_token or args.replay:
+            argument_parser.error('a partitioned harvest cannot use --resumption-token or --replay')
+
+    if args.command in DATABASE_COMMANDS:
+        from igsn_reader import settings
+
+        if (args.backend or settings['database_engine']) == 'Parquet':
+            argument_parser.error('{} requires a database backend. Read the Parquet directory as a dataset instead'.format(args.command))
+
+
+def get_reader(args):
+    '''
+    Function to return an IGSNReader for the backend and connection options given on the command line
+    '''
+    from igsn_reader import get_IGSNReader, settings
+
+    db_engine = args.backend or settings['database_engine']
+    if db_engine == 'SQLite':
+        reader_kwargs = {'sqlite_db_path': args.sqlite_db_path}
+    elif db_engine == 'Parquet':
+        reader_kwargs = {'parquet_dir': args.parquet_dir}
+    else:
+        reader_kwargs = {'postgres_host': args.postgres_host,
+                         'postgres_port': args.postgres_port,
+                         'postgres_dbname': args.postgres_dbname,
+                         'postgres_user': args.postgres_user,
+                         }
+    return get_IGSNReader(db_engine, **reader_kwargs)
+
+
+def harvest(igsn_reader_object, args):
+    '''
+    Function to run the harvest or resume command and return the harvest results
+    '''
+    from igsn_reader import settings
+
+    # Metrics export is configured through settings, which the command line overrides
+    if args.metrics_format:
+        settings['metrics_format'] = args.metrics_format
+    if args.metrics_path:
+        settings['metrics_path'] = args.metrics_path
+
+    harvest_kwargs = {'batch_size': args.batch_size,
+                      'page_queue_size': args.page_queue_size,
+                      'write_queue_size': args.write_queue_size,
+                      'streaming_parse': args.streaming_parse,
+                      'bulk_load': args.bulk_load,
+                      'skip_unchanged': args.skip_unchanged,
+                      'remove_deleted': args.remove_deleted,
+                      }
+
+    if args.command == 'resume':
+        return igsn_reader_object.read_igsns(args.endpoints,
+                                             max_concurrent_requests=args.max_concurrent_requests,
+                                             resume=True,
+                                             **harvest_kwargs)
+
+    if args.window_count or args.worker_count:
+        return igsn_reader_object.read_igsns_partitioned(args.endpoints[0],
+                                                         window_count=args.window_count,
+                                                         worker_count=args.worker_count,
+                                                         incremental=args.incremental,
+                                                         **harvest_kwargs)
+
+    return igsn_reader_object.read_igsns(args.endpoints,
+                                         resumption_token=args.resumption_token,
+                                         max_concurrent_requests=args.max_concurrent_requests,
+                                         incremental=args.incremental,
+                                         replay=args.replay,
+                                         **harvest_kwargs)
+
+
+def write_status(harvest_status, json_output=False):
+    '''
+    Function to write the harvest status of each endpoint to standard output as a table or as JSON
+    '''
+    if json_output:
+        print(json.dumps(harvest_status, indent=2))
+        return
+
+    columns = [('ENDPOINT', 'oaipmh_key'),
+               ('SAMPLES', 'sample_count'),
+               ('LATEST DATESTAMP', 'latest_datestamp'),
+               ('LAST CHECKPOINT', 'checkpoint_updated'),
+               ('PROGRESS', 'progress'),
+               ('STATE', 'state'),
+               ]
+
+    table_rows = []
+    for endpoint_status in harvest_status:
+        endpoint_status = dict(endpoint_status)
+        if endpoint_status.get('complete_list_size'):
+            # The cursor of a completed harvest is that of the last resumptionToken, not the end of the list
+            endpoint_status['progress'] = '{} / {}'.format(endpoint_status['cursor'] if endpoint_status['interrupted']
+                                                           else endpoint_status['complete_list_size'],
+                                                           endpoint_status['complete_list_size'])
+        if 'interrupted' not in endpoint_status:
+            endpoint_status['state'] = 'not harvested' if not endpoint_status['sample_count'] else 'no checkpoint'
+        else:
+            endpoint_status['state'] = 'interrupted' if endpoint_status['interrupted'] else 'complete'
+        table_rows.append([str(endpoint_status.get(key) if endpoint_status.get(key) is not None else '-')
+                           for _heading, key in columns])
+
+    column_widths = [max([len(heading)] + [len(table_row[column_index]) for table_row in table_rows])
+                     for column_index, (heading, _key) in enumerate(columns)]
+    for table_row in [[heading for heading, _key in columns]] + table_rows:
+        print('  '.join(value.ljust(column_width) for value, column_width in zip(table_row, column_widths)).rstrip())
+
+
+def main(argv=None):
+    '''
+    Main function for command line interface. Returns exit status
+    '''
+    argument_parser = get_argument_parser()
+    args = argument_parser.parse_args(argv)
+    check_args(argument_parser, args)
+
     # Setup logging handlers if required
     if not root_logger.handlers:
         # Set handler for root root_logger to standard output
         console_handler = logging.StreamHandler(sys.stdout)
-        #console_handler.setLevel(logging.INFO)
-        console_handler.setLevel(logging.DEBUG)
+        console_handler.setLevel(getattr(logging, args.log_level))
         console_formatter = logging.Formatter('%(message)s')
         console_handler.setFormatter(console_formatter)
         root_logger.addHandler(console_handler)
-    main()
\ No newline at end of file
+
+    igsn_reader_object = get_reader(args)
+    try:
+        if args.command == 'status':
+            write_status(igsn_reader_object.get_harvest_status(args.endpoints), json_output=args.json)
+            return 0
+
+        if args.command == 'export':
+            igsn_reader_object.export_samples(args.export_path,
+                                              export_format=args.export_format,
+                                              oaipmh_source=args.endpoints,
+                                              from_datestamp=args.from_datestamp,
+                                              until_datestamp=args.until_datestamp,
+                                              chunk_size=args.chunk_size)
+            return 0
+
+        if args.command == 'reconcile':
+            try:
+                igsn_reader_object.reconcile_samples(args.endpoints,
+                                                     remove_deleted=args.remove_deleted,
+                                                     max_missing_fraction=args.max_missing_fraction)
+            except Exception as e:
+                root_logger.error('Reconciliation failed: {}'.format(e))
+                return 1
+            return 0
+
+        try:
+            harvest(igsn_reader_object, args)
+        except Exception as e:
+            root_logger.error('Harvest failed: {}'.format(e))
+            return 1
+        return 0
+    finally:
+        igsn_reader_object.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import re
+
+# Geometry type and coordinate text of a WKT or EWKT geometry, e.g. "SRID=4326;POINT Z (147.5 -18.2 10)"
+WKT_REGEX = re.compile(r'^\s*(?:SRID=\d+\s*;\s*)?([A-Z]+)(?:\s+(?:ZM|Z|M))?\s*(\(.*\)|EMPTY)\s*$', re.IGNORECASE | re.DOTALL)
+NUMBER_REGEX = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+# Names of DCMI Point and DCMI Box encoding scheme components, e.g. "east=147.5; north=-18.2"
+DCMI_POINT_NAMES = ('east', 'north')
+DCMI_BOX_NAMES = ('westlimit', 'southlimit', 'eastlimit', 'northlimit')
+
+LONGITUDE_RANGE = (-180.0, 180.0) # Valid range of WGS84 longitudes in decimal degrees
+LATITUDE_RANGE = (-90.0, 90.0) # Valid range of WGS84 latitudes in decimal degrees
+
+
+def get_wkt_extent(geometry_text):
+    '''
+    Function to return a (min_longitude, min_latitude, max_longitude, max_latitude) tuple from the coordinate text
+    of a WKT geometry of any type, e.g. "((147 -18, 148 -18, 148 -19, 147 -18))", taking the first two ordinates
+    of each position as longitude and latitude. Returns None if there are no positions
+    '''
+    ordinates = [float(ordinate) for ordinate in NUMBER_REGEX.findall(geometry_text)]
+
+    # All positions of a geometry have the same number of ordinates, e.g. three for POINT Z
+    position_end = geometry_text.find(',')
+    dimension = len(NUMBER_REGEX.findall(geometry_text[:position_end])) if position_end >= 0 else len(ordinates)
+    if dimension < 2:
+        return None
+
+    longitudes = ordinates[0::dimension]
+    latitudes = ordinates[1::dimension]
+    return (min(longitudes), min(latitudes), max(longitudes), max(latitudes))
+
+
+def get_number(text):
+    '''
+    Function to return the number at the start of a text value, e.g. "147.5" or "147.5 degrees"
+    Raises ValueError if the text does not start with a number
+    '''
+    try:
+        return float(text)
+    except ValueError:
+        number_match = NUMBER_REGEX.match(text)
+        if not number_match:
+            raise
+        return float(number_match.group())
+
+
+def get_dcmi_extent(coverage):
+    '''
+    Function to return a (min_longitude, min_latitude, max_longitude, max_latitude) tuple from a DCMI Point or
+    DCMI Box encoded coverage, e.g. "northlimit=-18; southlimit=-19; westlimit=147; eastlimit=148", or None if
+    the coverage has neither all Point nor all Box components.
+    A Box whose westlimit is east of its eastlimit crosses the antimeridian, so it is given the full range of longitudes
+    '''
+    components = {}
+    for component in coverage.split(';'):
+        name, separator, value = component.partition('=')
+        if separator:
+            components[name.strip().lower()] = value.strip()
+
+    try:
+        if all(name in components for name in DCMI_BOX_NAMES):
+            west, south, east, north = [get_number(components[name]) for name in DCMI_BOX_NAMES]
+            if west > east:
+                west, east = LONGITUDE_RANGE
+            return (west, min(south, north), east, max(south, north))
+
+        if all(name in components for name in DCMI_POINT_NAMES):
+            east, north = [get_number(components[name]) for name in DCMI_POINT_NAMES]
+            return (east, north, east, north)
+    except ValueError:
+        return None
+
+
+def parse_coverage(coverage):
+    '''
+    Function to return a (min_longitude, min_latitude, max_longitude, max_latitude) tuple of WGS84 decimal degrees
+    bounding a Dublin Core coverage given as a WKT geometry, a DCMI Point or a DCMI Box.
+    Returns None if the coverage cannot be parsed or lies outside the valid range of longitudes and latitudes,
+    e.g. because it has projected coordinates
+    '''
+    if not coverage:
+        return None
+
+    wkt_match = WKT_REGEX.match(coverage)
+    if wkt_match:
+        extent = get_wkt_extent(wkt_match.group(2))
+    elif '=' in coverage:
+        extent = get_dcmi_extent(coverage)
+    else:
+        extent = None
+
+    if (extent is None
+        or extent[0] < LONGITUDE_RANGE[0] or extent[2] > LONGITUDE_RANGE[1]
+        or extent[1] < LATITUDE_RANGE[0] or extent[3] > LATITUDE_RANGE[1]):
+        return None
+
+    return extent
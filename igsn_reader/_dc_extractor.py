@@ -0,0 +1,222 @@
+import logging
+from datetime import datetime, timezone
+from lxml import etree
+
+from ._igsn_reader import settings, OAI_NAMESPACE, UTC_DATESTAMP_FORMAT, EXTENT_COLUMNS, get_distinct_values
+from ._coverage_parser import parse_coverage
+
+OAI_DC_NAMESPACE = 'http://www.openarchives.org/OAI/2.0/oai_dc/'
+DC_NAMESPACE = 'http://purl.org/dc/elements/1.1/'
+
+NAMESPACES = {'oai': OAI_NAMESPACE,
+              'oai_dc': OAI_DC_NAMESPACE,
+              'dc': DC_NAMESPACE,
+              }
+
+# XPath to Dublin Core element relative to record element for each endpoint profile
+PROFILE_DC_XPATHS = {
+    'oai_dc': 'oai:metadata/oai_dc:dc', # CSIRO, ARDC
+    'bare': 'oai:metadata', # GA
+    }
+
+DELETED_STATUS = 'deleted' # status attribute of the header of a record which has been deleted
+
+# Dublin Core attributes stored as single values. Only the first value is kept, even for DC_MULTI_ATTRIBUTES
+DC_ATTRIBUTES = [
+    'title',
+    'subject',
+    'description',
+    'date',
+    'type',
+    'format',
+    'coverage',
+    'creator',
+    'publisher',
+    'rights',
+    ]
+
+# Multi-valued Dublin Core attributes, with the distinct values of each kept in a list under its SAMPLE_VALUE_TABLES key
+DC_MULTI_ATTRIBUTES = {
+    'identifier': 'identifiers',
+    'relation': 'relations',
+    'subject': 'subjects',
+    'creator': 'creators',
+    }
+
+EXTENT_KEYS = [column.lower() for column in EXTENT_COLUMNS] # Keys of numeric extent parsed from coverage
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+
+class DublinCoreExtractor(object):
+    '''
+    Reusable extractor for Dublin Core records in OAI-PMH ListRecords responses.
+    XPath expressions are compiled once per instance and match elements by namespace URI rather than prefix,
+    so responses using a prefixed OAI-PMH namespace (e.g. CSIRO ns3:) can be read without rewriting the text.
+    All Dublin Core attributes are read in a single pass over the children of the Dublin Core element.
+    N.B: The detected profile is held by the instance, so one instance should be used per endpoint.
+    '''
+
+    def __init__(self, profile=None):
+        '''
+        DublinCoreExtractor class Constructor
+        profile may be one of the keys of PROFILE_DC_XPATHS, or None to detect the profile from the first record read
+        '''
+        assert profile is None or profile in PROFILE_DC_XPATHS, 'Unknown Dublin Core profile "{}"'.format(profile)
+        self.profile = profile
+
+        self._list_records_xpath = etree.XPath('/oai:OAI-PMH/oai:ListRecords', namespaces=NAMESPACES)
+        self._list_identifiers_xpath = etree.XPath('/oai:OAI-PMH/oai:ListIdentifiers', namespaces=NAMESPACES)
+        self._record_xpath = etree.XPath('oai:record', namespaces=NAMESPACES)
+        self._resumption_token_xpath = etree.XPath('oai:resumptionToken', namespaces=NAMESPACES)
+        self._header_xpath = etree.XPath('oai:header', namespaces=NAMESPACES)
+        self._dc_xpaths = {profile_name: etree.XPath(dc_xpath, namespaces=NAMESPACES)
+                           for profile_name, dc_xpath in PROFILE_DC_XPATHS.items()
+                           }
+
+        self._identifier_tag = '{{{}}}identifier'.format(OAI_NAMESPACE)
+        self._datestamp_tag = '{{{}}}datestamp'.format(OAI_NAMESPACE)
+
+        # Lookup from Dublin Core element tag to (single-valued key, multi-valued key), either of which may be None
+        self._dc_tags = {'{{{}}}{}'.format(DC_NAMESPACE, dc_attribute): (dc_attribute if dc_attribute in DC_ATTRIBUTES else None,
+                                                                         DC_MULTI_ATTRIBUTES.get(dc_attribute))
+                         for dc_attribute in DC_ATTRIBUTES + list(DC_MULTI_ATTRIBUTES.keys())
+                         }
+
+    def get_list_records_element(self, response_tree):
+        '''
+        Function to return the ListRecords element from a parsed OAI-PMH response, or None if not found
+        '''
+        list_records_elements = self._list_records_xpath(response_tree)
+        if list_records_elements:
+            return list_records_elements[0]
+
+    def get_list_identifiers_element(self, response_tree):
+        '''
+        Function to return the ListIdentifiers element from a parsed OAI-PMH response, or None if not found
+        '''
+        list_identifiers_elements = self._list_identifiers_xpath(response_tree)
+        if list_identifiers_elements:
+            return list_identifiers_elements[0]
+
+    def get_headers(self, list_identifiers_element):
+        '''
+        Function to return list of header elements from a ListIdentifiers element
+        '''
+        return self._header_xpath(list_identifiers_element)
+
+    def read_header(self, header_element):
+        '''
+        Function to return an (identifier, datestamp, deleted) tuple from a header element,
+        where deleted is True if the header has a deleted status
+        '''
+        identifier = None
+        datestamp = None
+        for child_element in header_element:
+            if child_element.tag == self._identifier_tag:
+                identifier = child_element.text
+            elif child_element.tag == self._datestamp_tag:
+                datestamp = child_element.text
+        return identifier, datestamp, header_element.get('status') == DELETED_STATUS
+
+    def get_records(self, list_records_element):
+        '''
+        Function to return list of record elements from a ListRecords element
+        '''
+        return self._record_xpath(list_records_element)
+
+    def read_resumption_token(self, resumption_token_element):
+        '''
+        Function to return a (resumption_token, cursor, complete_list_size) tuple from a resumptionToken element.
+        resumption_token is None for the last page, and cursor and complete_list_size are None if not reported
+        '''
+        if resumption_token_element is None:
+            return (None, None, None)
+
+        cursor = resumption_token_element.get('cursor')
+        complete_list_size = resumption_token_element.get('completeListSize')
+        return ((resumption_token_element.text or '').strip() or None,
+                int(cursor) if cursor else None,
+                int(complete_list_size) if complete_list_size else None)
+
+    def get_resumption_token(self, list_records_element):
+        '''
+        Function to return a (resumption_token, cursor, complete_list_size) tuple from a ListRecords element.
+        resumption_token is None for the last page
+        '''
+        resumption_token_elements = self._resumption_token_xpath(list_records_element)
+        return self.read_resumption_token(resumption_token_elements[0] if resumption_token_elements else None)
+
+    def _get_dc_element(self, record_element):
+        '''
+        Function to return the Dublin Core element for a record, detecting the profile on first use
+        '''
+        if self.profile:
+            dc_elements = self._dc_xpaths[self.profile](record_element)
+            return dc_elements[0] if dc_elements else None
+
+        for profile_name in PROFILE_DC_XPATHS.keys(): # oai_dc must be tried before bare
+            dc_elements = self._dc_xpaths[profile_name](record_element)
+            if dc_elements:
+                self.profile = profile_name
+                logger.debug('Detected Dublin Core profile "{}"'.format(profile_name))
+                return dc_elements[0]
+
+    def extract(self, record_element):
+        '''
+        Function to read header and Dublin Core metadata from a record element and return a dict of
+        all attributes, plus the numeric extent parsed from coverage. Missing attributes are None.
+        Every distinct value of each multi-valued attribute is returned in a list, with the header identifier
+        first in identifiers, and alt_identifiers holds all dc:identifier values joined into a comma-separated string.
+        A record with a deleted header has no metadata, so only identifier, datestamp and deleted are returned,
+        with deleted set to the header datestamp, or the current time if there is none. deleted is None for all other records.
+        Raises ValueError if the record has no identifier or no Dublin Core metadata
+        '''
+        header_elements = self._header_xpath(record_element)
+        identifier, datestamp, deleted = self.read_header(header_elements[0]) if header_elements else (None, None, False)
+        if not identifier:
+            raise ValueError('No identifier found in record header')
+
+        if deleted:
+            return {'identifier': identifier,
+                    'datestamp': datestamp,
+                    'deleted': datestamp or datetime.now(timezone.utc).strftime(UTC_DATESTAMP_FORMAT),
+                    }
+
+        record = {'identifier': identifier,
+                  'datestamp': datestamp,
+                  'deleted': None,
+                  }
+
+        dc_element = self._get_dc_element(record_element)
+        if dc_element is None:
+            raise ValueError('No Dublin Core metadata found for {}'.format(record['identifier']))
+
+        record.update({dc_attribute: None for dc_attribute in DC_ATTRIBUTES})
+        multi_values = {key: [] for key in DC_MULTI_ATTRIBUTES.values()}
+
+        # Read all Dublin Core attributes in one pass
+        for child_element in dc_element:
+            dc_tag = self._dc_tags.get(child_element.tag)
+            if dc_tag is None:
+                continue
+
+            key, multi_key = dc_tag
+            if multi_key is not None and child_element.text is not None:
+                multi_values[multi_key].append(child_element.text)
+            if key is not None and record[key] is None:
+                record[key] = child_element.text
+
+        record['alt_identifiers'] = ', '.join(multi_values['identifiers'])
+        multi_values['identifiers'].insert(0, identifier)
+        record.update({key: get_distinct_values(values) for key, values in multi_values.items()})
+
+        record.update(zip(EXTENT_KEYS, parse_coverage(record['coverage']) or [None] * len(EXTENT_KEYS)))
+
+        return record
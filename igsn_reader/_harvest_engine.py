@@ -0,0 +1,514 @@
+import logging
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from ._igsn_reader import settings, REPORT_INCREMENT, DEFAULT_BATCH_SIZE, DAY_GRANULARITY, DEBUG_MAX_SAMPLES
+
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4 # Maximum number of OAI-PMH requests in flight across all endpoints
+DEFAULT_PAGE_QUEUE_SIZE = 2 # Maximum number of parsed pages waiting for extraction per endpoint
+DEFAULT_WRITE_QUEUE_SIZE = 8 # Maximum number of batches waiting for the database writer
+DEFAULT_METRICS_INTERVAL = 60 # Seconds between metrics exports during a harvest
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+
+class HarvestEngine(object):
+    '''
+    Asyncio engine to page through multiple OAI-PMH endpoints concurrently.
+    Each endpoint is harvested as a pipeline of fetch and extraction stages connected by bounded queues.
+    HTTP requests and XML parsing run in worker threads with a global cap on in-flight requests,
+    while all database calls are made in turn by a single database thread, fed by a single writer coroutine,
+    so that the event loop keeps fetching and extracting pages during writes and the database connection
+    is never used by two threads at once.
+    '''
+
+    def __init__(self,
+                 igsn_reader,
+                 batch_size=None,
+                 max_concurrent_requests=None,
+                 page_queue_size=None,
+                 write_queue_size=None,
+                 streaming_parse=None,
+                 incremental=None,
+                 bulk_load=None,
+                 skip_unchanged=None,
+                 remove_deleted=None
+                 ):
+        '''
+        HarvestEngine class Constructor
+        '''
+        self.igsn_reader = igsn_reader
+        self.batch_size = batch_size or settings.get('batch_size') or DEFAULT_BATCH_SIZE
+        self.max_concurrent_requests = (max_concurrent_requests
+                                        or settings.get('max_concurrent_requests')
+                                        or DEFAULT_MAX_CONCURRENT_REQUESTS)
+        self.page_queue_size = page_queue_size or settings.get('page_queue_size') or DEFAULT_PAGE_QUEUE_SIZE
+        self.write_queue_size = write_queue_size or settings.get('write_queue_size') or DEFAULT_WRITE_QUEUE_SIZE
+        self.streaming_parse = streaming_parse if streaming_parse is not None else bool(settings.get('streaming_parse'))
+        self.incremental = incremental if incremental is not None else bool(settings.get('incremental'))
+        self.bulk_load = bulk_load if bulk_load is not None else bool(settings.get('bulk_load'))
+        self.skip_unchanged = skip_unchanged if skip_unchanged is not None else bool(settings.get('skip_unchanged'))
+        self.remove_deleted = remove_deleted if remove_deleted is not None else bool(settings.get('remove_deleted'))
+        self.metrics_format = settings.get('metrics_format')
+        self.metrics_path = settings.get('metrics_path')
+        self.metrics_interval = settings.get('metrics_interval') or DEFAULT_METRICS_INTERVAL
+        self.resume = False
+        self.from_datestamp = None
+        self.until_datestamp = None
+
+        self._sample_counts = {}
+        self._written_counts = {}
+        self._skipped_counts = {}
+        self._deleted_counts = {}
+        self._oaipmh_keys = {} # OAI-PMH keys of harvested endpoints keyed by oaipmh_id
+        self._content_hashes = {} # Dicts of stored content hashes keyed by identifier, keyed by oaipmh_id
+        self._write_failures = {} # First exception raised writing a batch for each endpoint keyed by oaipmh_id
+
+    def harvest(self, endpoints, resumption_token=None, resume=False, from_datestamp=None, until_datestamp=None):
+        '''
+        Function to harvest a list of (oaipmh_id, oaipmh_key, oaipmh_url) endpoints concurrently.
+        If resume is True, each endpoint carries on from its stored harvest checkpoint.
+        from_datestamp and until_datestamp optionally restrict the harvest to an inclusive datestamp window,
+        in which case no checkpoints are stored because a window does not cover the whole endpoint.
+        If bulk_load is True, the reader's connection is switched to bulk writes for the duration of the harvest.
+        If skip_unchanged is True, the content hashes of each endpoint's stored samples are loaded first,
+        so that records whose content has not changed are skipped without being written and changed records
+        are updated in place.
+        Stored samples whose records are returned with deleted headers are marked as deleted, or removed if
+        remove_deleted is True.
+        If any batch for an endpoint cannot be written, no later batches or checkpoints are written for it and its
+        harvest fails, so that a resumed harvest carries on from before the lost batch.
+        Returns dict of (sample_count, written_count) tuples keyed by OAI-PMH key
+        '''
+        self.resume = resume
+        self.from_datestamp = from_datestamp
+        self.until_datestamp = until_datestamp
+        self._oaipmh_keys = {oaipmh_id: oaipmh_key for oaipmh_id, oaipmh_key, _oaipmh_url in endpoints}
+        self._write_failures = {}
+
+        # Bulk writes may keep a connection and session state for the thread which starts them, so every database call
+        # of the harvest is made in the same thread
+        self._db_executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            if self.skip_unchanged:
+                self._content_hashes = {oaipmh_id: self._db_executor.submit(self.igsn_reader._get_content_hashes,
+                                                                            oaipmh_id).result()
+                                        for oaipmh_id, _oaipmh_key, _oaipmh_url in endpoints}
+
+            if self.bulk_load:
+                self._db_executor.submit(self.igsn_reader._start_bulk_writes).result()
+            try:
+                return asyncio.run(self._harvest(endpoints, resumption_token))
+            finally:
+                if self.bulk_load:
+                    self._db_executor.submit(self.igsn_reader._stop_bulk_writes).result()
+        finally:
+            self._db_executor.shutdown()
+
+    async def _harvest(self, endpoints, resumption_token):
+        '''
+        Coroutine to harvest all endpoints concurrently through a single database writer
+        '''
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_requests + len(endpoints))
+        self._request_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self._write_queue = asyncio.Queue(maxsize=self.write_queue_size)
+
+        writer_task = asyncio.create_task(self._write_batches())
+        metrics_task = asyncio.create_task(self._export_metrics()) if self.metrics_format else None
+        try:
+            results = await asyncio.gather(*[self._harvest_endpoint(oaipmh_id, oaipmh_key, oaipmh_url, resumption_token)
+                                             for oaipmh_id, oaipmh_key, oaipmh_url in endpoints
+                                             ],
+                                           return_exceptions=True)
+        finally:
+            await self._write_queue.put(None) # Signal writer to finish once all queued batches are written
+            await writer_task
+            self._executor.shutdown()
+
+            if metrics_task is not None:
+                metrics_task.cancel()
+                self.igsn_reader._metrics.export(self.metrics_format, self.metrics_path)
+
+        # An endpoint whose batches were not all written has failed, even if all of its pages were extracted
+        results = [result if isinstance(result, Exception) else self._write_failures.get(oaipmh_id, result)
+                   for (oaipmh_id, _oaipmh_key, _oaipmh_url), result in zip(endpoints, results)]
+
+        harvest_results = {}
+        for (oaipmh_id, oaipmh_key, oaipmh_url), result in zip(endpoints, results):
+            if isinstance(result, Exception):
+                logger.error('Harvest failed for {}: {}'.format(oaipmh_key, result))
+            harvest_results[oaipmh_key] = (self._sample_counts.get(oaipmh_key, 0),
+                                           self._written_counts.get(oaipmh_key, 0))
+            if self.skip_unchanged:
+                logger.info('{} samples read, {} unchanged samples skipped and {} samples written for {}'.format(harvest_results[oaipmh_key][0],
+                                                                                                                self._skipped_counts.get(oaipmh_key, 0),
+                                                                                                                harvest_results[oaipmh_key][1],
+                                                                                                                oaipmh_key))
+            else:
+                logger.info('{} samples read and {} samples written for {}'.format(harvest_results[oaipmh_key][0],
+                                                                                     harvest_results[oaipmh_key][1],
+                                                                                     oaipmh_key))
+            if self._deleted_counts.get(oaipmh_key):
+                logger.info('{} deleted samples {} for {}'.format(self._deleted_counts[oaipmh_key],
+                                                                  'removed' if self.remove_deleted else 'marked',
+                                                                  oaipmh_key))
+
+        # Re-raise the first failure only after all other endpoints have been harvested
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        return harvest_results
+
+    async def _harvest_endpoint(self, oaipmh_id, oaipmh_key, oaipmh_url, resumption_token=None):
+        '''
+        Coroutine to harvest a single endpoint as a pipeline of fetch and extraction stages connected
+        by a bounded page queue, so that the next page is requested as soon as its resumptionToken is known
+        '''
+        loop = asyncio.get_running_loop()
+
+        if self.resume and not resumption_token:
+            checkpoint = await loop.run_in_executor(self._db_executor, self.igsn_reader._get_harvest_checkpoint, oaipmh_id)
+            if not (checkpoint and checkpoint['resumption_token']):
+                logger.info('No interrupted harvest to resume for {}'.format(oaipmh_key))
+                return
+
+            resumption_token = checkpoint['resumption_token']
+            logger.info('Resuming harvest for {} at record {} of {} from checkpoint at {}'.format(oaipmh_key,
+                                                                                                  checkpoint['cursor'],
+                                                                                                  checkpoint['complete_list_size'],
+                                                                                                  checkpoint['updated']))
+
+        http_params = {'verb': 'ListRecords',
+                       'metadataPrefix': 'oai_dc'}
+
+        if self.from_datestamp:
+            http_params['from'] = self.from_datestamp
+        if self.until_datestamp:
+            http_params['until'] = self.until_datestamp
+
+        if self.incremental and not (resumption_token or self.from_datestamp):
+            from_datestamp = await loop.run_in_executor(self._db_executor, self.igsn_reader._get_latest_datestamp, oaipmh_id)
+            if from_datestamp:
+                async with self._request_semaphore:
+                    granularity = await loop.run_in_executor(self._executor,
+                                                             self.igsn_reader._get_granularity,
+                                                             oaipmh_url)
+                if granularity == DAY_GRANULARITY:
+                    from_datestamp = from_datestamp[:len(DAY_GRANULARITY)]
+
+                http_params['from'] = from_datestamp
+
+        logger.info('Querying records for {}{}{}'.format(oaipmh_key,
+                                                         ' from {}'.format(http_params['from']) if http_params.get('from') else '',
+                                                         ' until {}'.format(http_params['until']) if http_params.get('until') else ''))
+
+        self.igsn_reader._metrics.register_endpoint(oaipmh_id, oaipmh_key)
+
+        page_queue = asyncio.Queue(maxsize=self.page_queue_size)
+        fetch_task = asyncio.create_task(self._fetch_pages(oaipmh_id, oaipmh_key, oaipmh_url, http_params, resumption_token, page_queue))
+        completed = False
+        try:
+            completed = await self._extract_pages(oaipmh_id, oaipmh_key, page_queue)
+        finally:
+            self.igsn_reader._metrics.finish_endpoint(oaipmh_id, completed=completed)
+            if not fetch_task.done():
+                fetch_task.cancel() # Extraction finished early, e.g. debug limit reached
+
+        try:
+            await fetch_task # Re-raise any fetch failure
+        except asyncio.CancelledError:
+            pass
+
+    async def _fetch_pages(self, oaipmh_id, oaipmh_key, oaipmh_url, http_params, resumption_token, page_queue):
+        '''
+        Coroutine for the fetch stage. Requests each page in turn and queues its ListRecords element
+        for extraction with its (resumption_token, cursor, complete_list_size) tuple, finishing with a None sentinel.
+        When streaming, records are extracted while the response is read and lists of sample rows are queued instead
+        '''
+        loop = asyncio.get_running_loop()
+
+        try:
+            first_page = True
+            while first_page or resumption_token:
+                first_page = False
+                logger.debug('%s: resumption_token = %s', oaipmh_key, resumption_token)
+                if resumption_token:
+                    http_params = {'verb': 'ListRecords',
+                                   'resumptionToken': resumption_token}
+
+                if self.streaming_parse:
+                    # The resumptionToken comes after all records, so extraction is part of the streamed request
+                    async with self._request_semaphore:
+                        page_rows, resumption_state = await loop.run_in_executor(self._executor,
+                                                                                 self.igsn_reader._read_page_stream,
+                                                                                 oaipmh_id,
+                                                                                 oaipmh_url,
+                                                                                 http_params)
+                    resumption_token = resumption_state[0]
+                    await page_queue.put((page_rows, resumption_state))
+                    continue
+
+                async with self._request_semaphore:
+                    list_records_element = await loop.run_in_executor(self._executor,
+                                                                      self.igsn_reader._get_list_records_element,
+                                                                      oaipmh_id,
+                                                                      oaipmh_url,
+                                                                      http_params)
+                if list_records_element is None: # noRecordsMatch
+                    await page_queue.put(([], (None, None, None))) # Record completed harvest in checkpoint
+                    break
+
+                resumption_state = self.igsn_reader._get_resumption_token(oaipmh_id, list_records_element)
+                resumption_token = resumption_state[0]
+
+                await page_queue.put((list_records_element, resumption_state))
+        except Exception:
+            await page_queue.put(None) # Let extraction stage finish with the pages already queued
+            raise
+
+        await page_queue.put(None)
+
+    async def _extract_pages(self, oaipmh_id, oaipmh_key, page_queue):
+        '''
+        Coroutine for the extraction stage. Reads Dublin Core records from each queued page and queues
+        batches of new, changed and deleted sample rows for the database writer, each with a checkpoint of the
+        resumptionToken for the page following the last page in the batch. Batches are queued once batch_size records
+        have been read, including any skipped as unchanged, so that checkpoints are still stored when nothing has changed.
+        A page cut short by the debug limit adds no checkpoint, so that a resumed harvest reads its unwritten records.
+        Raises the write failure for the endpoint, if any, so that no more pages are fetched once a batch has been lost.
+        Returns True if the last page of the complete list was extracted
+        '''
+        loop = asyncio.get_running_loop()
+        debug_max_samples = DEBUG_MAX_SAMPLES if settings['debug'] else 0
+
+        metrics = self.igsn_reader._metrics
+
+        sample_count = 0
+        batch_count = 0 # Number of records read since the last batch was queued
+        sample_rows = []
+        changed_rows = []
+        deleted_rows = []
+        checkpoint = None
+        completed = False
+        while True:
+            page = await page_queue.get()
+            if page is None:
+                break
+
+            if oaipmh_id in self._write_failures:
+                raise self._write_failures[oaipmh_id]
+
+            page, (resumption_token, cursor, complete_list_size) = page
+            page_checkpoint = None
+            if not (self.from_datestamp or self.until_datestamp):
+                page_checkpoint = {'oaipmh_id': oaipmh_id,
+                                   'resumption_token': resumption_token,
+                                   'cursor': cursor,
+                                   'complete_list_size': complete_list_size,
+                                   }
+
+            if isinstance(page, list): # Records already extracted by streaming parse
+                page_rows = page
+            else:
+                page_rows = await loop.run_in_executor(self._executor,
+                                                       self.igsn_reader._read_page_records,
+                                                       oaipmh_id,
+                                                       page)
+            del page # Release page before waiting for the next one
+
+            metrics.add('pages', 1, oaipmh_id)
+            metrics.add('records', len(page_rows), oaipmh_id)
+            metrics.set_progress(oaipmh_id,
+                                 cursor + len(page_rows) if cursor is not None else None,
+                                 complete_list_size)
+            completed = resumption_token is None
+
+            # Records with deleted headers have no metadata to write
+            page_deleted_rows = [sample_row for sample_row in page_rows if sample_row['deleted']]
+            if page_deleted_rows:
+                page_rows = [sample_row for sample_row in page_rows if not sample_row['deleted']]
+                self._forget_deleted(oaipmh_id, page_deleted_rows)
+                deleted_rows += page_deleted_rows
+
+            debug_limit_reached = debug_max_samples > 0 and sample_count + len(page_rows) >= debug_max_samples
+            if debug_limit_reached:
+                if sample_count + len(page_rows) > debug_max_samples:
+                    # Records past the limit are not written, so the batch keeps the checkpoint from before this page
+                    page_checkpoint = None
+                page_rows = page_rows[:debug_max_samples - sample_count]
+                logger.debug('Debug limit reached for {}'.format(oaipmh_key))
+
+            if page_checkpoint is not None:
+                checkpoint = page_checkpoint
+
+            if (sample_count + len(page_rows)) // REPORT_INCREMENT > sample_count // REPORT_INCREMENT:
+                logger.info('{} samples read for {}'.format(sample_count + len(page_rows), oaipmh_key))
+
+            sample_count += len(page_rows)
+            batch_count += len(page_rows) + len(page_deleted_rows)
+            self._sample_counts[oaipmh_key] = sample_count
+
+            if self.skip_unchanged:
+                page_rows, page_changed_rows = self._filter_unchanged(oaipmh_id, oaipmh_key, page_rows)
+                changed_rows += page_changed_rows
+            sample_rows += page_rows
+
+            # Only write at page boundaries so that each transaction contains whole pages
+            if batch_count >= self.batch_size:
+                await self._write_queue.put((oaipmh_id, oaipmh_key, sample_rows, changed_rows, deleted_rows, checkpoint))
+                batch_count = 0
+                sample_rows = []
+                changed_rows = []
+                deleted_rows = []
+                checkpoint = None
+
+            if debug_limit_reached:
+                completed = False
+                break
+
+        if sample_rows or changed_rows or deleted_rows or checkpoint:
+            await self._write_queue.put((oaipmh_id, oaipmh_key, sample_rows, changed_rows, deleted_rows, checkpoint))
+
+        return completed
+
+    def _filter_unchanged(self, oaipmh_id, oaipmh_key, page_rows):
+        '''
+        Function to compare the content hash of each sample row with the stored content hash for its identifier.
+        Returns (new_rows, changed_rows) with unchanged rows removed and counted as skipped.
+        Stored hashes are updated as rows are queued, so repeated identical records in one harvest are only written once
+        '''
+        content_hashes = self._content_hashes.setdefault(oaipmh_id, {})
+        new_rows = []
+        changed_rows = []
+        for sample_row in page_rows:
+            content_hash = int(sample_row['content_hash'], 16)
+            if sample_row['identifier'] not in content_hashes:
+                new_rows.append(sample_row)
+            elif content_hashes[sample_row['identifier']] != content_hash:
+                changed_rows.append(sample_row)
+            else:
+                continue
+            content_hashes[sample_row['identifier']] = content_hash
+
+        skipped_count = len(page_rows) - len(new_rows) - len(changed_rows)
+        if skipped_count:
+            self._skipped_counts[oaipmh_key] = self._skipped_counts.get(oaipmh_key, 0) + skipped_count
+            self.igsn_reader._metrics.add('skipped', skipped_count, oaipmh_id)
+        return new_rows, changed_rows
+
+    def _forget_deleted(self, oaipmh_id, deleted_rows):
+        '''
+        Function to clear the stored content hashes for sample rows of deleted records, so that a deleted record
+        harvested again later in the same harvest is written rather than skipped as unchanged
+        '''
+        content_hashes = self._content_hashes.get(oaipmh_id)
+        if content_hashes:
+            for sample_row in deleted_rows:
+                if sample_row['identifier'] in content_hashes:
+                    if self.remove_deleted:
+                        del content_hashes[sample_row['identifier']]
+                    else:
+                        content_hashes[sample_row['identifier']] = None
+
+    def _delete_batch(self, oaipmh_id, deleted_rows):
+        '''
+        Function to mark or remove the stored samples of a batch of records with deleted headers.
+        Called in the database thread. Returns the number of samples deleted
+        '''
+        with self.igsn_reader._metrics.endpoint(oaipmh_id):
+            return self.igsn_reader._delete_sample_batch(oaipmh_id,
+                                                         [(sample_row['identifier'], sample_row['deleted'])
+                                                          for sample_row in deleted_rows],
+                                                         remove=self.remove_deleted)
+
+    def _write_batch(self, oaipmh_id, sample_rows, changed_rows, checkpoint):
+        '''
+        Function to write a batch of new and changed sample rows and store its checkpoint.
+        Called in the database thread. Returns the number of samples written
+        '''
+        with self.igsn_reader._metrics.endpoint(oaipmh_id):
+            # Changed records are always updated in place. The checkpoint is stored with the last write
+            written_count = self.igsn_reader._write_sample_batch(changed_rows, upsert=True)
+            written_count += self.igsn_reader._write_sample_batch(sample_rows,
+                                                                  upsert=self.incremental,
+                                                                  checkpoint=checkpoint)
+        return written_count
+
+    async def _write_batches(self):
+        '''
+        Coroutine for the single database writer. Writes queued batches in the database thread until a None sentinel
+        is received, so that the event loop is not blocked while each batch is written.
+        Once a batch for an endpoint fails, the failure is recorded and all later batches for the endpoint are discarded,
+        so that no checkpoint past the lost records is stored. If the final flush fails, every endpoint has failed
+        '''
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._write_queue.get()
+            if batch is None:
+                break
+
+            oaipmh_id, oaipmh_key, sample_rows, changed_rows, deleted_rows, checkpoint = batch
+            if oaipmh_id in self._write_failures:
+                continue
+
+            logger.debug('Writing batch of %s new, %s changed and %s deleted records for %s',
+                         len(sample_rows), len(changed_rows), len(deleted_rows), oaipmh_key)
+            if deleted_rows:
+                # Deletions are written before the checkpoint so that they are not skipped when resuming
+                try:
+                    deleted_count = await loop.run_in_executor(self._db_executor, self._delete_batch, oaipmh_id, deleted_rows)
+                    self._deleted_counts[oaipmh_key] = self._deleted_counts.get(oaipmh_key, 0) + deleted_count
+                    self.igsn_reader._metrics.add('deleted', deleted_count, oaipmh_id)
+                except Exception as e:
+                    logger.error('Deleting {} samples failed for {}: {}'.format(len(deleted_rows), oaipmh_key, e))
+                    self._write_failures[oaipmh_id] = e
+                    continue
+
+            try:
+                written_count = await loop.run_in_executor(self._db_executor,
+                                                           self._write_batch,
+                                                           oaipmh_id,
+                                                           sample_rows,
+                                                           changed_rows,
+                                                           checkpoint)
+            except Exception as e:
+                logger.error('Batch write failed for {}: {}'.format(oaipmh_key, e))
+                self._write_failures[oaipmh_id] = e
+                continue
+
+            self._written_counts[oaipmh_key] = self._written_counts.get(oaipmh_key, 0) + written_count
+            self.igsn_reader._metrics.add('written', written_count, oaipmh_id)
+
+        try:
+            flushed_counts = await loop.run_in_executor(self._db_executor, self.igsn_reader._flush_samples)
+        except Exception as e:
+            logger.error('Final write of buffered samples failed: {}'.format(e))
+            for oaipmh_id in self._oaipmh_keys.keys():
+                self._write_failures.setdefault(oaipmh_id, e)
+            return
+
+        # Records merged or written only once the harvest has finished are counted here
+        for oaipmh_id, written_count in flushed_counts.items():
+            oaipmh_key = self._oaipmh_keys.get(oaipmh_id)
+            if oaipmh_key is not None:
+                self._written_counts[oaipmh_key] = self._written_counts.get(oaipmh_key, 0) + written_count
+                self.igsn_reader._metrics.add('written', written_count, oaipmh_id)
+
+    async def _export_metrics(self):
+        '''
+        Coroutine to export harvest metrics every metrics_interval seconds until cancelled
+        '''
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            try:
+                self.igsn_reader._metrics.export(self.metrics_format, self.metrics_path)
+            except Exception as e:
+                logger.warning('Metrics export failed: {}'.format(e))
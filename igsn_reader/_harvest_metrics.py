@@ -0,0 +1,234 @@
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+from ._igsn_reader import settings
+
+# Harvest stages timed for each endpoint, in pipeline order
+STAGES = [
+    'http_wait', # Waiting for response headers, including rate limiting and retry backoff
+    'decode', # Receiving and decompressing the response body
+    'parse', # Parsing XML
+    'extract', # Extracting Dublin Core records
+    'db_write', # Executing insert statements
+    'db_commit', # Committing transactions
+    ]
+
+# Counters kept for each endpoint
+COUNTERS = [
+    'pages', # ListRecords pages received
+    'bytes', # Decompressed response bytes received
+    'records', # Records extracted
+    'skipped', # Records skipped because their content had not changed
+    'written', # Records written to the database
+    'deleted', # Stored samples marked or removed as deleted
+    ]
+
+METRICS_FORMATS = ['json', 'prometheus'] # Supported metrics export formats
+PROMETHEUS_PREFIX = 'igsn_harvest' # Prefix for exported Prometheus metric names
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+
+class HarvestMetrics(object):
+    '''
+    Thread-safe per-endpoint harvest metrics, with cumulative seconds for each of STAGES and totals for each of COUNTERS.
+    Metrics are attributed to the endpoint set for the current thread with endpoint(), so that code timing
+    a stage does not need to know which endpoint it is working on.
+    Throughput and ETA are estimated from the cursor and completeListSize of the latest resumptionToken.
+    '''
+
+    def __init__(self):
+        '''
+        HarvestMetrics class Constructor
+        '''
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+        self._endpoint_keys = {} # OAI-PMH keys keyed by oaipmh_id
+        self._endpoint_metrics = {} # Dicts of metrics keyed by oaipmh_id
+
+    def register_endpoint(self, oaipmh_id, oaipmh_key):
+        '''
+        Function to (re)start metrics for an endpoint
+        '''
+        with self._lock:
+            self._endpoint_keys[oaipmh_id] = oaipmh_key
+            endpoint_metrics = {stage: 0.0 for stage in STAGES}
+            endpoint_metrics.update({counter: 0 for counter in COUNTERS})
+            endpoint_metrics.update({'cursor': None,
+                                     'complete_list_size': None,
+                                     'start_time': timer(),
+                                     'finish_time': None,
+                                     })
+            self._endpoint_metrics[oaipmh_id] = endpoint_metrics
+
+    def finish_endpoint(self, oaipmh_id, completed=False):
+        '''
+        Function to mark the harvest of an endpoint as finished so that its throughput is no longer updated.
+        If completed is True, the whole of any known complete list is counted as returned
+        '''
+        with self._lock:
+            endpoint_metrics = self._endpoint_metrics.get(oaipmh_id)
+            if endpoint_metrics is not None:
+                endpoint_metrics['finish_time'] = timer()
+                if completed and endpoint_metrics['complete_list_size'] is not None:
+                    endpoint_metrics['cursor'] = endpoint_metrics['complete_list_size']
+
+    @contextmanager
+    def endpoint(self, oaipmh_id):
+        '''
+        Context manager to attribute metrics added in the current thread to an endpoint
+        '''
+        previous_oaipmh_id = getattr(self._thread_local, 'oaipmh_id', None)
+        self._thread_local.oaipmh_id = oaipmh_id
+        try:
+            yield
+        finally:
+            self._thread_local.oaipmh_id = previous_oaipmh_id
+
+    def add(self, name, value, oaipmh_id=None):
+        '''
+        Function to add a value to a stage or counter for an endpoint, defaulting to the current thread's endpoint.
+        Values for unregistered endpoints are ignored
+        '''
+        oaipmh_id = oaipmh_id if oaipmh_id is not None else getattr(self._thread_local, 'oaipmh_id', None)
+        with self._lock:
+            endpoint_metrics = self._endpoint_metrics.get(oaipmh_id)
+            if endpoint_metrics is not None:
+                endpoint_metrics[name] += value
+
+    @contextmanager
+    def timer(self, stage):
+        '''
+        Context manager to add the elapsed time of its body to a stage for the current thread's endpoint
+        '''
+        start_time = timer()
+        try:
+            yield
+        finally:
+            self.add(stage, timer() - start_time)
+
+    def set_progress(self, oaipmh_id, cursor, complete_list_size):
+        '''
+        Function to record the number of records in the complete list returned so far and the complete list size
+        '''
+        with self._lock:
+            endpoint_metrics = self._endpoint_metrics.get(oaipmh_id)
+            if endpoint_metrics is not None:
+                if cursor is not None:
+                    endpoint_metrics['cursor'] = cursor
+                if complete_list_size is not None:
+                    endpoint_metrics['complete_list_size'] = complete_list_size
+
+    def get_summary(self):
+        '''
+        Function to return dict of metrics dicts keyed by OAI-PMH key, each with stage seconds, counters,
+        elapsed seconds, records_per_sec and, where completeListSize is known, progress and eta_seconds
+        '''
+        now = timer()
+        summary = {}
+        with self._lock:
+            for oaipmh_id, endpoint_metrics in self._endpoint_metrics.items():
+                elapsed_seconds = (endpoint_metrics['finish_time'] or now) - endpoint_metrics['start_time']
+                records_per_sec = endpoint_metrics['records'] / elapsed_seconds if elapsed_seconds > 0 else 0.0
+
+                endpoint_summary = {'endpoint': self._endpoint_keys[oaipmh_id],
+                                    'elapsed_seconds': round(elapsed_seconds, 3),
+                                    'records_per_sec': round(records_per_sec, 1),
+                                    'stage_seconds': {stage: round(endpoint_metrics[stage], 3) for stage in STAGES},
+                                    }
+                endpoint_summary.update({counter: endpoint_metrics[counter] for counter in COUNTERS})
+
+                complete_list_size = endpoint_metrics['complete_list_size']
+                cursor = endpoint_metrics['cursor']
+                if complete_list_size and cursor is not None:
+                    remaining_records = max(complete_list_size - cursor, 0)
+                    endpoint_summary.update({'cursor': cursor,
+                                             'complete_list_size': complete_list_size,
+                                             'progress': round(min(cursor / complete_list_size, 1.0), 4),
+                                             'eta_seconds': (0.0 if not remaining_records
+                                                             else None if endpoint_metrics['finish_time'] or not records_per_sec
+                                                             else round(remaining_records / records_per_sec, 1)),
+                                             })
+
+                summary[self._endpoint_keys[oaipmh_id]] = endpoint_summary
+        return summary
+
+    def log_json(self):
+        '''
+        Function to log the metrics for each endpoint as a single-line JSON object
+        '''
+        for endpoint_summary in self.get_summary().values():
+            logger.info(json.dumps(endpoint_summary, sort_keys=True))
+
+    def get_prometheus_text(self):
+        '''
+        Function to return the metrics for all endpoints in Prometheus text exposition format
+        '''
+        summary = self.get_summary()
+
+        metric_definitions = [('stage_seconds_total', 'counter', 'Cumulative seconds spent in each harvest stage'),
+                              ('pages_total', 'counter', 'ListRecords pages received'),
+                              ('bytes_total', 'counter', 'Decompressed response bytes received'),
+                              ('records_total', 'counter', 'Records extracted'),
+                              ('skipped_total', 'counter', 'Records skipped because their content had not changed'),
+                              ('written_total', 'counter', 'Records written to the database'),
+                              ('deleted_total', 'counter', 'Stored samples marked or removed as deleted'),
+                              ('records_per_second', 'gauge', 'Records extracted per second of harvest time'),
+                              ('cursor', 'gauge', 'Records in the complete list returned so far'),
+                              ('complete_list_size', 'gauge', 'Size of the complete list reported by the endpoint'),
+                              ('eta_seconds', 'gauge', 'Estimated seconds until the harvest completes'),
+                              ]
+
+        lines = []
+        for metric_name, metric_type, metric_help in metric_definitions:
+            full_name = '{}_{}'.format(PROMETHEUS_PREFIX, metric_name)
+            lines.append('# HELP {} {}'.format(full_name, metric_help))
+            lines.append('# TYPE {} {}'.format(full_name, metric_type))
+
+            for oaipmh_key, endpoint_summary in summary.items():
+                if metric_name == 'stage_seconds_total':
+                    for stage in STAGES:
+                        lines.append('{}{{endpoint="{}",stage="{}"}} {}'.format(full_name,
+                                                                              oaipmh_key,
+                                                                              stage,
+                                                                              endpoint_summary['stage_seconds'][stage]))
+                    continue
+
+                summary_key = {'records_per_second': 'records_per_sec'}.get(metric_name,
+                                                                           metric_name.replace('_total', ''))
+                value = endpoint_summary.get(summary_key)
+                if value is not None:
+                    lines.append('{}{{endpoint="{}"}} {}'.format(full_name, oaipmh_key, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, metrics_path):
+        '''
+        Function to atomically write the metrics for all endpoints to a Prometheus textfile,
+        e.g. for the node_exporter textfile collector
+        '''
+        temp_path = '{}.{}.tmp'.format(metrics_path, os.getpid())
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write(self.get_prometheus_text())
+        os.replace(temp_path, metrics_path)
+
+    def export(self, metrics_format, metrics_path=None):
+        '''
+        Function to export the metrics for all endpoints in one of METRICS_FORMATS
+        '''
+        assert metrics_format in METRICS_FORMATS, 'Unknown metrics format "{}"'.format(metrics_format)
+        if metrics_format == 'json':
+            self.log_json()
+        else:
+            assert metrics_path, 'A metrics_path must be specified for Prometheus metrics'
+            self.write_prometheus(metrics_path)
@@ -1,22 +1,77 @@
 import yaml
 import os
-import sys
-import logging
-import sqlite3
 import re
-import requests
-from lxml import etree
-from time import sleep
+import json
+import hashlib
+import logging
 import abc
+from datetime import datetime, timezone
+from timeit import default_timer as timer
 
 DEBUG_MAX_SAMPLES = 2500 # Number of samples to store before finishing while in debug mode
 REPORT_INCREMENT = 1000 # Number of records to insert before reporting progress
-MAX_RETRIES = 2 # Maximum number of times to retry request
-RETRY_SLEEP = 2 # Seconds to sleep before retrying request
+DEFAULT_BATCH_SIZE = 1000 # Minimum number of records to buffer before writing a batch to the database
+STREAM_CHUNK_SIZE = 65536 # Number of bytes to read from HTTP response at a time when streaming
+DEFAULT_SEARCH_LIMIT = 20 # Default maximum number of samples returned by a full-text search
+CONTENT_HASH_SIZE = 8 # Number of bytes in the digest of each sample's harvested content
+DEFAULT_MAX_MISSING_FRACTION = 0.5 # Maximum fraction of an endpoint's stored samples a reconciliation may mark as deleted
+IDENTIFIER_CHUNK_SIZE = 500 # Maximum number of identifiers looked up with each query
+DEFAULT_RELATION_DEPTH = 1 # Default number of relations away from the start sample traversed by get_relations
+
+OAI_NAMESPACE = 'http://www.openarchives.org/OAI/2.0/'
+# Numeric bounding box columns of SAMPLE table parsed from COVERAGE, in (west, south, east, north) order
+EXTENT_COLUMNS = [
+    'MIN_LONGITUDE',
+    'MIN_LATITUDE',
+    'MAX_LONGITUDE',
+    'MAX_LATITUDE',
+    ]
+# Columns of SAMPLE table written by harvest, in order. Parameter names are lower case column names.
+SAMPLE_COLUMNS = [
+    'OAIPMH_ID',
+    'IDENTIFIER',
+    'DATESTAMP',
+    'ALT_IDENTIFIERS',
+    'TITLE',
+    'SUBJECT',
+    'DESCRIPTION',
+    'TYPE',
+    'FORMAT',
+    'COVERAGE',
+    ] + EXTENT_COLUMNS + [
+    'CREATOR',
+    'PUBLISHER',
+    'RIGHTS',
+    'CONTENT_HASH',
+    'DELETED',
+    ]
+# Tables holding every distinct value of a multi-valued element of each sample, in document order,
+# keyed by the sample row key of the list of values. SAMPLE_IDENTIFIER also holds the OAI-PMH identifier of each sample,
+# so that a sample can be found by any of its identifiers with one index
+SAMPLE_VALUE_TABLES = {
+    'identifiers': 'SAMPLE_IDENTIFIER',
+    'relations': 'SAMPLE_RELATION',
+    'subjects': 'SAMPLE_SUBJECT',
+    'creators': 'SAMPLE_CREATOR',
+    }
+# Sample row keys whose values are covered by CONTENT_HASH, in order. Extents are derived from COVERAGE, so are not hashed
+CONTENT_HASH_KEYS = [column.lower() for column in SAMPLE_COLUMNS 
+                     if column not in ['OAIPMH_ID', 'CONTENT_HASH', 'DELETED'] + EXTENT_COLUMNS] + list(SAMPLE_VALUE_TABLES.keys())
+# Columns of HARVEST_STATE table written with each batch, in order. Parameter names are lower case column names.
+HARVEST_STATE_COLUMNS = [
+    'OAIPMH_ID',
+    'RESUMPTION_TOKEN',
+    'CURSOR',
+    'COMPLETE_LIST_SIZE',
+    ]
+
+NO_RECORDS_MATCH = 'noRecordsMatch' # OAI-PMH error code returned when a request selects no records
+UTC_DATESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ' # OAI-PMH UTC datestamp format at seconds granularity
+DAY_GRANULARITY = 'YYYY-MM-DD' # OAI-PMH datestamp granularity for endpoints without time support
 
 logger = logging.getLogger(__name__)
 
-settings = yaml.safe_load(open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 
+settings = yaml.safe_load(open(os.path.join(os.path.dirname(os.path.realpath(__file__)),
                                                  'igsn_reader_config.yml')))
 if settings['debug']:
     logger.setLevel(logging.DEBUG)
@@ -25,17 +80,1109 @@ else:
 logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
 
 
+def get_content_hash(sample_row):
+    '''
+    Function to return a hex digest of the harvested content of a sample row, including its datestamp,
+    so that a record which has not changed since it was stored can be recognised without comparing every column
+    '''
+    return hashlib.blake2b(json.dumps([sample_row.get(key) for key in CONTENT_HASH_KEYS], ensure_ascii=False).encode('utf-8'),
+                           digest_size=CONTENT_HASH_SIZE).hexdigest()
+
+
+def get_distinct_values(values):
+    '''
+    Function to return a list of the distinct non-empty values in a list of text values, stripped of whitespace, in order
+    '''
+    stripped_values = (value.strip() for value in values if value)
+    return list(dict.fromkeys(value for value in stripped_values if value))
+
+
+def get_stored_values(identifier, alt_identifiers, subject, creator):
+    '''
+    Function to return dict of lists of values keyed by SAMPLE_VALUE_TABLES key recovered from the columns of a sample
+    stored before its multi-valued elements were kept, which hold only the first subject and creator and no relations
+    '''
+    return {'identifiers': get_distinct_values([identifier] + (alt_identifiers or '').split(', ')),
+            'relations': [],
+            'subjects': get_distinct_values([subject]),
+            'creators': get_distinct_values([creator]),
+            }
+
+
+def get_sample_values(sample_rows, stored_samples):
+    '''
+    Function to return the values of the sample rows which were stored, given a dict of (sample_id, content_hash) tuples
+    of stored samples keyed by identifier, as (sample_ids, sample_values) where sample_ids is a list of the sample_id
+    of each sample stored from a row and sample_values is a dict of lists of (sample_id, ordinal, value) tuples keyed by
+    SAMPLE_VALUE_TABLES key. Only the first sample row of each identifier with the stored content hash is used,
+    so that the values of the version of a sample which was stored are returned once, however many versions were written
+    '''
+    stored_samples = dict(stored_samples)
+    sample_ids = []
+    sample_values = {value_key: [] for value_key in SAMPLE_VALUE_TABLES.keys()}
+    for sample_row in sample_rows:
+        sample_id, content_hash = stored_samples.get(sample_row['identifier'], (None, None))
+        if sample_id is None or content_hash != sample_row.get('content_hash'):
+            continue
+
+        del stored_samples[sample_row['identifier']]
+        sample_ids.append(sample_id)
+        for value_key, value_rows in sample_values.items():
+            value_rows.extend((sample_id, ordinal, value) for ordinal, value in enumerate(sample_row.get(value_key) or [], 1))
+    return sample_ids, sample_values
+
+
+def get_until_datestamp(until_datestamp):
+    '''
+    Function to return an inclusive until datestamp covering the whole of the last day when until_datestamp
+    has day granularity, so that it can be compared with full OAI-PMH UTC datestamps
+    '''
+    if until_datestamp and len(until_datestamp) == len(DAY_GRANULARITY):
+        return until_datestamp + 'T23:59:59Z'
+    return until_datestamp
+
+
 class IGSNReader(object):
-    
+
     def __init__(self):
         '''
         Constructor for IGSNReader class
         '''
+        from ._harvest_metrics import HarvestMetrics
+
+        self._dc_extractors = {} # DublinCoreExtractor objects keyed by oaipmh_id
+        self._metrics = HarvestMetrics()
+        self._oaipmh_client = None # OAIPMHClient, created on first use
+
+    @property
+    def _http_client(self):
+        '''
+        OAIPMHClient shared by all requests, created on first use so that readers which only query the database
+        do not load the HTTP stack
+        '''
+        if self._oaipmh_client is None:
+            from ._oaipmh_client import OAIPMHClient
+            from ._page_cache import PageCache
+
+            # Rate limits are configured by OAI-PMH key but applied by endpoint URL
+            rate_limits = settings.get('rate_limits') or {}
+            self._oaipmh_client = OAIPMHClient(rate_limits={oaipmh_url: rate_limits[oaipmh_key]
+                                                            for oaipmh_key, oaipmh_url in settings['oai_pmh_endpoints'].items()
+                                                            if rate_limits.get(oaipmh_key)
+                                                            },
+                                               page_cache=PageCache() if settings.get('page_cache_dir') else None,
+                                               metrics=self._metrics)
+        return self._oaipmh_client
+
+    def close(self):
+        '''
+        Function to release anything held by the reader, e.g. a database connection or buffered samples
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _get_oaipmh_endpoints(self):
+        '''
+        Function to return list of (oaipmh_id, oaipmh_key, oaipmh_url) tuples for all known OAI-PMH endpoints
+        '''
         pass
-                
+
     @abc.abstractmethod
-    def read_igsns(self, oaipmh_source_list=None):
+    def _get_latest_datestamp(self, oaipmh_id):
+        '''
+        Function to return the latest stored DATESTAMP for an endpoint as an OAI-PMH UTC datestamp string,
+        or None if no samples have been stored
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _get_sample_count(self, oaipmh_id):
+        '''
+        Function to return the number of samples stored for an endpoint
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _get_reader_kwargs(self):
+        '''
+        Function to return dict of constructor keyword arguments to create an equivalent reader,
+        e.g. in a worker process
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _get_harvest_checkpoint(self, oaipmh_id):
+        '''
+        Function to return the stored harvest checkpoint for an endpoint as a dict with keys oaipmh_id,
+        resumption_token, cursor, complete_list_size and updated, or None if no checkpoint has been stored.
+        resumption_token is None if the last harvest of the endpoint completed
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _iter_content_hashes(self, oaipmh_id):
+        '''
+        Generator to yield an (identifier, content_hash) tuple for each sample stored for an endpoint.
+        content_hash is None for samples stored before content hashes were recorded
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _iter_live_identifiers(self, oaipmh_id):
+        '''
+        Generator to yield the identifier of each sample stored for an endpoint which has not been marked as deleted
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _delete_samples(self, oaipmh_id, deleted_samples, remove=False):
+        '''
+        Function to mark stored samples for an endpoint as deleted in a single transaction, given a list of
+        (identifier, deleted_datestamp) tuples, by setting DELETED to deleted_datestamp and clearing CONTENT_HASH
+        so that a sample harvested again later is updated in place. Samples already marked are left unchanged.
+        If remove is True, the samples are removed instead.
+        Returns number of samples marked or removed.
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _write_samples(self, sample_rows, upsert=False, checkpoint=None):
+        '''
+        Function to write a batch of sample records to the database in a single transaction.
+        Records which already exist must be skipped, or updated in place if upsert is True.
+        If checkpoint is a dict of HARVEST_STATE_COLUMNS parameters, the harvest checkpoint for the endpoint
+        must be stored in the same transaction.
+        Returns number of records written.
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _iter_sample_chunks(self, oaipmh_ids=None, from_datestamp=None, until_datestamp=None, chunk_size=None):
+        '''
+        Generator to yield lists of up to chunk_size (oaipmh_key, *SAMPLE_COLUMNS) tuples for all stored samples
+        in SAMPLE_ID order, restricted to endpoints in oaipmh_ids and an inclusive DATESTAMP range if specified.
+        Rows must be read from the database one chunk at a time. DATESTAMP values must be returned as
+        OAI-PMH UTC datestamp strings
+        '''
+        pass
+
+    def _flush_samples(self):
+        '''
+        Function to write any samples buffered by _write_samples, called once all batches of a harvest have been written.
+        Returns dict of numbers of records written keyed by oaipmh_id for any records not already counted by _write_samples.
+        Does nothing for backends which write each batch as it is received
+        '''
+        return {}
+
+    def _get_content_hashes(self, oaipmh_id):
+        '''
+        Function to return a dict of the stored content hash of each sample for an endpoint keyed by identifier.
+        Hashes are held as integers rather than strings to keep the dict compact for large endpoints
+        '''
+        start_time = timer()
+        content_hashes = {identifier: int(content_hash, 16) if content_hash else None
+                          for identifier, content_hash in self._iter_content_hashes(oaipmh_id)}
+        logger.debug('Loaded %s content hashes for oaipmh_id %s in %.2f seconds',
+                     len(content_hashes), oaipmh_id, timer() - start_time)
+        return content_hashes
+
+    def _prepare_bulk_load(self):
+        '''
+        Function to prepare the whole database for a bulk load before any harvest connections start writing,
+        e.g. by dropping indexes to be rebuilt once by _complete_bulk_load. Does nothing by default
+        '''
+        pass
+
+    def _complete_bulk_load(self):
+        '''
+        Function to restore the database after a bulk load, once all harvest connections have finished writing.
+        Does nothing by default
+        '''
+        pass
+
+    def _start_bulk_writes(self):
+        '''
+        Function to switch this reader's database connection to bulk writes for the rest of a harvest.
+        Does nothing by default
+        '''
+        pass
+
+    def _stop_bulk_writes(self):
+        '''
+        Function to switch this reader's database connection back to normal writes after _flush_samples.
+        Does nothing by default
+        '''
+        pass
+
+    def _write_sample_batch(self, sample_rows, upsert=False, checkpoint=None):
+        '''
+        Function to write a batch of sample records, falling back to one record per transaction
+        if the batch write fails so that a single bad record does not lose the whole batch.
+        Any checkpoint is stored with the batch, or after all records have been written if the batch write fails.
+        Raises RuntimeError once all records have been tried if any record could not be written, without storing
+        the checkpoint, so that a resumed harvest carries on from before the lost records
+        '''
+        if not sample_rows and not checkpoint:
+            return 0
+
+        if upsert:
+            # A record may only be updated once per statement, so keep the last version of each identifier
+            sample_rows = list({sample_row['identifier']: sample_row for sample_row in sample_rows}.values())
+
+        try:
+            try:
+                return self._write_samples(sample_rows, upsert=upsert, checkpoint=checkpoint)
+            except Exception as e:
+                logger.warning('Batch write of {} records failed: {}'.format(len(sample_rows), e))
+
+            written_count = 0
+            failed_count = 0
+            for sample_row in sample_rows:
+                try:
+                    written_count += self._write_samples([sample_row], upsert=upsert)
+                except Exception as e:
+                    logger.warning('Record write failed for {}: {}'.format(sample_row['identifier'], e))
+                    failed_count += 1
+
+            if failed_count:
+                raise RuntimeError('{} of {} records could not be written'.format(failed_count, len(sample_rows)))
+
+            if checkpoint:
+                self._write_samples([], checkpoint=checkpoint)
+            return written_count
+        finally:
+            # Cached lookups are only invalidated once the samples have been written, so that they cannot be cached again
+            # from the database before the write. New identifiers are invalidated too, in case they were cached as unknown
+            if sample_rows:
+                self._invalidate_sample_cache({identifier
+                                               for sample_row in sample_rows
+                                               for identifier in [sample_row['identifier']] + (sample_row.get('identifiers') or [])})
+
+    def _delete_sample_batch(self, oaipmh_id, deleted_samples, remove=False):
+        '''
+        Function to mark stored samples for an endpoint as deleted, or remove them if remove is True, given a list of
+        (identifier, deleted_datestamp) tuples, and invalidate any cached lookups of them. See _delete_samples.
+        Returns number of samples marked or removed
+        '''
+        try:
+            return self._delete_samples(oaipmh_id, deleted_samples, remove=remove)
+        finally:
+            self._invalidate_sample_cache([identifier for identifier, _deleted_datestamp in deleted_samples])
+
+    def _invalidate_sample_cache(self, identifiers=None):
+        '''
+        Function to invalidate any cached lookups of the samples with any of identifiers once they have been written
+        or deleted, or of all samples if identifiers is None. Readers which cannot look up samples cache nothing
+        '''
+        pass
+
+    def _get_dc_extractor(self, oaipmh_id):
+        '''
+        Function to return the DublinCoreExtractor for an endpoint, creating it on first use
+        '''
+        from ._dc_extractor import DublinCoreExtractor
+
+        dc_extractor = self._dc_extractors.get(oaipmh_id)
+        if dc_extractor is None:
+            dc_extractor = DublinCoreExtractor()
+            self._dc_extractors[oaipmh_id] = dc_extractor
+        return dc_extractor
+
+    def _get_oaipmh_tree(self, oaipmh_url, http_params):
+        '''
+        Function to retrieve an OAI-PMH response and return the parsed response tree.
+        The response must contain an element for the requested verb, or a noRecordsMatch error.
+        The body is only received once the headers have arrived, so that receiving it is timed as decode rather than http_wait.
+        Failed requests are retried by the HTTP client
+        '''
+        from lxml import etree
+
+        verb_tag = '{{{}}}{}'.format(OAI_NAMESPACE, http_params['verb'])
+
+        def read_response(response):
+            with self._metrics.timer('decode'):
+                response_content = response.content
+            self._metrics.add('bytes', len(response_content))
+
+            with self._metrics.timer('parse'):
+                response_tree = etree.fromstring(response_content)
+
+            if response_tree.find(verb_tag) is None:
+                error_element = response_tree.find('{{{}}}error'.format(OAI_NAMESPACE))
+                assert error_element is not None, 'Unable to find OAI-PMH/{} element'.format(http_params['verb'])
+                assert error_element.get('code') == NO_RECORDS_MATCH, 'OAI-PMH error "{}": {}'.format(error_element.get('code'),
+                                                                                                    error_element.text)
+
+            return response_tree
+
+        return self._http_client.get(oaipmh_url, http_params, read_response, stream=True)
+
+    def _get_list_records_element(self, oaipmh_id, oaipmh_url, http_params):
+        '''
+        Function to retrieve a ListRecords response and return the ListRecords element,
+        or None if no records match the request
+        '''
+        with self._metrics.endpoint(oaipmh_id):
+            response_tree = self._get_oaipmh_tree(oaipmh_url, http_params)
+        return self._get_dc_extractor(oaipmh_id).get_list_records_element(response_tree)
+
+    def _get_list_identifiers_element(self, oaipmh_id, oaipmh_url, http_params):
+        '''
+        Function to retrieve a ListIdentifiers response and return the ListIdentifiers element,
+        or None if no records match the request
+        '''
+        with self._metrics.endpoint(oaipmh_id):
+            response_tree = self._get_oaipmh_tree(oaipmh_url, http_params)
+        return self._get_dc_extractor(oaipmh_id).get_list_identifiers_element(response_tree)
+
+    def _read_identifiers(self, oaipmh_id, oaipmh_key, oaipmh_url):
+        '''
+        Function to page through the ListIdentifiers responses of an endpoint, which list record headers without
+        any metadata. Returns (live_identifiers, deleted_datestamps) where live_identifiers is the set of identifiers
+        of all listed records which have not been deleted, and deleted_datestamps is a dict of the header datestamps
+        of deleted records keyed by identifier
+        '''
+        dc_extractor = self._get_dc_extractor(oaipmh_id)
+
+        live_identifiers = set()
+        deleted_datestamps = {}
+        http_params = {'verb': 'ListIdentifiers',
+                       'metadataPrefix': 'oai_dc'}
+        while True:
+            list_identifiers_element = self._get_list_identifiers_element(oaipmh_id, oaipmh_url, http_params)
+            if list_identifiers_element is None: # noRecordsMatch
+                break
+
+            identifier_count = len(live_identifiers) + len(deleted_datestamps)
+            for header_element in dc_extractor.get_headers(list_identifiers_element):
+                identifier, datestamp, deleted = dc_extractor.read_header(header_element)
+                if not identifier:
+                    continue
+                if deleted:
+                    deleted_datestamps[identifier] = datestamp
+                else:
+                    live_identifiers.add(identifier)
+
+            resumption_token, cursor, complete_list_size = dc_extractor.get_resumption_token(list_identifiers_element)
+            page_count = len(live_identifiers) + len(deleted_datestamps) - identifier_count
+            self._metrics.add('pages', 1, oaipmh_id)
+            self._metrics.add('records', page_count, oaipmh_id)
+            self._metrics.set_progress(oaipmh_id,
+                                       cursor + page_count if cursor is not None else None,
+                                       complete_list_size)
+            if (identifier_count + page_count) // REPORT_INCREMENT > identifier_count // REPORT_INCREMENT:
+                logger.info('{} identifiers read for {}'.format(identifier_count + page_count, oaipmh_key))
+
+            if not resumption_token:
+                break
+            http_params = {'verb': 'ListIdentifiers',
+                           'resumptionToken': resumption_token}
+
+        return live_identifiers, deleted_datestamps
+
+    def _get_identify(self, oaipmh_url):
+        '''
+        Function to return dict of the text of each child element of an endpoint's Identify response
+        keyed by local name, e.g. 'earliestDatestamp' and 'granularity'
+        '''
+        from lxml import etree
+
+        response_tree = self._get_oaipmh_tree(oaipmh_url, {'verb': 'Identify'})
+        return {etree.QName(element).localname: element.text
+                for element in response_tree.iterfind('{{{0}}}Identify/*'.format(OAI_NAMESPACE))
+                }
+
+    def _get_granularity(self, oaipmh_url):
+        '''
+        Function to return the datestamp granularity reported by an endpoint's Identify response
+        '''
+        return self._get_identify(oaipmh_url).get('granularity')
+
+    def _iter_list_records_stream(self, response):
+        '''
+        Generator to stream a ListRecords response through an incremental pull parser, yielding each record
+        and resumptionToken element as soon as it has been parsed. A noRecordsMatch error yields nothing.
+        Each element is cleared, along with any preceding siblings, once the consumer has finished with it
+        so memory use depends on record size rather than page size.
+        Time spent receiving and parsing the response, but not consuming elements, is added to the metrics
+        '''
+        from lxml import etree
+
+        list_records_tag = '{{{}}}ListRecords'.format(OAI_NAMESPACE)
+        error_tag = '{{{}}}error'.format(OAI_NAMESPACE)
+        parser = etree.XMLPullParser(events=('end',),
+                                     tag=[list_records_tag,
+                                          error_tag,
+                                          '{{{}}}record'.format(OAI_NAMESPACE),
+                                          '{{{}}}resumptionToken'.format(OAI_NAMESPACE),
+                                          ])
+
+        list_records_found = False
+        decode_seconds = 0.0
+        parse_seconds = 0.0
+        byte_count = 0
+        chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        while True:
+            start_time = timer()
+            chunk = next(chunks, None)
+            decode_seconds += timer() - start_time
+            if chunk is None:
+                break
+            byte_count += len(chunk)
+
+            start_time = timer()
+            parser.feed(chunk)
+            parse_seconds += timer() - start_time
+
+            for _event, element in parser.read_events():
+                if element.tag == list_records_tag:
+                    list_records_found = True
+                    continue
+
+                if element.tag == error_tag:
+                    assert element.get('code') == NO_RECORDS_MATCH, 'OAI-PMH error "{}": {}'.format(element.get('code'),
+                                                                                                   element.text)
+                    list_records_found = True # No records to yield
+                    continue
+
+                yield element
+
+                # Free memory used by processed element and any preceding siblings
+                element.clear(keep_tail=True)
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+        parser.close()
+        self._metrics.add('decode', decode_seconds)
+        self._metrics.add('parse', parse_seconds)
+        self._metrics.add('bytes', byte_count)
+        assert list_records_found, 'Unable to find OAI-PMH/ListRecords element'
+
+    def _read_page_stream(self, oaipmh_id, oaipmh_url, http_params):
+        '''
+        Function to retrieve and read one ListRecords page using a streaming parse.
+        Returns (sample_rows, (resumption_token, cursor, complete_list_size)).
+        Failed requests are retried by the HTTP client
+        '''
+        dc_extractor = self._get_dc_extractor(oaipmh_id)
+        resumption_token_tag = '{{{}}}resumptionToken'.format(OAI_NAMESPACE)
+
+        def read_response(response):
+            sample_rows = []
+            resumption_state = dc_extractor.read_resumption_token(None)
+            extract_seconds = 0.0
+            for element in self._iter_list_records_stream(response):
+                if element.tag == resumption_token_tag:
+                    resumption_state = dc_extractor.read_resumption_token(element)
+                    continue
+
+                start_time = timer()
+                try:
+                    sample_row = dc_extractor.extract(element)
+                except Exception as e:
+                    logger.warning('Attribute read failed: {}'.format(e))
+                    continue
+                finally:
+                    extract_seconds += timer() - start_time
+
+                sample_row['oaipmh_id'] = oaipmh_id
+                sample_row['content_hash'] = get_content_hash(sample_row) if not sample_row['deleted'] else None
+                sample_rows.append(sample_row)
+
+            self._metrics.add('extract', extract_seconds)
+            return sample_rows, resumption_state
+
+        with self._metrics.endpoint(oaipmh_id):
+            return self._http_client.get(oaipmh_url, http_params, read_response, stream=True)
+
+    def _get_resumption_token(self, oaipmh_id, list_records_element):
+        '''
+        Function to return a (resumption_token, cursor, complete_list_size) tuple from a ListRecords element.
+        resumption_token is None for the last page
+        '''
+        return self._get_dc_extractor(oaipmh_id).get_resumption_token(list_records_element)
+
+    def _read_page_records(self, oaipmh_id, list_records_element):
+        '''
+        Function to read Dublin Core metadata for each record in a ListRecords page and return a list of sample rows.
+        Records with deleted headers are returned with their deleted key set. See DublinCoreExtractor.extract
+        '''
+        dc_extractor = self._get_dc_extractor(oaipmh_id)
+
+        start_time = timer()
+        sample_rows = []
+        for record_element in dc_extractor.get_records(list_records_element):
+            try:
+                sample_row = dc_extractor.extract(record_element)
+            except Exception as e:
+                logger.warning('Attribute read failed: {}'.format(e))
+                continue
+
+            sample_row['oaipmh_id'] = oaipmh_id
+            sample_row['content_hash'] = get_content_hash(sample_row) if not sample_row['deleted'] else None
+            sample_rows.append(sample_row)
+        self._metrics.add('extract', timer() - start_time, oaipmh_id)
+        return sample_rows
+
+    def export_samples(self,
+                       export_path,
+                       export_format=None,
+                       oaipmh_source=None,
+                       from_datestamp=None,
+                       until_datestamp=None,
+                       chunk_size=None
+                       ):
+        '''
+        Function to export stored samples to a CSV, JSONL or Parquet file, streaming chunk_size rows at a time
+        from the database so that memory use does not depend on the number of samples exported.
+        export_format is one of EXPORT_FORMATS, or is determined from the export_path extension if not specified.
+        oaipmh_source may be a single OAI-PMH key or a list of keys to restrict the export to.
+        from_datestamp and until_datestamp are inclusive OAI-PMH UTC datestamps, either of which may be a day only.
+        Each exported row has oaipmh_key and lower case SAMPLE_COLUMNS other than OAIPMH_ID.
+        Returns number of samples exported
+        '''
+        from ._sample_export import export_sample_chunks, DEFAULT_EXPORT_CHUNK_SIZE
+
+        sample_chunks = self._iter_sample_chunks(oaipmh_ids=self._get_oaipmh_ids(oaipmh_source),
+                                                 from_datestamp=from_datestamp,
+                                                 until_datestamp=get_until_datestamp(until_datestamp),
+                                                 chunk_size=chunk_size or DEFAULT_EXPORT_CHUNK_SIZE)
+        export_count = export_sample_chunks(sample_chunks, export_path, export_format=export_format)
+        logger.info('{} samples exported to {}'.format(export_count, export_path))
+        return export_count
+
+    def _get_oaipmh_ids(self, oaipmh_source=None):
+        '''
+        Function to return list of oaipmh_id values for a single OAI-PMH key or a list of keys,
+        or None for all endpoints if oaipmh_source is not specified
+        '''
+        if not oaipmh_source:
+            return None
+
+        if isinstance(oaipmh_source, str):
+            oaipmh_source = [oaipmh_source]
+        return [oaipmh_id
+                for oaipmh_id, oaipmh_key, _oaipmh_url in self._get_oaipmh_endpoints()
+                if oaipmh_key in oaipmh_source
+                ]
+
+    def get_harvest_status(self, oaipmh_source=None):
+        '''
+        Function to return a list of harvest status dicts for each known OAI-PMH endpoint, or only those in
+        oaipmh_source if specified, with keys oaipmh_key, oaipmh_url, sample_count, latest_datestamp and,
+        if a checkpoint has been stored, checkpoint_updated, cursor, complete_list_size and interrupted.
+        interrupted is True if the last harvest of the endpoint did not complete and can be resumed
+        '''
+        if isinstance(oaipmh_source, str):
+            oaipmh_source = [oaipmh_source]
+
+        harvest_status = []
+        for oaipmh_id, oaipmh_key, oaipmh_url in self._get_oaipmh_endpoints():
+            if oaipmh_source and oaipmh_key not in oaipmh_source:
+                continue
+
+            endpoint_status = {'oaipmh_key': oaipmh_key,
+                               'oaipmh_url': oaipmh_url,
+                               'sample_count': self._get_sample_count(oaipmh_id),
+                               'latest_datestamp': self._get_latest_datestamp(oaipmh_id),
+                               }
+
+            checkpoint = self._get_harvest_checkpoint(oaipmh_id)
+            if checkpoint:
+                endpoint_status.update({'checkpoint_updated': checkpoint['updated'],
+                                        'cursor': checkpoint['cursor'],
+                                        'complete_list_size': checkpoint['complete_list_size'],
+                                        'interrupted': bool(checkpoint['resumption_token']),
+                                        })
+
+            harvest_status.append(endpoint_status)
+        return harvest_status
+
+    def read_igsns(self,
+                   oaipmh_source=None,
+                   resumption_token=None,
+                   batch_size=None,
+                   max_concurrent_requests=None,
+                   page_queue_size=None,
+                   write_queue_size=None,
+                   streaming_parse=None,
+                   incremental=None,
+                   resume=False,
+                   replay=False,
+                   bulk_load=None,
+                   skip_unchanged=None,
+                   remove_deleted=None
+                   ):
         '''
         Function to read IGSNS into database
+        oaipmh_source may be a single OAI-PMH key or a list of keys, with all endpoints harvested if None.
+        Endpoints are harvested concurrently and records are written by a single database writer in
+        batches of at least batch_size records, with each batch written in a single transaction.
+        Within each endpoint, the next page is fetched while the current one is extracted, with at most
+        page_queue_size pages per endpoint and write_queue_size batches held in memory.
+        If streaming_parse is True, each page is parsed incrementally as it is received and records are
+        extracted one at a time, so memory use depends on record size rather than page size.
+        If incremental is True, only records changed since the latest stored datestamp for each endpoint are
+        requested, and existing records are updated in place.
+        A checkpoint of the next resumptionToken is stored for each endpoint in the same transaction as each batch.
+        If resume is True, each endpoint with an interrupted harvest carries on from its last checkpoint, and
+        endpoints whose last harvest completed are skipped.
+        If page_cache_dir is set, every response is also stored in the page cache. If replay is True, responses
+        are read from the page cache instead of over HTTP, so that records can be re-ingested at disk and parse speed.
+        Replay requires the same request parameters as the recorded harvest, so should not be combined with
+        incremental or resume modes.
+        If bulk_load is True, the database is tuned for bulk ingest rather than concurrent use for the duration of
+        the harvest, e.g. for the initial load of an empty database. See _prepare_bulk_load and _start_bulk_writes.
+        If skip_unchanged is True, a content hash of each record is compared with that of the stored sample
+        before writing, so that only new and changed records are written and changed records are updated in place.
+        Stored samples whose records are returned with deleted headers are marked as deleted, or removed if
+        remove_deleted is True, and samples marked as deleted are updated in place if their records reappear.
+        See reconcile_samples to find deleted records without a full harvest.
+        Returns dict of (sample_count, written_count) tuples keyed by OAI-PMH key
+        '''
+        from ._harvest_engine import HarvestEngine
+
+        if isinstance(oaipmh_source, str):
+            oaipmh_source = [oaipmh_source]
+
+        # Skip any sources not in specified source list
+        endpoints = [(oaipmh_id, oaipmh_key, oaipmh_url)
+                     for oaipmh_id, oaipmh_key, oaipmh_url in self._get_oaipmh_endpoints()
+                     if not oaipmh_source or oaipmh_key in oaipmh_source
+                     ]
+        assert not resumption_token or len(endpoints) == 1, 'resumption_token can only be specified for a single OAI-PMH source'
+        assert not (resumption_token and resume), 'resumption_token cannot be specified when resuming'
+        assert not replay or self._http_client.page_cache is not None, 'page_cache_dir must be set to replay'
+
+        bulk_load = bulk_load if bulk_load is not None else bool(settings.get('bulk_load'))
+        harvest_engine = HarvestEngine(self,
+                                       batch_size=batch_size,
+                                       max_concurrent_requests=max_concurrent_requests,
+                                       page_queue_size=page_queue_size,
+                                       write_queue_size=write_queue_size,
+                                       streaming_parse=streaming_parse,
+                                       incremental=incremental,
+                                       bulk_load=bulk_load,
+                                       skip_unchanged=skip_unchanged,
+                                       remove_deleted=remove_deleted)
+        if bulk_load:
+            self._prepare_bulk_load()
+        self._http_client.replay = replay
+        try:
+            return harvest_engine.harvest(endpoints, resumption_token=resumption_token, resume=resume)
+        finally:
+            self._http_client.replay = False
+            if bulk_load:
+                self._complete_bulk_load()
+                self._invalidate_sample_cache() # Samples staged by bulk writes may only have been stored by the final flush
+
+    def read_igsns_partitioned(self,
+                               oaipmh_source,
+                               window_count=None,
+                               worker_count=None,
+                               batch_size=None,
+                               page_queue_size=None,
+                               write_queue_size=None,
+                               streaming_parse=None,
+                               incremental=None,
+                               bulk_load=None,
+                               skip_unchanged=None,
+                               remove_deleted=None
+                               ):
+        '''
+        Function to read IGSNS from a single large OAI-PMH source into database by splitting its datestamp range
+        into window_count from/until windows and harvesting the windows in parallel in worker_count processes.
+        Each window has its own resumptionToken chain and its own database connection, and records harvested
+        in more than one window are written once. If incremental is True, the windows cover only the range
+        since the latest stored datestamp and existing records are updated in place.
+        No harvest checkpoints are stored, so an interrupted partitioned harvest cannot be resumed.
+        If bulk_load is True, the database is prepared for bulk ingest once and each worker writes in bulk mode.
+        If skip_unchanged is True, each worker skips records whose content has not changed.
+        Stored samples whose records are returned with deleted headers are marked as deleted, or removed if
+        remove_deleted is True.
+        Returns dict of (sample_count, written_count) tuples keyed by OAI-PMH key
+        '''
+        from ._partitioned_harvest import PartitionedHarvest
+
+        endpoints = [(oaipmh_id, oaipmh_key, oaipmh_url)
+                     for oaipmh_id, oaipmh_key, oaipmh_url in self._get_oaipmh_endpoints()
+                     if oaipmh_key == oaipmh_source
+                     ]
+        assert endpoints, 'Unknown OAI-PMH source "{}"'.format(oaipmh_source)
+
+        partitioned_harvest = PartitionedHarvest(self,
+                                                 window_count=window_count,
+                                                 worker_count=worker_count,
+                                                 batch_size=batch_size,
+                                                 page_queue_size=page_queue_size,
+                                                 write_queue_size=write_queue_size,
+                                                 streaming_parse=streaming_parse,
+                                                 incremental=incremental,
+                                                 bulk_load=bulk_load,
+                                                 skip_unchanged=skip_unchanged,
+                                                 remove_deleted=remove_deleted)
+        try:
+            return partitioned_harvest.harvest(*endpoints[0])
+        finally:
+            self._invalidate_sample_cache() # Samples are written by worker processes, which cannot invalidate this reader's cache
+
+    def reconcile_samples(self,
+                          oaipmh_source=None,
+                          remove_deleted=None,
+                          max_missing_fraction=None
+                          ):
+        '''
+        Function to reconcile stored samples with the records currently listed by each OAI-PMH endpoint using
+        header-only ListIdentifiers requests, which are far smaller than ListRecords responses.
+        Stored samples whose records are listed as deleted, or are no longer listed at all, are marked as deleted
+        with the datestamp of the deleted header or the time of reconciliation, or removed if remove_deleted is True.
+        A sample marked as deleted is updated in place if its record is harvested again, in any harvest mode.
+        An endpoint is not reconciled if more than max_missing_fraction of its stored samples would be marked or
+        removed, so that an endpoint temporarily listing too few records does not empty the database.
+        oaipmh_source may be a single OAI-PMH key or a list of keys, with all endpoints reconciled if None.
+        Returns dict of (identifier_count, deleted_count) tuples keyed by OAI-PMH key
+        '''
+        remove_deleted = remove_deleted if remove_deleted is not None else bool(settings.get('remove_deleted'))
+        max_missing_fraction = (max_missing_fraction if max_missing_fraction is not None
+                                else settings.get('reconcile_max_missing_fraction')
+                                if settings.get('reconcile_max_missing_fraction') is not None
+                                else DEFAULT_MAX_MISSING_FRACTION)
+
+        if isinstance(oaipmh_source, str):
+            oaipmh_source = [oaipmh_source]
+
+        reconcile_results = {}
+        failures = []
+        for oaipmh_id, oaipmh_key, oaipmh_url in self._get_oaipmh_endpoints():
+            if oaipmh_source and oaipmh_key not in oaipmh_source:
+                continue
+
+            logger.info('Querying identifiers for {}'.format(oaipmh_key))
+            self._metrics.register_endpoint(oaipmh_id, oaipmh_key)
+            reconcile_datestamp = datetime.now(timezone.utc).strftime(UTC_DATESTAMP_FORMAT)
+            try:
+                live_identifiers, deleted_datestamps = self._read_identifiers(oaipmh_id, oaipmh_key, oaipmh_url)
+                self._metrics.finish_endpoint(oaipmh_id, completed=True)
+
+                stored_count = 0
+                deleted_samples = []
+                for identifier in self._iter_live_identifiers(oaipmh_id):
+                    stored_count += 1
+                    if identifier not in live_identifiers:
+                        deleted_samples.append((identifier, deleted_datestamps.get(identifier) or reconcile_datestamp))
+
+                assert len(deleted_samples) <= stored_count * max_missing_fraction, \
+                    '{} of {} stored samples for {} are deleted or missing, more than max_missing_fraction {}'.format(len(deleted_samples),
+                                                                                                                   stored_count,
+                                                                                                                   oaipmh_key,
+                                                                                                                   max_missing_fraction)
+
+                with self._metrics.endpoint(oaipmh_id):
+                    deleted_count = self._delete_sample_batch(oaipmh_id, deleted_samples, remove=remove_deleted) if deleted_samples else 0
+                    self._flush_samples() # Write any deletions buffered by the backend
+            except Exception as e:
+                self._metrics.finish_endpoint(oaipmh_id)
+                logger.error('Reconciliation failed for {}: {}'.format(oaipmh_key, e))
+                failures.append(e)
+                continue
+
+            self._metrics.add('deleted', deleted_count, oaipmh_id)
+            reconcile_results[oaipmh_key] = (len(live_identifiers) + len(deleted_datestamps), deleted_count)
+            logger.info('{} identifiers listed and {} of {} stored samples {} as deleted for {}'.format(reconcile_results[oaipmh_key][0],
+                                                                                                      deleted_count,
+                                                                                                      stored_count,
+                                                                                                      'removed' if remove_deleted else 'marked',
+                                                                                                      oaipmh_key))
+
+        # Re-raise the first failure only after all other endpoints have been reconciled
+        if failures:
+            raise failures[0]
+
+        return reconcile_results
+
+
+class IGSNDatabaseReader(IGSNReader):
+    '''
+    IGSNReader which stores samples in a database, which can also be queried with full-text and bounding box searches,
+    identifier resolution and sample and relation lookups. Looked up samples are cached until this reader writes them
+    '''
+
+    def __init__(self):
+        '''
+        Constructor for IGSNDatabaseReader class
+        '''
+        from ._sample_cache import SampleCache
+
+        super(IGSNDatabaseReader, self).__init__()
+
+        self._sample_cache = SampleCache() # Samples looked up by get_samples keyed by identifier
+        self._db_connection = None # Database connection, opened by subclasses on first use
+
+    @property
+    def db_connection(self):
+        '''
+        Database connection, opened with _connect() on first use so that creating a reader does not connect
+        '''
+        if self._db_connection is None:
+            self._db_connection = self._connect()
+        return self._db_connection
+
+    def close(self):
+        '''
+        Function to close the database connection if it has been opened
+        '''
+        if self._db_connection is not None:
+            self._db_connection.close()
+            self._db_connection = None
+
+    @abc.abstractmethod
+    def _connect(self):
+        '''
+        Function to open and return a new database connection, creating any missing tables
+        and inserting any configured OAI-PMH endpoints not already in the OAIPMH table
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _search_samples(self, search_terms, oaipmh_ids=None, sample_type=None, from_datestamp=None, until_datestamp=None,
+                        limit=None, offset=0):
+        '''
+        Function to return a list of (rank, oaipmh_key, *SAMPLE_COLUMNS) tuples for samples not marked as deleted with
+        all search terms in TITLE, SUBJECT or DESCRIPTION using the full-text index, highest rank first.
+        Results are restricted to endpoints in oaipmh_ids, TYPE sample_type and an inclusive DATESTAMP range if specified.
+        DATESTAMP values must be returned as OAI-PMH UTC datestamp strings
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _search_bbox(self, bbox, within=False, oaipmh_ids=None, sample_type=None, limit=None, offset=0):
+        '''
+        Function to return a list of (oaipmh_key, *SAMPLE_COLUMNS) tuples for samples not marked as deleted whose
+        extent intersects a (min_longitude, min_latitude, max_longitude, max_latitude) bbox using the spatial index,
+        or lies within it if within is True, in IDENTIFIER order.
+        Results are restricted to endpoints in oaipmh_ids and TYPE sample_type if specified.
+        DATESTAMP values must be returned as OAI-PMH UTC datestamp strings
         '''
         pass
+
+    @abc.abstractmethod
+    def _resolve_identifiers(self, identifiers):
+        '''
+        Function to return a list of (identifier, sample_identifier) tuples for each of identifiers which is any
+        identifier of a sample not marked as deleted, where sample_identifier is its IDENTIFIER,
+        with one query using the SAMPLE_IDENTIFIER index
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _get_samples(self, identifiers):
+        '''
+        Function to return a list of (identifier, oaipmh_key, *SAMPLE_COLUMNS) tuples for each of identifiers which is any
+        identifier of a sample not marked as deleted, with one query using the SAMPLE_IDENTIFIER index.
+        DATESTAMP values must be returned as OAI-PMH UTC datestamp strings
+        '''
+        pass
+
+    @abc.abstractmethod
+    def _get_relations(self, sample_identifiers, inverse=False):
+        '''
+        Function to return a list of (identifier, relation, related_identifier) tuples for each dc:relation value of
+        the samples not marked as deleted with IDENTIFIER in sample_identifiers, where related_identifier is the IDENTIFIER
+        of a sample not marked as deleted which the relation identifies, or None for a relation which identifies none.
+        If inverse is True, tuples are instead returned for the relations of samples not marked as deleted which identify
+        samples in sample_identifiers. Each direction takes one query using the SAMPLE_IDENTIFIER and SAMPLE_RELATION indexes
+        '''
+        pass
+
+    def _invalidate_sample_cache(self, identifiers=None):
+        '''
+        Function to invalidate the cached lookups of the samples with any of identifiers once they have been written
+        or deleted, or of all samples if identifiers is None
+        '''
+        if identifiers is None:
+            self._sample_cache.clear()
+        else:
+            self._sample_cache.invalidate(identifiers)
+
+    def search_samples(self,
+                       query,
+                       oaipmh_source=None,
+                       sample_type=None,
+                       from_datestamp=None,
+                       until_datestamp=None,
+                       limit=None,
+                       offset=0
+                       ):
+        '''
+        Function to return a ranked list of samples with all words in query in their TITLE, SUBJECT or DESCRIPTION,
+        best matches first, excluding samples marked as deleted.
+        Matches in TITLE rank above matches in SUBJECT, which rank above matches in DESCRIPTION.
+        oaipmh_source may be a single OAI-PMH key or a list of keys to restrict the search to.
+        from_datestamp and until_datestamp are inclusive OAI-PMH UTC datestamps, either of which may be a day only.
+        At most limit samples are returned, starting offset samples into the ranked results.
+        Returns list of sample dicts with lower case SAMPLE_COLUMNS keys plus oaipmh_key and rank, where higher ranks
+        are better matches. Ranks are only comparable between results from the same database backend.
+        '''
+        search_terms = re.findall(r'\w+', query)
+        assert search_terms, 'No words to search for in query "{}"'.format(query)
+
+        result_keys = ['rank', 'oaipmh_key'] + [column.lower() for column in SAMPLE_COLUMNS]
+        return [dict(zip(result_keys, result_row))
+                for result_row in self._search_samples(search_terms,
+                                                       oaipmh_ids=self._get_oaipmh_ids(oaipmh_source),
+                                                       sample_type=sample_type,
+                                                       from_datestamp=from_datestamp,
+                                                       until_datestamp=get_until_datestamp(until_datestamp),
+                                                       limit=limit or DEFAULT_SEARCH_LIMIT,
+                                                       offset=offset)
+                ]
+
+    def search_bbox(self,
+                    bbox,
+                    within=False,
+                    oaipmh_source=None,
+                    sample_type=None,
+                    limit=None,
+                    offset=0
+                    ):
+        '''
+        Function to return a list of samples whose extent, parsed from COVERAGE when harvested, intersects a bounding box,
+        or lies entirely within it if within is True, excluding samples marked as deleted.
+        bbox is a (min_longitude, min_latitude, max_longitude, max_latitude) tuple of WGS84 decimal degrees,
+        which may not cross the antimeridian.
+        oaipmh_source may be a single OAI-PMH key or a list of keys to restrict the search to.
+        At most limit samples are returned, starting offset samples into the results in IDENTIFIER order.
+        Returns list of sample dicts with lower case SAMPLE_COLUMNS keys plus oaipmh_key
+        '''
+        assert len(bbox) == 4, 'bbox must be a (min_longitude, min_latitude, max_longitude, max_latitude) tuple'
+        bbox = tuple(float(ordinate) for ordinate in bbox)
+        assert bbox[0] <= bbox[2] and bbox[1] <= bbox[3], 'Invalid bbox {}. Minimum values must not exceed maximum values'.format(bbox)
+
+        result_keys = ['oaipmh_key'] + [column.lower() for column in SAMPLE_COLUMNS]
+        return [dict(zip(result_keys, result_row))
+                for result_row in self._search_bbox(bbox,
+                                                    within=within,
+                                                    oaipmh_ids=self._get_oaipmh_ids(oaipmh_source),
+                                                    sample_type=sample_type,
+                                                    limit=limit or DEFAULT_SEARCH_LIMIT,
+                                                    offset=offset)
+                ]
+
+    def resolve_identifiers(self, identifiers):
+        '''
+        Function to resolve a batch of identifiers, each of which may be the OAI-PMH identifier of a sample or any of its
+        dc:identifier values, e.g. an IGSN URI, to the OAI-PMH identifiers of samples not marked as deleted, with one
+        indexed query for every IDENTIFIER_CHUNK_SIZE identifiers.
+        Returns dict of sorted lists of OAI-PMH identifiers keyed by identifier. An identifier may resolve to more than one
+        sample, e.g. an IGSN harvested from more than one endpoint. Identifiers which do not resolve are omitted
+        '''
+        identifiers = list(dict.fromkeys(identifiers))
+
+        resolved_identifiers = {}
+        for chunk_start in range(0, len(identifiers), IDENTIFIER_CHUNK_SIZE):
+            for identifier, sample_identifier in self._resolve_identifiers(identifiers[chunk_start:chunk_start + IDENTIFIER_CHUNK_SIZE]):
+                resolved_identifiers.setdefault(identifier, []).append(sample_identifier)
+
+        for sample_identifiers in resolved_identifiers.values():
+            sample_identifiers.sort()
+        return resolved_identifiers
+
+    def get_samples(self, identifiers):
+        '''
+        Function to look up a batch of identifiers, each of which may be the OAI-PMH identifier of a sample or any of its
+        dc:identifier values, e.g. an IGSN URI, and return the samples not marked as deleted which they identify.
+        Identifiers are answered from a least recently used cache of up to sample_cache_size identifiers where possible,
+        and the rest are looked up with one indexed query for every IDENTIFIER_CHUNK_SIZE identifiers and then cached.
+        Cached lookups of a sample are invalidated whenever this reader writes or deletes it during a harvest or
+        reconciliation. Samples written by other processes or readers may be returned as cached until clear_sample_cache
+        is called.
+        Returns dict of lists of sample dicts with lower case SAMPLE_COLUMNS keys plus oaipmh_key keyed by identifier,
+        in IDENTIFIER order. An identifier may identify more than one sample, e.g. an IGSN harvested from more than
+        one endpoint. Identifiers which do not resolve are omitted
+        '''
+        from ._sample_cache import IDENTIFIER_INDEX
+
+        identifiers = list(dict.fromkeys(identifiers))
+
+        resolved_samples = self._sample_cache.get(identifiers)
+        uncached_identifiers = [identifier for identifier in identifiers if identifier not in resolved_samples]
+        if uncached_identifiers:
+            generation = self._sample_cache.generation # Read before querying so that overlapping invalidations are detected
+            looked_up_samples = {identifier: [] for identifier in uncached_identifiers}
+            for chunk_start in range(0, len(uncached_identifiers), IDENTIFIER_CHUNK_SIZE):
+                for identifier, *sample in self._get_samples(uncached_identifiers[chunk_start:chunk_start + IDENTIFIER_CHUNK_SIZE]):
+                    looked_up_samples[identifier].append(tuple(sample))
+
+            looked_up_samples = {identifier: tuple(sorted(samples, key=lambda sample: sample[IDENTIFIER_INDEX]))
+                                 for identifier, samples in looked_up_samples.items()}
+            self._sample_cache.put(looked_up_samples, generation)
+            resolved_samples.update(looked_up_samples)
+
+        result_keys = ['oaipmh_key'] + [column.lower() for column in SAMPLE_COLUMNS]
+        return {identifier: [dict(zip(result_keys, sample)) for sample in resolved_samples[identifier]]
+                for identifier in identifiers
+                if resolved_samples[identifier]
+                }
+
+    def get_sample_cache_stats(self):
+        '''
+        Function to return a dict of get_samples cache statistics with keys size, max_size, hits, misses and hit_ratio,
+        where hits and misses are numbers of identifiers answered from the cache and looked up in the database
+        '''
+        return self._sample_cache.get_stats()
+
+    def clear_sample_cache(self):
+        '''
+        Function to discard all samples cached by get_samples, e.g. after another process has harvested into the database
+        '''
+        self._sample_cache.clear()
+
+    def get_relations(self, identifier, max_depth=None, inverse=True):
+        '''
+        Function to traverse the graph of dc:relation values between samples not marked as deleted breadth first from the
+        sample with the specified identifier, which may be its OAI-PMH identifier or any of its dc:identifier values.
+        Relations of each sample reached are followed to the samples they identify and, if inverse is True, relations of
+        other samples are followed back to the samples identifying them, up to max_depth relations from the start sample.
+        Each level takes one indexed query per direction for every IDENTIFIER_CHUNK_SIZE samples reached.
+        Returns list of relation dicts with keys identifier, relation, related_identifier and depth, in order of depth,
+        where identifier is the OAI-PMH identifier of the sample with the dc:relation value relation,
+        related_identifier is the OAI-PMH identifier of the sample it identifies, or None if no stored sample matches,
+        and depth is the number of relations from the start sample
+        '''
+        max_depth = max_depth or DEFAULT_RELATION_DEPTH
+        assert max_depth >= 1, 'max_depth must be at least 1'
+
+        start_identifiers = self.resolve_identifiers([identifier]).get(identifier)
+        assert start_identifiers, 'No sample found with identifier "{}"'.format(identifier)
+
+        reached_identifiers = set(start_identifiers)
+        level_identifiers = start_identifiers
+        relation_rows = set()
+        relations = []
+        for depth in range(1, max_depth + 1):
+            level_rows = []
+            for chunk_start in range(0, len(level_identifiers), IDENTIFIER_CHUNK_SIZE):
+                chunk_identifiers = level_identifiers[chunk_start:chunk_start + IDENTIFIER_CHUNK_SIZE]
+                level_rows += self._get_relations(chunk_identifiers)
+                if inverse:
+                    level_rows += self._get_relations(chunk_identifiers, inverse=True)
+
+            # A relation only identifies no sample if none of its matching identifiers belongs to a stored sample
+            resolved_relations = {(relation_row[0], relation_row[1]) for relation_row in level_rows if relation_row[2] is not None}
+
+            next_identifiers = set()
+            for relation_row in sorted(level_rows, key=lambda relation_row: (relation_row[0], relation_row[1], relation_row[2] or '')):
+                if relation_row in relation_rows or (relation_row[2] is None and relation_row[:2] in resolved_relations):
+                    continue
+
+                relation_rows.add(relation_row)
+                relations.append(dict(zip(['identifier', 'relation', 'related_identifier'], relation_row), depth=depth))
+                next_identifiers.update(sample_identifier for sample_identifier in (relation_row[0], relation_row[2])
+                                        if sample_identifier is not None and sample_identifier not in reached_identifiers)
+
+            if not next_identifiers:
+                break
+            reached_identifiers |= next_identifiers
+            level_identifiers = sorted(next_identifiers)
+
+        return relations
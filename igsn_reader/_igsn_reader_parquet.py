@@ -0,0 +1,282 @@
+import os
+import json
+import logging
+from datetime import datetime, timezone
+from timeit import default_timer as timer
+import pyarrow
+import pyarrow.parquet
+
+from ._igsn_reader import settings, IGSNReader, SAMPLE_COLUMNS
+from ._sample_export import get_parquet_schema
+
+DEFAULT_ROW_GROUP_SIZE = 100000 # Number of samples to buffer per endpoint before writing them as one Parquet file
+PARTITION_DIR_FORMAT = 'oaipmh_key={}' # Hive-style partition directory name for each endpoint's files
+PART_FILE_FORMAT = 'part-{}-{}-{:05d}.parquet' # Part file name from UTC start time, process ID and sequence number
+STATE_FILE_NAME = '_harvest_state.json' # Harvest checkpoint file in each partition directory, ignored by dataset readers
+
+# Columns stored in each part file. OAIPMH_ID is replaced by the oaipmh_key partition directory
+PARQUET_COLUMNS = [column.lower() for column in SAMPLE_COLUMNS if column != 'OAIPMH_ID']
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+class IGSNReader_Parquet(IGSNReader):
+    '''
+    IGSNReader backend which writes extracted samples straight to Parquet files with no database, e.g. for
+    analytics jobs. Samples are buffered in memory per endpoint and written as a single row group file in a
+    Hive-style oaipmh_key=<key> partition directory once row_group_size samples are buffered, and at the end
+    of each harvest, so the whole directory can be read as one partitioned dataset.
+    Each harvest checkpoint is only stored once all samples buffered before it have been written, so an
+    interrupted harvest can be resumed without losing samples.
+    N.B: Part files are only ever added, so samples which have changed since they were first harvested, or which
+    are harvested again with skip_unchanged disabled, are stored more than once and should be deduplicated
+    by identifier and latest datestamp when read. Deleted samples are recorded by appending a tombstone row
+    with only identifier and deleted set, which supersedes any earlier rows for the same identifier.
+    Stored samples cannot be searched or looked up, as there is no database to query. See IGSNDatabaseReader.
+    '''
+
+    def __init__(self, parquet_dir=None, row_group_size=None):
+        '''
+        IGSNReader_Parquet class Constructor
+        '''
+        super(IGSNReader_Parquet, self).__init__()
+
+        self.parquet_dir = (parquet_dir
+                            or settings.get('parquet_dir')
+                            or os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                            'data', 'parquet'))
+        self.row_group_size = row_group_size or settings.get('parquet_row_group_size') or DEFAULT_ROW_GROUP_SIZE
+
+        self.parquet_schema = get_parquet_schema(PARQUET_COLUMNS)
+        self._sample_buffers = {} # Lists of buffered sample rows keyed by oaipmh_id
+        self._pending_checkpoints = {} # Latest checkpoint received for each endpoint keyed by oaipmh_id
+        self._part_count = 0
+        self._start_time = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    def close(self):
+        '''
+        Function to write any buffered samples
+        '''
+        self._flush_samples()
+
+    def _get_partition_dir(self, oaipmh_id):
+        '''
+        Function to return the partition directory for an endpoint
+        '''
+        oaipmh_key = self._get_oaipmh_key(oaipmh_id)
+        return os.path.join(self.parquet_dir, PARTITION_DIR_FORMAT.format(oaipmh_key))
+
+    def _get_oaipmh_key(self, oaipmh_id):
+        '''
+        Function to return the OAI-PMH key for an oaipmh_id
+        '''
+        return {endpoint_id: oaipmh_key for endpoint_id, oaipmh_key, _oaipmh_url in self._get_oaipmh_endpoints()}[oaipmh_id]
+
+    def _get_part_paths(self, oaipmh_id):
+        '''
+        Function to return sorted list of part file paths for an endpoint
+        '''
+        partition_dir = self._get_partition_dir(oaipmh_id)
+        if not os.path.isdir(partition_dir):
+            return []
+        return sorted(os.path.join(partition_dir, file_name)
+                      for file_name in os.listdir(partition_dir)
+                      if file_name.startswith('part-') and file_name.endswith('.parquet'))
+
+    def _get_reader_kwargs(self):
+        '''
+        Function to return dict of constructor keyword arguments to create an equivalent reader
+        '''
+        return {'parquet_dir': self.parquet_dir,
+                'row_group_size': self.row_group_size,
+                }
+
+    def _get_oaipmh_endpoints(self):
+        '''
+        Function to return list of (oaipmh_id, oaipmh_key, oaipmh_url) tuples for all configured OAI-PMH endpoints,
+        numbered in configuration order
+        '''
+        return [(endpoint_index + 1, oaipmh_key, oaipmh_url)
+                for endpoint_index, (oaipmh_key, oaipmh_url) in enumerate(settings['oai_pmh_endpoints'].items())]
+
+    def _get_latest_datestamp(self, oaipmh_id):
+        '''
+        Function to return the latest stored datestamp for an endpoint from the statistics of each part file,
+        or None if no samples have been stored
+        '''
+        datestamp_index = PARQUET_COLUMNS.index('datestamp')
+        latest_datestamp = None
+        for part_path in self._get_part_paths(oaipmh_id):
+            parquet_metadata = pyarrow.parquet.read_metadata(part_path)
+            for row_group_index in range(parquet_metadata.num_row_groups):
+                column_statistics = parquet_metadata.row_group(row_group_index).column(datestamp_index).statistics
+                if column_statistics is not None and column_statistics.has_min_max:
+                    latest_datestamp = max(latest_datestamp or column_statistics.max, column_statistics.max)
+        return latest_datestamp
+
+    def _get_sample_count(self, oaipmh_id):
+        '''
+        Function to return the number of samples stored for an endpoint, including any duplicates
+        '''
+        return sum(pyarrow.parquet.read_metadata(part_path).num_rows for part_path in self._get_part_paths(oaipmh_id))
+
+    def _get_harvest_checkpoint(self, oaipmh_id):
+        '''
+        Function to return the stored harvest checkpoint for an endpoint as a dict, or None if no checkpoint has been stored
+        '''
+        state_path = os.path.join(self._get_partition_dir(oaipmh_id), STATE_FILE_NAME)
+        if os.path.isfile(state_path):
+            with open(state_path, 'r') as state_file:
+                return dict(json.load(state_file), oaipmh_id=oaipmh_id)
+
+    def _iter_content_hashes(self, oaipmh_id):
+        '''
+        Generator to yield an (identifier, content_hash) tuple for each sample stored for an endpoint, in part file order
+        so that the latest content hash of any identifier stored more than once comes last
+        '''
+        for part_path in self._get_part_paths(oaipmh_id):
+            parquet_file = pyarrow.parquet.ParquetFile(part_path)
+            if 'content_hash' not in parquet_file.schema_arrow.names:
+                content_hash_table = parquet_file.read(columns=['identifier'])
+                content_hashes = [None] * content_hash_table.num_rows
+            else:
+                content_hash_table = parquet_file.read(columns=['identifier', 'content_hash'])
+                content_hashes = content_hash_table.column('content_hash').to_pylist()
+            for content_hash_row in zip(content_hash_table.column('identifier').to_pylist(), content_hashes):
+                yield content_hash_row
+    
+    def _iter_live_identifiers(self, oaipmh_id):
+        '''
+        Generator to yield the identifier of each sample stored for an endpoint whose latest row is not a tombstone
+        '''
+        deleted_identifiers = {}
+        for part_path in self._get_part_paths(oaipmh_id):
+            parquet_file = pyarrow.parquet.ParquetFile(part_path)
+            if 'deleted' not in parquet_file.schema_arrow.names:
+                identifier_table = parquet_file.read(columns=['identifier'])
+                deleted_datestamps = [None] * identifier_table.num_rows
+            else:
+                identifier_table = parquet_file.read(columns=['identifier', 'deleted'])
+                deleted_datestamps = identifier_table.column('deleted').to_pylist()
+            deleted_identifiers.update(zip(identifier_table.column('identifier').to_pylist(), deleted_datestamps))
+
+        for identifier, deleted_datestamp in deleted_identifiers.items():
+            if not deleted_datestamp:
+                yield identifier
+
+    def _delete_samples(self, oaipmh_id, deleted_samples, remove=False):
+        '''
+        Function to buffer a tombstone row for each deleted sample, written with any other buffered samples.
+        Rows already written cannot be removed, so remove is ignored.
+        Returns number of tombstone rows buffered
+        '''
+        return self._write_samples([{'oaipmh_id': oaipmh_id,
+                                     'identifier': identifier,
+                                     'deleted': deleted_datestamp,
+                                     } for identifier, deleted_datestamp in deleted_samples])
+
+    def _iter_sample_chunks(self, oaipmh_ids=None, from_datestamp=None, until_datestamp=None, chunk_size=None):
+        '''
+        Generator to yield lists of up to chunk_size (oaipmh_key, *SAMPLE_COLUMNS) tuples read from each part file
+        in batches, so that only one batch is held in memory at a time
+        '''
+        oaipmh_id_index = SAMPLE_COLUMNS.index('OAIPMH_ID')
+        datestamp_index = PARQUET_COLUMNS.index('datestamp')
+
+        for oaipmh_id, oaipmh_key, _oaipmh_url in self._get_oaipmh_endpoints():
+            if oaipmh_ids is not None and oaipmh_id not in oaipmh_ids:
+                continue
+
+            for part_path in self._get_part_paths(oaipmh_id):
+                for record_batch in pyarrow.parquet.ParquetFile(part_path).iter_batches(batch_size=chunk_size):
+                    sample_chunk = []
+                    # Columns are read by name, as part files written before a column was added do not have it
+                    for parquet_row in zip(*[record_batch.column(column).to_pylist()
+                                             if record_batch.schema.get_field_index(column) >= 0
+                                             else [None] * record_batch.num_rows
+                                             for column in PARQUET_COLUMNS]):
+                        datestamp = parquet_row[datestamp_index]
+                        if ((from_datestamp and (datestamp is None or datestamp < from_datestamp))
+                            or (until_datestamp and (datestamp is None or datestamp > until_datestamp))):
+                            continue
+
+                        sample_chunk.append((oaipmh_key,) + parquet_row[:oaipmh_id_index] + (oaipmh_id,) + parquet_row[oaipmh_id_index:])
+                    if sample_chunk:
+                        yield sample_chunk
+
+    def _write_samples(self, sample_rows, upsert=False, checkpoint=None):
+        '''
+        Function to buffer a batch of sample records for each endpoint, writing an endpoint's buffer to a new
+        part file once it holds row_group_size samples. Any checkpoint is held until the samples buffered before
+        it have been written. Samples are always appended, regardless of upsert.
+        Returns number of records buffered.
+        '''
+        start_time = timer()
+        for sample_row in sample_rows:
+            self._sample_buffers.setdefault(sample_row['oaipmh_id'], []).append(sample_row)
+
+        if checkpoint:
+            self._pending_checkpoints[checkpoint['oaipmh_id']] = checkpoint
+        self._metrics.add('db_write', timer() - start_time)
+
+        for oaipmh_id, sample_buffer in list(self._sample_buffers.items()):
+            if len(sample_buffer) >= self.row_group_size:
+                self._write_part(oaipmh_id)
+
+        # Store a checkpoint immediately if nothing written before it is still buffered
+        if checkpoint and not self._sample_buffers.get(checkpoint['oaipmh_id']):
+            self._write_part(checkpoint['oaipmh_id'])
+
+        return len(sample_rows)
+
+    def _flush_samples(self):
+        '''
+        Function to write all buffered samples and store any pending checkpoints.
+        Returns empty dict because buffered samples are already counted as written by _write_samples
+        '''
+        for oaipmh_id in sorted(set(self._sample_buffers.keys()) | set(self._pending_checkpoints.keys())):
+            with self._metrics.endpoint(oaipmh_id):
+                self._write_part(oaipmh_id)
+        return {}
+
+    def _write_part(self, oaipmh_id):
+        '''
+        Function to write the buffered samples for an endpoint to a new part file as a single row group,
+        then store any pending checkpoint. Files are written under temporary names which dataset readers ignore
+        '''
+        sample_buffer = self._sample_buffers.pop(oaipmh_id, [])
+        checkpoint = self._pending_checkpoints.pop(oaipmh_id, None)
+        partition_dir = self._get_partition_dir(oaipmh_id)
+        os.makedirs(partition_dir, exist_ok=True)
+
+        if sample_buffer:
+            start_time = timer()
+            part_table = pyarrow.Table.from_pydict({column: [sample_row.get(column) for sample_row in sample_buffer]
+                                                    for column in PARQUET_COLUMNS},
+                                                   schema=self.parquet_schema)
+
+            self._part_count += 1
+            part_path = os.path.join(partition_dir, PART_FILE_FORMAT.format(self._start_time, os.getpid(), self._part_count))
+            temp_path = os.path.join(partition_dir, '.{}.tmp'.format(os.path.basename(part_path)))
+            pyarrow.parquet.write_table(part_table, temp_path, row_group_size=len(sample_buffer))
+            write_time = timer()
+            os.replace(temp_path, part_path)
+            self._metrics.add('db_write', write_time - start_time)
+            self._metrics.add('db_commit', timer() - write_time)
+            logger.debug('Wrote %s samples to %s', len(sample_buffer), part_path)
+
+        if checkpoint:
+            state_path = os.path.join(partition_dir, STATE_FILE_NAME)
+            temp_path = '{}.{}.tmp'.format(state_path, os.getpid())
+            with open(temp_path, 'w') as state_file:
+                json.dump({'resumption_token': checkpoint['resumption_token'],
+                           'cursor': checkpoint['cursor'],
+                           'complete_list_size': checkpoint['complete_list_size'],
+                           'updated': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                           }, state_file)
+            os.replace(temp_path, state_path)
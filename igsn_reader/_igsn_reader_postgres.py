@@ -1,17 +1,82 @@
 import os
+import io
 import logging
-import re
-import requests
-from lxml import etree
-from time import sleep
+import threading
+import weakref
+from contextlib import contextmanager
+from time import monotonic
+from timeit import default_timer as timer
 import psycopg2
+import psycopg2.pool
 
-from ._igsn_reader import settings, IGSNReader
+from ._igsn_reader import (settings, IGSNDatabaseReader, SAMPLE_COLUMNS, HARVEST_STATE_COLUMNS, EXTENT_COLUMNS, SAMPLE_VALUE_TABLES,
+                           get_sample_values, get_stored_values)
+from ._coverage_parser import parse_coverage
 
-DEBUG_MAX_SAMPLES = 0 # Number of samples to store before finishing while in debug mode
-REPORT_INCREMENT = 1000 # Number of records to insert before reporting progress
-MAX_RETRIES = 2 # Maximum number of times to retry request
-RETRY_SLEEP = 10 # Seconds to sleep before retrying request
+TIMESTAMP_TYPE = 'timestamp with time zone' # Type of timestamp columns, which are written and read as OAI-PMH UTC datestamp strings
+
+# Types of sample table columns which are not text, used to add columns missing from an existing database
+# and to select timestamps as OAI-PMH UTC datestamp strings
+SAMPLE_COLUMN_TYPES = {
+    'OAIPMH_ID': 'bigint',
+    'DATESTAMP': TIMESTAMP_TYPE,
+    'DELETED': TIMESTAMP_TYPE,
+    }
+SAMPLE_COLUMN_TYPES.update({column: 'double precision' for column in EXTENT_COLUMNS})
+
+# Box of each sample's extent, matching the expression indexed by sample_extent_idx
+EXTENT_BOX_SQL = 'box(point(sample.min_longitude, sample.min_latitude), point(sample.max_longitude, sample.max_latitude))'
+
+# Statements creating a SAMPLE_VALUE_TABLES table and its value index, used to add tables missing from an existing database
+VALUE_TABLE_SQL = '''create table if not exists {value_table} (
+    sample_id bigint not null references sample (sample_id) on delete cascade,
+    ordinal integer not null,
+    value text not null,
+    primary key (sample_id, ordinal)
+    );
+'''
+VALUE_INDEX_SQL = 'create index if not exists {value_table}_value_idx on {value_table} (value);'
+
+# Weighted full-text search vector of a sample row, matching the sample_search_vector_update trigger in the DDL script
+SEARCH_VECTOR_SQL = '''setweight(to_tsvector('{text_search_config}', coalesce({row}title, '')), 'A')
+        || setweight(to_tsvector('{text_search_config}', coalesce({row}subject, '')), 'B')
+        || setweight(to_tsvector('{text_search_config}', coalesce({row}description, '')), 'C')'''
+
+# Statements creating the trigger maintaining the search_vector column, used to add it to an existing database
+SEARCH_VECTOR_TRIGGER_SQL = '''create or replace function sample_search_vector_update() returns trigger
+    language plpgsql
+    as $$
+begin
+    new.search_vector := {search_vector};
+    return new;
+end
+$$;
+drop trigger if exists sample_search_vector_update on sample;
+create trigger sample_search_vector_update before insert or update of title, subject, description on sample
+    for each row execute procedure sample_search_vector_update();
+'''
+
+# Statements creating the secondary and full-text indexes on sample keyed by index name,
+# used to add any missing from an existing database
+SAMPLE_INDEX_SQL = {
+    'sample_datestamp_idx': 'create index if not exists sample_datestamp_idx on sample (datestamp);',
+    'sample_oaipmh_id_datestamp_idx': 'create index if not exists sample_oaipmh_id_datestamp_idx on sample (oaipmh_id, datestamp);',
+    'sample_type_idx': 'create index if not exists sample_type_idx on sample (type);',
+    'sample_search_vector_idx': 'create index if not exists sample_search_vector_idx on sample using gin (search_vector);',
+    }
+
+# Statement creating the harvest_state table, used to add it to a database created before checkpoints were stored
+HARVEST_STATE_TABLE_SQL = '''create table if not exists harvest_state (
+    oaipmh_id bigint not null primary key references oaipmh (oaipmh_id),
+    resumption_token text,
+    cursor bigint,
+    complete_list_size bigint,
+    updated timestamp with time zone default now() not null
+    );
+'''
+
+# Columns set from the written row when a sample with the same identifier is updated in place
+SAMPLE_UPDATES = ',\n    '.join('{0} = excluded.{0}'.format(column) for column in SAMPLE_COLUMNS if column != 'IDENTIFIER')
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +86,251 @@ else:
     logger.setLevel(logging.INFO)
 logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
 
-class IGSNReader_postgres(IGSNReader):
+
+def get_copy_value(value):
+    '''
+    Function to return a value as a field of COPY text format, with backslash escapes and \\N for NULL
+    '''
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def get_prepare_sql(statement_name, conflict_action):
+    '''
+    Function to return a PREPARE statement inserting rows into sample from one array parameter per column in
+    SAMPLE_COLUMNS, taking the specified action on a conflicting identifier.
+    Timestamps are passed as text[] and cast to the column type.
+    The sample_id, identifier and content_hash of each sample inserted or updated are returned
+    '''
+    return '''prepare {statement_name} ({types}) as
+insert into sample (
+    {columns}
+    )
+select 
+    {values}
+from unnest({params}) as sample_row (
+    {columns}
+    )
+on conflict (identifier) do {conflict_action}
+returning sample_id, identifier, content_hash;
+'''.format(statement_name=statement_name,
+           types=', '.join('{}[]'.format(SAMPLE_COLUMN_TYPES.get(column, 'text')) 
+                           if SAMPLE_COLUMN_TYPES.get(column) != TIMESTAMP_TYPE 
+                           else 'text[]' 
+                           for column in SAMPLE_COLUMNS),
+           columns=',\n    '.join(SAMPLE_COLUMNS),
+           values=',\n    '.join('sample_row.{}::{}'.format(column, TIMESTAMP_TYPE) 
+                                  if SAMPLE_COLUMN_TYPES.get(column) == TIMESTAMP_TYPE 
+                                  else 'sample_row.' + column 
+                                  for column in SAMPLE_COLUMNS),
+           params=', '.join('${}'.format(column_index + 1) for column_index in range(len(SAMPLE_COLUMNS))),
+           conflict_action=conflict_action)
+
+
+class IGSNReader_postgres(IGSNDatabaseReader):
     
     DEFAULT_POSTGRES_AUTOCOMMIT = True
+    CONTENT_HASH_FETCH_SIZE = 100000 # Number of content hashes or identifiers fetched from the server at a time
+    DEFAULT_POOL_SIZE = 4 # Maximum number of connections in each process's connection pool
+    POOL_MIN_SIZE = 1 # Number of idle connections kept open by each connection pool
+    POOL_CHECK_INTERVAL = 30 # Seconds a pooled connection may be idle before it is checked with a query when borrowed
+    
+    # Prepared statements writing a whole batch of samples from one array parameter per column, so that each statement
+    # is parsed and planned once per connection rather than sent as text with every batch. Keyed by statement name.
+    # Inserts leave existing samples in place, unless they are marked as deleted and their records have reappeared
+    PREPARED_STATEMENTS = {
+        'insert_samples': get_prepare_sql('insert_samples', 
+                                          'update set\n    {}\nwhere sample.deleted is not null'.format(SAMPLE_UPDATES)),
+        'upsert_samples': get_prepare_sql('upsert_samples', 'update set\n    {}'.format(SAMPLE_UPDATES)),
+        }
+    
+    CHECKPOINT_SQL = '''insert into harvest_state (
+    {columns},
+    updated
+    )
+values (
+    {values},
+    now()
+    )
+on conflict (oaipmh_id) do update set
+    {updates},
+    updated = excluded.updated;
+'''.format(columns=',\n    '.join(HARVEST_STATE_COLUMNS),
+           values=',\n    '.join('%({})s'.format(column.lower()) for column in HARVEST_STATE_COLUMNS),
+           updates=',\n    '.join('{0} = excluded.{0}'.format(column) for column in HARVEST_STATE_COLUMNS if column != 'OAIPMH_ID'))
+    
+    # Session-private staging table for bulk loads. Temporary tables are never WAL-logged, like unlogged tables,
+    # and each partitioned harvest worker gets its own
+    CREATE_STAGING_SQL = '''drop table if exists pg_temp.sample_staging;
+create temporary table sample_staging as
+select 
+    {columns}
+from sample
+with no data;
+alter table sample_staging add column upsert boolean;
+alter table sample_staging add column staging_id bigserial;
+drop table if exists pg_temp.sample_value_staging;
+create temporary table sample_value_staging (
+    identifier text,
+    content_hash text,
+    value_key text,
+    ordinal integer,
+    value text
+    );
+'''.format(columns=',\n    '.join(SAMPLE_COLUMNS))
+    
+    COPY_SQL = 'copy sample_staging ({columns}, upsert) from stdin;'.format(columns=', '.join(SAMPLE_COLUMNS))
+    
+    VALUE_COPY_SQL = 'copy sample_value_staging (identifier, content_hash, value_key, ordinal, value) from stdin;'
+    
+    # Set-based merge of samples staged with or without upsert into sample, keeping one version of each identifier:
+    # the first staged when inserting, as for INSERT_SQL, or the last staged when updating in place, as for UPSERT_SQL
+    MERGE_SQL = '''with merged_sample as (
+    insert into sample (
+        {columns}
+        )
+    select distinct on (identifier)
+        {columns}
+    from sample_staging
+    where identifier is not null
+        and upsert = {{upsert}}
+    order by identifier, staging_id {{staging_order}}
+    on conflict (identifier) do {{conflict_action}}
+    returning oaipmh_id
+    )
+select oaipmh_id, count(*)
+from merged_sample
+group by oaipmh_id;
+'''.format(columns=',\n        '.join(SAMPLE_COLUMNS))
+    
+    MERGE_UPDATES = 'update set\n        {}'.format(',\n        '.join('{0} = excluded.{0}'.format(column) 
+                                                                    for column in SAMPLE_COLUMNS if column != 'IDENTIFIER'))
+    
+    # Update of a sample merged without upsert, only if it is marked as deleted and its record has reappeared
+    MERGE_DELETED_UPDATES = MERGE_UPDATES + '\n    where sample.deleted is not null'
+    
+    # Set-based merge of the staged values of each merged sample into a value table, replacing any values already
+    # stored for it. Merged samples are those whose stored content hash matches that of the staged version
+    VALUE_MERGE_SQL = '''delete from {value_table}
+using sample_staging, sample
+where sample.identifier = sample_staging.identifier
+    and sample.content_hash = sample_staging.content_hash
+    and {value_table}.sample_id = sample.sample_id;
+insert into {value_table} (
+    sample_id,
+    ordinal,
+    value
+    )
+select 
+    sample.sample_id,
+    sample_value_staging.ordinal,
+    sample_value_staging.value
+from sample_value_staging
+join sample on sample.identifier = sample_value_staging.identifier
+    and sample.content_hash = sample_value_staging.content_hash
+where sample_value_staging.value_key = %(value_key)s
+on conflict (sample_id, ordinal) do nothing;
+'''
+    
+    TEXT_SEARCH_CONFIG = 'english' # Text search configuration, which must match the sample search_vector trigger
+    
+    # SAMPLE_COLUMNS as selected from sample, with timestamps as OAI-PMH UTC datestamp strings
+    SAMPLE_SELECT_COLUMNS = ',\n    '.join('''to_char(sample.{} at time zone 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"')'''.format(column.lower()) 
+                                          if SAMPLE_COLUMN_TYPES.get(column) == TIMESTAMP_TYPE 
+                                          else 'sample.' + column.lower()
+                                          for column in SAMPLE_COLUMNS)
+    
+    SEARCH_SQL = '''select 
+    ts_rank(sample.search_vector, search_query) as rank,
+    oaipmh.oaipmh_key,
+    {columns}
+from sample
+join oaipmh using (oaipmh_id)
+cross join plainto_tsquery(%(text_search_config)s::regconfig, %(search_text)s) search_query
+where sample.search_vector @@ search_query
+    and sample.deleted is null{{filters}}
+order by rank desc, sample.identifier
+limit %(limit)s offset %(offset)s;
+'''.format(columns=SAMPLE_SELECT_COLUMNS)
+    
+    # Samples whose extent box overlaps, or is contained in, a bbox, found with the GiST index. The planner cannot
+    # estimate how many samples a box matches, so OFFSET 0 stops it scanning the identifier index to satisfy the limit.
+    # Only the identifiers of matching samples are sorted, and whole rows are read for the page of results
+    BBOX_SQL = '''select 
+    oaipmh.oaipmh_key,
+    {columns}
+from (
+    select sample_id, identifier
+    from (
+        select sample_id, identifier
+        from sample
+        where {extent_box} {{operator}} box(point(%(min_longitude)s, %(min_latitude)s), point(%(max_longitude)s, %(max_latitude)s))
+            and sample.deleted is null{{filters}}
+        offset 0
+        ) bbox_sample
+    order by identifier
+    limit %(limit)s offset %(offset)s
+    ) bbox_sample
+join sample using (sample_id)
+join oaipmh using (oaipmh_id)
+order by sample.identifier;
+'''.format(columns=SAMPLE_SELECT_COLUMNS,
+           extent_box=EXTENT_BOX_SQL)
+    
+    # Samples with any of an array of identifiers, found with the sample_identifier value index
+    RESOLVE_SQL = '''select 
+    sample_identifier.value,
+    sample.identifier
+from sample_identifier
+join sample using (sample_id)
+where sample_identifier.value = any(%(identifiers)s)
+    and sample.deleted is null;
+'''
+    
+    # Samples with any of an array of identifiers, with the identifier each was found by
+    SAMPLES_SQL = '''select 
+    sample_identifier.value,
+    oaipmh.oaipmh_key,
+    {columns}
+from sample_identifier
+join sample using (sample_id)
+join oaipmh using (oaipmh_id)
+where sample_identifier.value = any(%(identifiers)s)
+    and sample.deleted is null;
+'''.format(columns=SAMPLE_SELECT_COLUMNS)
+    
+    # Relations of an array of samples, with any samples they identify. A relation identifying no sample not marked as
+    # deleted is returned with a null related identifier
+    RELATIONS_SQL = '''select 
+    sample.identifier,
+    sample_relation.value,
+    related_sample.identifier
+from sample
+join sample_relation on sample_relation.sample_id = sample.sample_id
+left join sample_identifier on sample_identifier.value = sample_relation.value
+left join sample as related_sample on related_sample.sample_id = sample_identifier.sample_id
+    and related_sample.deleted is null
+where sample.identifier = any(%(identifiers)s)
+    and sample.deleted is null;
+'''
+    
+    # Relations of other samples identifying any of an array of samples
+    INVERSE_RELATIONS_SQL = '''select 
+    relating_sample.identifier,
+    sample_relation.value,
+    sample.identifier
+from sample
+join sample_identifier on sample_identifier.sample_id = sample.sample_id
+join sample_relation on sample_relation.value = sample_identifier.value
+join sample as relating_sample on relating_sample.sample_id = sample_relation.sample_id
+where sample.identifier = any(%(identifiers)s)
+    and sample.deleted is null
+    and relating_sample.deleted is null;
+'''
     
     def __init__(self,
                  postgres_host=None, 
@@ -32,10 +339,12 @@ class IGSNReader_postgres(IGSNReader):
                  postgres_user=None, 
                  postgres_password=None, 
                  autocommit=None, 
-                 debug=False
+                 debug=False,
+                 pool_size=None
                  ):
         '''
         IGSNReader_postgres class Constructor
+        pool_size: Maximum number of connections in the connection pool of each process using the reader
         '''
         super(IGSNReader_postgres, self).__init__()
 
@@ -45,204 +354,778 @@ class IGSNReader_postgres(IGSNReader):
         self.postgres_user = postgres_user or settings.get('postgres_user') or 'db_user'
         self.postgres_password = postgres_password or settings.get('postgres_password') or 'db_password'
         self.autocommit = autocommit if autocommit is not None else IGSNReader_postgres.DEFAULT_POSTGRES_AUTOCOMMIT
+        self.pool_size = pool_size or settings.get('postgres_pool_size') or IGSNReader_postgres.DEFAULT_POOL_SIZE
+        
+        self._pool = None # ThreadedConnectionPool, created on first use in each process
+        self._pool_pid = None # ID of the process which created the connection pool
+        self._pool_lock = threading.Lock()
+        self._pool_semaphore = None # Semaphore bounding the number of connections borrowed from the pool
+        self._thread_local = threading.local() # Connection held by each thread and its number of borrowers
+        self._connection_used_times = weakref.WeakKeyDictionary() # Monotonic time each connection was last returned
+        self._prepared_statements = weakref.WeakKeyDictionary() # Sets of names of statements prepared on each connection
+        
+        self._bulk_writes = False # True while samples are staged for a bulk load merge
+        self._staged_count = 0
+        self._pending_checkpoints = {} # Latest checkpoint staged for each endpoint keyed by oaipmh_id
+                
+    @property
+    def db_connection(self):
+        '''
+        Database connection held by the current thread. A thread which does not already hold a connection
+        borrows one from the connection pool to keep until close()
+        '''
+        db_connection = getattr(self._thread_local, 'db_connection', None)
+        return db_connection if db_connection is not None else self._connect()
+    
+    def close(self):
+        '''
+        Function to close all connections in this process's connection pool
+        '''
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.closeall()
+        self._pool = None
+        self._thread_local = threading.local()
+    
+    def _connect(self):
+        '''
+        Function to borrow a database connection from the connection pool for the current thread to keep until close()
+        '''
+        return self._borrow_connection()
+    
+    @property
+    def _connection_pool(self):
+        '''
+        ThreadedConnectionPool of up to pool_size connections, created on first use in each process so that
+        a forked process never uses its parent's connections. The database is prepared with the first connection
+        '''
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = psycopg2.pool.ThreadedConnectionPool(IGSNReader_postgres.POOL_MIN_SIZE,
+                                                                      self.pool_size,
+                                                                      host=self.postgres_host, 
+                                                                      port=self.postgres_port, 
+                                                                      dbname=self.postgres_dbname, 
+                                                                      user=self.postgres_user, 
+                                                                      password=self.postgres_password)
+                    self._pool_pid = os.getpid()
+                    self._pool_semaphore = threading.BoundedSemaphore(self.pool_size)
+                    self._thread_local = threading.local()
+                    
+                    logger.debug('Connected to database {}:{}/{} as {} with up to {} connections'.format(self.postgres_host, 
+                                                                                                         self.postgres_port, 
+                                                                                                         self.postgres_dbname,
+                                                                                                         self.postgres_user,
+                                                                                                         self.pool_size))
+                    db_connection = self._pool.getconn()
+                    try:
+                        self._check_connection(db_connection)
+                        self._prepare_database(db_connection)
+                    finally:
+                        self._connection_used_times[db_connection] = monotonic()
+                        self._pool.putconn(db_connection)
+        return self._pool
+    
+    def _check_connection(self, db_connection):
+        '''
+        Function to return True if a connection borrowed from the pool can be used, setting up any new connection
+        and checking any connection which has been idle for more than POOL_CHECK_INTERVAL seconds with a query
+        '''
+        if db_connection.closed:
+            return False
+        
+        used_time = self._connection_used_times.get(db_connection)
+        if used_time is None:
+            if self.autocommit:
+                db_connection.autocommit = True
+                db_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            else:
+                db_connection.autocommit = False
+                db_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+        elif monotonic() - used_time > IGSNReader_postgres.POOL_CHECK_INTERVAL:
+            try:
+                with db_connection.cursor() as cursor:
+                    cursor.execute('select 1')
+                if not db_connection.autocommit:
+                    db_connection.rollback()
+            except psycopg2.Error as e:
+                logger.warning('Discarding broken database connection: {}'.format(str(e).strip()))
+                return False
+        return True
+    
+    def _borrow_connection(self):
+        '''
+        Function to return the connection held by the current thread, borrowing a connection from the pool
+        if the thread does not already hold one. Each call must be matched by a call to _release_connection.
+        Waits for a connection to be released if pool_size connections are already borrowed.
+        Connections which have been closed or fail their health check are discarded and replaced
+        '''
+        db_connection = getattr(self._thread_local, 'db_connection', None)
+        if db_connection is not None:
+            self._thread_local.borrow_count += 1
+            return db_connection
+        
+        connection_pool = self._connection_pool
+        self._pool_semaphore.acquire()
+        try:
+            db_connection = connection_pool.getconn()
+            while not self._check_connection(db_connection):
+                connection_pool.putconn(db_connection, close=True)
+                db_connection = connection_pool.getconn()
+        except Exception:
+            self._pool_semaphore.release()
+            raise
+        
+        self._thread_local.db_connection = db_connection
+        self._thread_local.borrow_count = 1
+        return db_connection
+    
+    def _release_connection(self):
+        '''
+        Function to return the connection held by the current thread to the pool once all its borrowers have
+        released it. A connection which has been closed, e.g. because the server connection was lost, is discarded
+        '''
+        self._thread_local.borrow_count -= 1
+        if self._thread_local.borrow_count:
+            return
+        
+        db_connection = self._thread_local.db_connection
+        self._thread_local.db_connection = None
+        try:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._connection_used_times[db_connection] = monotonic()
+                self._pool.putconn(db_connection, close=bool(db_connection.closed))
+        finally:
+            self._pool_semaphore.release()
+    
+    def _reconnecting(self, write_function):
+        '''
+        Function to return the result of write_function(), calling it once more with a new pooled connection
+        if it fails with a connection error, e.g. because the server connection was lost.
+        write_function must make an idempotent write in a single transaction
+        '''
+        try:
+            return write_function()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if getattr(self._thread_local, 'db_connection', None) is not None:
+                raise # A connection held by the thread cannot be replaced
+            logger.warning('Retrying database write with a new connection after error: {}'.format(str(e).strip()))
+            return write_function()
+    
+    def _prepare_database(self, db_connection):
+        '''
+        Function to add any columns, search_vector trigger, indexes and value tables missing from the sample table,
+        and the harvest_state table if it is missing, and insert any configured OAI-PMH endpoints not already in the OAIPMH table
+        '''
+        cursor = db_connection.cursor()       
+        
+        # Add any columns missing from a database created before they were added to the DDL script.
+        # ALTER TABLE locks the whole table, so it is only run if a column is missing
+        cursor.execute('''select column_name 
+from information_schema.columns 
+where table_schema = 'public' 
+    and table_name = 'sample' ''')
+        table_columns = [column_name.upper() for column_name, in cursor.fetchall()]
+        for column in SAMPLE_COLUMNS:
+            if column not in table_columns:
+                try:
+                    with db_connection:
+                        cursor.execute('alter table sample add column if not exists {} {};'.format(
+                            column.lower(), SAMPLE_COLUMN_TYPES.get(column, 'text')))
+                    logger.info('Added column {} to sample table'.format(column.lower()))
+                except Exception as e:
+                    logger.warning('Unable to add column {} to sample table: {}'.format(column.lower(), e))
+        
+        # Unchanged samples are skipped by later harvests, so extents are parsed from the stored coverage
+        if table_columns and any(column not in table_columns for column in EXTENT_COLUMNS):
+            self._parse_stored_coverage(db_connection)
+        
+        # Likewise, search vectors are computed from the stored samples once the column and its trigger are added
+        if table_columns and 'SEARCH_VECTOR' not in table_columns:
+            try:
+                self._store_search_vectors(db_connection)
+            except Exception as e:
+                logger.warning('Unable to add search_vector column to sample table: {}'.format(e))
+        
+        cursor.execute('''select indexname 
+from pg_indexes 
+where schemaname = 'public' 
+    and tablename = 'sample' ''')
+        index_names = [index_name for index_name, in cursor.fetchall()]
+        for index_name, index_sql in SAMPLE_INDEX_SQL.items():
+            if table_columns and index_name not in index_names:
+                try:
+                    with db_connection:
+                        cursor.execute(index_sql)
+                    logger.info('Created index {} on sample table'.format(index_name))
+                except Exception as e:
+                    logger.warning('Unable to create index {} on sample table: {}'.format(index_name, e))
+        
+        cursor.execute('''select table_name 
+from information_schema.tables 
+where table_schema = 'public' ''')
+        table_names = [table_name.upper() for table_name, in cursor.fetchall()]
+        if table_columns and any(value_table not in table_names for value_table in SAMPLE_VALUE_TABLES.values()):
+            self._store_existing_values(db_connection)
+        
+        if table_columns and 'HARVEST_STATE' not in table_names:
+            try:
+                with db_connection:
+                    cursor.execute(HARVEST_STATE_TABLE_SQL)
+                logger.info('Created harvest_state table')
+            except Exception as e:
+                logger.warning('Unable to create harvest_state table: {}'.format(e))
         
-        self.db_connection = psycopg2.connect(host=self.postgres_host, 
-                                              port=self.postgres_port, 
-                                              dbname=self.postgres_dbname, 
-                                              user=self.postgres_user, 
-                                              password=self.postgres_password)
-        
-        if self.autocommit:
-            self.db_connection.autocommit = True
-            self.db_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-        else:
-            self.db_connection.autocommit = False
-            self.db_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
-            
-        logger.debug('Connected to database {}:{}/{} as {}'.format(self.postgres_host, 
-                                                                       self.postgres_port, 
-                                                                       self.postgres_dbname,
-                                                                       self.postgres_user))    
-        
-        cursor = self.db_connection.cursor()       
         for key, value in settings['oai_pmh_endpoints'].items():
             try:
                 cursor.execute("""insert into OAIPMH (OAIPMH_KEY, OAIPMH_URL)
                     values (%(key)s, %(value)s);
                     """, {'key': key, 
                           'value': value})
-                self.db_connection.commit()
+                db_connection.commit()
                 if cursor.rowcount:
                     logger.info('"{}" inserted into OAIPMH table for key {}'.format(value, key))
             except Exception as e:
-                logger.debug('{}'.format(e))    
-                                
-    def read_igsns(self, oaipmh_source=None, resumption_token=None):
-        '''
-        Function to read IGSNS into database
-        '''
-        insert_sql = '''insert into sample (
-    OAIPMH_ID,
-    IDENTIFIER,
-    DATESTAMP,
-    ALT_IDENTIFIERS,
-    TITLE,
-    SUBJECT,
-    DESCRIPTION,
-    TYPE,
-    FORMAT,
-    COVERAGE,
-    CREATOR,
-    PUBLISHER,
-    RIGHTS
-    )
-values (
-    %(oaipmh_id)s,
-    %(identifier)s,
-    %(datestamp)s,
-    %(alt_identifiers)s,
-    %(title)s,
-    %(subject)s,
-    %(description)s,
-    %(type)s,
-    %(format)s,
-    %(coverage)s,
-    %(creator)s,
-    %(publisher)s,
-    %(rights)s
-    );
-'''                        
-
-        cursor = self.db_connection.cursor()
-        cursor.execute('select OAIPMH_ID, OAIPMH_KEY, OAIPMH_URL from OAIPMH')
-        
-        for oaipmh_id, oaipmh_key, oaipmh_url in cursor.fetchall():
-            # Skip any sources not in specified source list
-            if oaipmh_source and oaipmh_key != oaipmh_source:
-                continue
-            
-            logger.info('Querying records for {}'.format(oaipmh_key))
-            
-            http_params = {'verb': 'ListRecords',
-                           'metadataPrefix': 'oai_dc',
-                           'resumptionToken': resumption_token}
-        
-            sample_count = 0            
-            while not sample_count or resumption_token:
-                logger.debug('resumption_token = {}'.format(resumption_token))
-                if resumption_token:
-                    http_params = {'verb': 'ListRecords',
-                                   'resumptionToken': resumption_token}
-                    
-                retries = 0
-                while True:
-                    try:
-                        response_content = None
-                        logger.debug('oaipmh_url = {}, headers={}, params={}, data={}, timeout={}'.format(oaipmh_url, None, http_params, None, settings['timeout']))
-                        response = requests.get(oaipmh_url, headers=None, params=http_params, data=None, timeout=settings['timeout'])
-                        assert response.status_code == 200, 'Response status code {} != 200: {}'.format(response.status_code, response.content)
-                        
-                        # Hack to get around CSIRO namespace definition
-                        response_content = response.content.decode('utf-8')
-                        response_content = re.sub('xmlns:ns3="http://www.openarchives.org/OAI/2.0/"', '', re.sub('ns3:', '', response_content)).encode('utf-8')
-                        #logger.debug(response_content)
-                        
-                        response_tree = etree.fromstring(response_content)
-                        
-                        list_records_element = response_tree.find('./ListRecords', namespaces=response_tree.nsmap)
-                        assert list_records_element is not None, 'Unable to find OAI-PMH/ListRecords element'
-                        
-                        break # We have our list_records_element - proceed with parsing
-                    except Exception as e:
-                        logger.warning('HTTP get failed: {}'.format(e))
-                        if response_content is not None:
-                            logger.debug(response_content)
-
-                        if retries < MAX_RETRIES:
-                            retries += 1
-                            logger.warning('Waiting {} seconds before retrying...'.format(RETRY_SLEEP))
-                            sleep(RETRY_SLEEP)
-                            continue
-                        else:
-                            raise(e)
-                                        
-                resumption_token_element = list_records_element.find('./resumptionToken', namespaces=response_tree.nsmap)
-                if resumption_token_element is not None:
-                    resumption_token = resumption_token_element.text
-                    if resumption_token is not None:
-                        resumption_token = resumption_token.strip()
-                else:
-                    resumption_token = None
+                db_connection.rollback()
+                logger.debug('{}'.format(e))
                 
-                # Read Dublin Core metadata for each record in response
-                for record_element in list_records_element.findall('./record', namespaces=response_tree.nsmap):
-                    insert_params = {'oaipmh_id': oaipmh_id}
-                    try:
-                        insert_params['identifier'] = record_element.find('./header/identifier', namespaces=response_tree.nsmap).text
-                        try:
-                            insert_params['datestamp'] = record_element.find('./header/datestamp', namespaces=response_tree.nsmap).text
-                        except:
-                            insert_params['datestamp'] = None
-                            
-                        # Find Dublin Core element
-                        dc_element = record_element.find('./metadata/{http://www.openarchives.org/OAI/2.0/oai_dc/}dc', namespaces=response_tree.nsmap) # CSIRO
-                        if dc_element is None:
-                            dc_element = record_element.find('./metadata', namespaces=response_tree.nsmap) # GA
-                        
-                        insert_params['alt_identifiers'] = ', '.join([alt_identifier_element.text
-                                                    for alt_identifier_element in dc_element.findall('./dc:identifier', 
-                                                                                                     namespaces=dc_element.nsmap)
-                                                    ])
-                        
-                        insert_params['relations'] = ', '.join([alt_identifier_element.text
-                                                    for alt_identifier_element in dc_element.findall('./dc:relation', 
-                                                                                                     namespaces=dc_element.nsmap)
-                                                    ])
-                        
-                        for dc_attribute in [
-                            'title',
-                            'subject',
-                            'description',
-                            'date',
-                            'type',
-                            'format',
-                            'coverage',
-                            'creator',
-                            'publisher',
-                            'rights',
-                            ]:
-                            try:                         
-                                insert_params[dc_attribute] = dc_element.find('./dc:{}'.format(dc_attribute), 
-                                                                                namespaces=dc_element.nsmap).text
-                            except Exception as e:
-                                #logger.debug('Dublin Core attribute read for {} failed: {}'.format(dc_attribute, e))
-                                insert_params[dc_attribute] = None
+    def _parse_stored_coverage(self, db_connection):
+        '''
+        Function to set the extent columns of all stored samples from their coverage, reading CONTENT_HASH_FETCH_SIZE
+        samples at a time from a server-side named cursor and updating each chunk with a single statement,
+        then create the spatial index if it is missing
+        '''
+        start_time = timer()
+        extent_count = 0
+        autocommit = db_connection.autocommit
+        db_connection.autocommit = False # Named cursors can only be used within a transaction
+        try:
+            with db_connection:
+                with db_connection.cursor(name='stored_coverage') as coverage_cursor, db_connection.cursor() as cursor:
+                    coverage_cursor.execute('select sample_id, coverage from sample where coverage is not null')
+                    while True:
+                        coverage_rows = coverage_cursor.fetchmany(IGSNReader_postgres.CONTENT_HASH_FETCH_SIZE)
+                        if not coverage_rows:
+                            break
                         
-                    except Exception as e:
-                        logger.warning('Attribute read failed: {}'.format(e))
-                        continue
-                            
-                    logger.debug('Inserting record for {}'.format(insert_params['identifier']))
-                    insert_cursor = self.db_connection.cursor()
-                    logger.debug(insert_params)
-                    try:
-                        insert_cursor.execute(insert_sql, insert_params)
-                        self.db_connection.commit()
-                    except Exception as e:
-                        logger.debug('Record insertion failed: {}'.format(e)) # OK: Record might already exist
+                        extent_rows = [(sample_id,) + extent
+                                       for sample_id, extent in ((sample_id, parse_coverage(coverage)) 
+                                                                 for sample_id, coverage in coverage_rows)
+                                       if extent]
+                        if extent_rows:
+                            cursor.execute('''update sample
+set {updates}
+from unnest(%s::bigint[], %s::double precision[], %s::double precision[], %s::double precision[], %s::double precision[]) 
+    as extent(sample_id, {columns})
+where sample.sample_id = extent.sample_id'''.format(updates=', '.join('{0} = extent.{0}'.format(column.lower()) 
+                                                                          for column in EXTENT_COLUMNS),
+                                                        columns=', '.join(column.lower() for column in EXTENT_COLUMNS)),
+                                           [list(extent_values) for extent_values in zip(*extent_rows)])
+                            extent_count += len(extent_rows)
+                
+                with db_connection.cursor() as cursor:
+                    cursor.execute('create index if not exists sample_extent_idx on sample using gist ({});'.format(
+                        EXTENT_BOX_SQL.replace('sample.', '')))
+        finally:
+            db_connection.autocommit = autocommit
+        logger.info('Parsed extents of {} existing samples from coverage in {:.1f} seconds'.format(extent_count, 
+                                                                                                   timer() - start_time))
+    
+    def _store_search_vectors(self, db_connection):
+        '''
+        Function to add the search_vector column and the trigger maintaining it to the sample table, then set the
+        search vectors of all stored samples with a single statement, in one transaction
+        '''
+        start_time = timer()
+        with db_connection:
+            with db_connection.cursor() as cursor:
+                cursor.execute('alter table sample add column if not exists search_vector tsvector;')
+                cursor.execute(SEARCH_VECTOR_TRIGGER_SQL.format(
+                    search_vector=SEARCH_VECTOR_SQL.format(text_search_config=IGSNReader_postgres.TEXT_SEARCH_CONFIG, 
+                                                           row='new.')))
+                cursor.execute('update sample set search_vector = {};'.format(
+                    SEARCH_VECTOR_SQL.format(text_search_config=IGSNReader_postgres.TEXT_SEARCH_CONFIG, 
+                                             row='')))
+                sample_count = cursor.rowcount
+        logger.info('Added search_vector column and stored search vectors of {} existing samples in {:.1f} seconds'.format(sample_count, 
+                                                                                                                           timer() - start_time))
+    
+    def _store_existing_values(self, db_connection):
+        '''
+        Function to create any missing SAMPLE_VALUE_TABLES tables and fill them with the values recovered from the
+        columns of all stored samples, reading CONTENT_HASH_FETCH_SIZE samples at a time from a server-side named cursor,
+        then create their value indexes. See get_stored_values
+        '''
+        start_time = timer()
+        sample_count = 0
+        autocommit = db_connection.autocommit
+        db_connection.autocommit = False # Named cursors can only be used within a transaction
+        try:
+            with db_connection:
+                with db_connection.cursor() as cursor:
+                    for value_table in SAMPLE_VALUE_TABLES.values():
+                        cursor.execute(VALUE_TABLE_SQL.format(value_table=value_table.lower()))
+                
+                with db_connection.cursor(name='stored_values') as sample_cursor, db_connection.cursor() as cursor:
+                    sample_cursor.execute('select sample_id, identifier, alt_identifiers, subject, creator from sample')
+                    while True:
+                        sample_rows = sample_cursor.fetchmany(IGSNReader_postgres.CONTENT_HASH_FETCH_SIZE)
+                        if not sample_rows:
+                            break
                         
-                    sample_count += 1
-                    
-                    if sample_count % REPORT_INCREMENT == 0:
-                        logger.info('{} samples updated'.format(sample_count))
-                    
-                    if settings['debug'] and DEBUG_MAX_SAMPLES > 0 and sample_count >= DEBUG_MAX_SAMPLES:
-                        break
+                        self._insert_sample_values(cursor, 
+                                                   {value_key: [(sample_id, ordinal, value)
+                                                                for sample_id, *stored_columns in sample_rows
+                                                                for ordinal, value in enumerate(get_stored_values(*stored_columns)[value_key], 1)]
+                                                    for value_key in SAMPLE_VALUE_TABLES.keys()})
+                        sample_count += len(sample_rows)
                 
-                if settings['debug'] and DEBUG_MAX_SAMPLES > 0 and sample_count >= DEBUG_MAX_SAMPLES:
-                    logger.debug('Debug limit reached')
+                with db_connection.cursor() as cursor:
+                    for value_table in SAMPLE_VALUE_TABLES.values():
+                        cursor.execute(VALUE_INDEX_SQL.format(value_table=value_table.lower()))
+        finally:
+            db_connection.autocommit = autocommit
+        logger.info('Stored identifiers, subjects and creators of {} existing samples in {:.1f} seconds'.format(sample_count, 
+                                                                                                                timer() - start_time))
+    
+    def _get_reader_kwargs(self):
+        '''
+        Function to return dict of constructor keyword arguments to create an equivalent reader
+        '''
+        return {'postgres_host': self.postgres_host,
+                'postgres_port': self.postgres_port,
+                'postgres_dbname': self.postgres_dbname,
+                'postgres_user': self.postgres_user,
+                'postgres_password': self.postgres_password,
+                'autocommit': self.autocommit,
+                'pool_size': self.pool_size,
+                }
+    
+    @contextmanager
+    def _cursor(self):
+        '''
+        Context manager yielding a cursor on the current thread's connection, borrowed from the pool if required
+        '''
+        db_connection = self._borrow_connection()
+        try:
+            with db_connection.cursor() as cursor:
+                yield cursor
+        finally:
+            self._release_connection()
+    
+    @contextmanager
+    def _transaction(self, cursor_name=None):
+        '''
+        Context manager yielding a cursor within a single transaction, regardless of the autocommit setting,
+        on the current thread's connection, borrowed from the pool if required.
+        If cursor_name is specified, the cursor is a server-side named cursor which fetches rows on demand.
+        Commits on success or rolls back on exception.
+        '''
+        db_connection = self._borrow_connection()
+        try:
+            autocommit = db_connection.autocommit
+            if autocommit:
+                db_connection.autocommit = False
+            try:
+                with db_connection:
+                    with db_connection.cursor(name=cursor_name) as cursor:
+                        yield cursor
+            finally:
+                if autocommit and not db_connection.closed:
+                    db_connection.autocommit = True
+        finally:
+            self._release_connection()
+    
+    def _execute_prepared(self, cursor, statement_name, params):
+        '''
+        Function to execute one of PREPARED_STATEMENTS with a list of parameters, preparing it on the cursor's
+        connection on first use. Prepared statements last for the whole session, even if the transaction fails
+        '''
+        prepared_statements = self._prepared_statements.setdefault(cursor.connection, set())
+        if statement_name not in prepared_statements:
+            cursor.execute(IGSNReader_postgres.PREPARED_STATEMENTS[statement_name])
+            prepared_statements.add(statement_name)
+        cursor.execute('execute {} ({})'.format(statement_name, ', '.join(['%s'] * len(params))), params)
+    
+    def _get_oaipmh_endpoints(self):
+        '''
+        Function to return list of (oaipmh_id, oaipmh_key, oaipmh_url) tuples for all known OAI-PMH endpoints
+        '''
+        with self._cursor() as cursor:
+            cursor.execute('select OAIPMH_ID, OAIPMH_KEY, OAIPMH_URL from OAIPMH')
+            return cursor.fetchall()
+    
+    def _get_latest_datestamp(self, oaipmh_id):
+        '''
+        Function to return the latest stored DATESTAMP for an endpoint as an OAI-PMH UTC datestamp string,
+        or None if no samples have been stored
+        '''
+        with self._cursor() as cursor:
+            cursor.execute('''select to_char(max(datestamp) at time zone 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+from sample 
+where oaipmh_id = %(oaipmh_id)s''', 
+                           {'oaipmh_id': oaipmh_id})
+            return cursor.fetchone()[0]
+    
+    def _get_sample_count(self, oaipmh_id):
+        '''
+        Function to return the number of samples stored for an endpoint
+        '''
+        with self._cursor() as cursor:
+            cursor.execute('select count(*) from sample where oaipmh_id = %(oaipmh_id)s', 
+                           {'oaipmh_id': oaipmh_id})
+            return cursor.fetchone()[0]
+    
+    def _get_harvest_checkpoint(self, oaipmh_id):
+        '''
+        Function to return the stored harvest checkpoint for an endpoint as a dict, or None if no checkpoint has been stored.
+        updated is returned as an OAI-PMH style UTC datestamp string to match the SQLite backend
+        '''
+        with self._cursor() as cursor:
+            cursor.execute('''select resumption_token, cursor, complete_list_size, 
+    to_char(updated at time zone 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+from harvest_state 
+where oaipmh_id = %(oaipmh_id)s''', 
+                           {'oaipmh_id': oaipmh_id})
+            checkpoint_row = cursor.fetchone()
+        if checkpoint_row:
+            return dict(zip(['resumption_token', 'cursor', 'complete_list_size', 'updated'], checkpoint_row),
+                        oaipmh_id=oaipmh_id)
+    
+    def _iter_content_hashes(self, oaipmh_id):
+        '''
+        Generator to yield an (identifier, content_hash) tuple for each sample stored for an endpoint
+        from a server-side named cursor
+        '''
+        with self._transaction(cursor_name='content_hashes') as cursor:
+            cursor.itersize = IGSNReader_postgres.CONTENT_HASH_FETCH_SIZE
+            cursor.execute('select identifier, content_hash from sample where oaipmh_id = %(oaipmh_id)s',
+                           {'oaipmh_id': oaipmh_id})
+            for content_hash_row in cursor:
+                yield content_hash_row
+    
+    def _iter_live_identifiers(self, oaipmh_id):
+        '''
+        Generator to yield the identifier of each sample stored for an endpoint which has not been marked as deleted
+        from a server-side named cursor
+        '''
+        with self._transaction(cursor_name='live_identifiers') as cursor:
+            cursor.itersize = IGSNReader_postgres.CONTENT_HASH_FETCH_SIZE
+            cursor.execute('select identifier from sample where oaipmh_id = %(oaipmh_id)s and deleted is null',
+                           {'oaipmh_id': oaipmh_id})
+            for identifier, in cursor:
+                yield identifier
+    
+    def _delete_samples(self, oaipmh_id, deleted_samples, remove=False):
+        '''
+        Function to mark stored samples as deleted, or remove them if remove is True, with a single statement
+        joining the samples to arrays of identifiers and deleted datestamps.
+        The statement is retried once with a new connection if the connection is lost.
+        Returns number of samples marked or removed.
+        '''
+        query_params = {'oaipmh_id': oaipmh_id,
+                        'identifiers': [identifier for identifier, _deleted_datestamp in deleted_samples],
+                        'deleted_datestamps': [deleted_datestamp for _identifier, deleted_datestamp in deleted_samples],
+                        }
+        
+        def delete_samples():
+            with self._transaction() as cursor:
+                if remove:
+                    cursor.execute('''delete from sample
+where oaipmh_id = %(oaipmh_id)s
+    and identifier = any(%(identifiers)s)''', 
+                                   query_params)
+                else:
+                    cursor.execute('''update sample
+set deleted = deleted_sample.deleted_datestamp::timestamp with time zone,
+    content_hash = null
+from unnest(%(identifiers)s::text[], %(deleted_datestamps)s::text[]) as deleted_sample(identifier, deleted_datestamp)
+where sample.oaipmh_id = %(oaipmh_id)s
+    and sample.identifier = deleted_sample.identifier
+    and sample.deleted is null''', 
+                                   query_params)
+                return cursor.rowcount
+        
+        start_time = timer()
+        deleted_count = self._reconnecting(delete_samples)
+        self._metrics.add('db_write', timer() - start_time)
+        return deleted_count
+    
+    def _search_samples(self, search_terms, oaipmh_ids=None, sample_type=None, from_datestamp=None, until_datestamp=None,
+                        limit=None, offset=0):
+        '''
+        Function to return list of (rank, oaipmh_key, *SAMPLE_COLUMNS) tuples for samples matching all search terms,
+        highest rank first
+        '''
+        query_params = {'text_search_config': IGSNReader_postgres.TEXT_SEARCH_CONFIG,
+                        'search_text': ' '.join(search_terms),
+                        'limit': limit,
+                        'offset': offset,
+                        }
+        filters = []
+        if oaipmh_ids is not None:
+            filters.append('sample.oaipmh_id = any(%(oaipmh_ids)s)')
+            query_params['oaipmh_ids'] = list(oaipmh_ids)
+        if sample_type:
+            filters.append('sample.type = %(sample_type)s')
+            query_params['sample_type'] = sample_type
+        if from_datestamp:
+            filters.append('sample.datestamp >= %(from_datestamp)s')
+            query_params['from_datestamp'] = from_datestamp
+        if until_datestamp:
+            filters.append('sample.datestamp <= %(until_datestamp)s')
+            query_params['until_datestamp'] = until_datestamp
+        
+        with self._cursor() as cursor:
+            cursor.execute(IGSNReader_postgres.SEARCH_SQL.format(filters=''.join('\n    and ' + search_filter 
+                                                                                 for search_filter in filters)), 
+                           query_params)
+            return cursor.fetchall()
+    
+    def _search_bbox(self, bbox, within=False, oaipmh_ids=None, sample_type=None, limit=None, offset=0):
+        '''
+        Function to return list of (oaipmh_key, *SAMPLE_COLUMNS) tuples for samples whose extent intersects bbox,
+        or lies within it if within is True, in identifier order
+        '''
+        query_params = dict(zip(['min_longitude', 'min_latitude', 'max_longitude', 'max_latitude'], bbox),
+                            limit=limit,
+                            offset=offset)
+        filters = []
+        if oaipmh_ids is not None:
+            filters.append('sample.oaipmh_id = any(%(oaipmh_ids)s)')
+            query_params['oaipmh_ids'] = list(oaipmh_ids)
+        if sample_type:
+            filters.append('sample.type = %(sample_type)s')
+            query_params['sample_type'] = sample_type
+        
+        with self._cursor() as cursor:
+            cursor.execute(IGSNReader_postgres.BBOX_SQL.format(operator='<@' if within else '&&',
+                                                               filters=''.join('\n            and ' + bbox_filter 
+                                                                               for bbox_filter in filters)), 
+                           query_params)
+            return cursor.fetchall()
+    
+    def _resolve_identifiers(self, identifiers):
+        '''
+        Function to return list of (identifier, sample_identifier) tuples for each of identifiers which is any
+        identifier of a sample
+        '''
+        with self._cursor() as cursor:
+            cursor.execute(IGSNReader_postgres.RESOLVE_SQL, {'identifiers': list(identifiers)})
+            return cursor.fetchall()
+    
+    def _get_samples(self, identifiers):
+        '''
+        Function to return list of (identifier, oaipmh_key, *SAMPLE_COLUMNS) tuples for each of identifiers which is any
+        identifier of a sample
+        '''
+        with self._cursor() as cursor:
+            cursor.execute(IGSNReader_postgres.SAMPLES_SQL, {'identifiers': list(identifiers)})
+            return cursor.fetchall()
+    
+    def _get_relations(self, sample_identifiers, inverse=False):
+        '''
+        Function to return list of (identifier, relation, related_identifier) tuples for the relations of samples
+        in sample_identifiers, or for the relations of other samples identifying them if inverse is True
+        '''
+        with self._cursor() as cursor:
+            cursor.execute(IGSNReader_postgres.INVERSE_RELATIONS_SQL if inverse else IGSNReader_postgres.RELATIONS_SQL, 
+                           {'identifiers': list(sample_identifiers)})
+            return cursor.fetchall()
+    
+    def _iter_sample_chunks(self, oaipmh_ids=None, from_datestamp=None, until_datestamp=None, chunk_size=None):
+        '''
+        Generator to yield lists of up to chunk_size (oaipmh_key, *SAMPLE_COLUMNS) tuples from a server-side
+        named cursor, so that only one chunk is transferred and held in memory at a time
+        '''
+        query_params = {}
+        filters = []
+        if oaipmh_ids is not None:
+            filters.append('sample.oaipmh_id = any(%(oaipmh_ids)s)')
+            query_params['oaipmh_ids'] = list(oaipmh_ids)
+        if from_datestamp:
+            filters.append('sample.datestamp >= %(from_datestamp)s')
+            query_params['from_datestamp'] = from_datestamp
+        if until_datestamp:
+            filters.append('sample.datestamp <= %(until_datestamp)s')
+            query_params['until_datestamp'] = until_datestamp
+        
+        with self._transaction(cursor_name='sample_export') as cursor:
+            cursor.execute('''select 
+    oaipmh.oaipmh_key,
+    {columns}
+from sample
+join oaipmh using (oaipmh_id){where}
+order by sample.sample_id'''.format(columns=IGSNReader_postgres.SAMPLE_SELECT_COLUMNS,
+                                    where='\nwhere ' + '\n    and '.join(filters) if filters else ''), 
+                           query_params)
+            while True:
+                sample_chunk = cursor.fetchmany(chunk_size)
+                if not sample_chunk:
                     break
-
-                        
-            logger.info('{} samples updated for {}'.format(sample_count, oaipmh_key))
-                        
\ No newline at end of file
+                yield sample_chunk
+    
+    def _start_bulk_writes(self):
+        '''
+        Function to create the staging table which _write_samples copies samples into until they are merged
+        into sample by _flush_samples. The staging table is a temporary table belonging to the session,
+        so the current thread keeps its connection until _stop_bulk_writes
+        '''
+        self._borrow_connection()
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(IGSNReader_postgres.CREATE_STAGING_SQL)
+        except Exception:
+            self._release_connection()
+            raise
+        self._bulk_writes = True
+        self._staged_count = 0
+        self._pending_checkpoints = {}
+    
+    def _stop_bulk_writes(self):
+        '''
+        Function to drop the staging tables, discarding any samples and checkpoints which were not merged,
+        and release the connection kept by _start_bulk_writes
+        '''
+        if not self._bulk_writes:
+            return
+        
+        self._bulk_writes = False
+        self._pending_checkpoints = {}
+        try:
+            if not self.db_connection.closed:
+                with self._transaction() as cursor:
+                    cursor.execute('drop table if exists pg_temp.sample_staging, pg_temp.sample_value_staging;')
+        finally:
+            self._release_connection()
+    
+    def _stage_samples(self, sample_rows, upsert=False, checkpoint=None):
+        '''
+        Function to copy a batch of sample records, and the values of each, into the staging tables with COPY FROM STDIN.
+        Any checkpoint is held until the staged samples have been merged.
+        Returns 0, because staged records are counted as written when they are merged
+        '''
+        start_time = timer()
+        with self._transaction() as cursor:
+            if sample_rows:
+                copy_buffer = io.StringIO()
+                copy_buffer.writelines('\t'.join([get_copy_value(sample_row.get(column.lower())) 
+                                                  for column in SAMPLE_COLUMNS] + ['t' if upsert else 'f']) + '\n'
+                                       for sample_row in sample_rows)
+                copy_buffer.seek(0)
+                cursor.copy_expert(IGSNReader_postgres.COPY_SQL, copy_buffer)
+                
+                copy_buffer = io.StringIO()
+                for sample_row in sample_rows:
+                    sample_key = '{}\t{}'.format(get_copy_value(sample_row['identifier']), 
+                                                 get_copy_value(sample_row.get('content_hash')))
+                    copy_buffer.writelines('{}\t{}\t{}\t{}\n'.format(sample_key, value_key, ordinal, get_copy_value(value))
+                                           for value_key in SAMPLE_VALUE_TABLES.keys()
+                                           for ordinal, value in enumerate(sample_row.get(value_key) or [], 1))
+                copy_buffer.seek(0)
+                cursor.copy_expert(IGSNReader_postgres.VALUE_COPY_SQL, copy_buffer)
+            write_time = timer()
+        self._metrics.add('db_write', write_time - start_time)
+        self._metrics.add('db_commit', timer() - write_time)
+        
+        self._staged_count += len(sample_rows)
+        if checkpoint:
+            self._pending_checkpoints[checkpoint['oaipmh_id']] = checkpoint
+        return 0
+    
+    def _flush_samples(self):
+        '''
+        Function to merge all staged samples into sample with one set-based statement for samples staged for update
+        and one for samples staged for insert, then merge their staged values into each value table,
+        and store the pending checkpoints in the same transaction.
+        Returns dict of numbers of records written keyed by oaipmh_id
+        '''
+        if not self._bulk_writes or not (self._staged_count or self._pending_checkpoints):
+            return {}
+        
+        if self._staged_count:
+            logger.info('Merging {} staged samples'.format(self._staged_count))
+        start_time = timer()
+        written_counts = {}
+        with self._transaction() as cursor:
+            for upsert in [True, False]:
+                cursor.execute(IGSNReader_postgres.MERGE_SQL.format(upsert=upsert,
+                                                                    staging_order='desc' if upsert else 'asc',
+                                                                    conflict_action=IGSNReader_postgres.MERGE_UPDATES 
+                                                                    if upsert else IGSNReader_postgres.MERGE_DELETED_UPDATES))
+                for oaipmh_id, written_count in cursor.fetchall():
+                    written_counts[oaipmh_id] = written_counts.get(oaipmh_id, 0) + written_count
+            for value_key, value_table in SAMPLE_VALUE_TABLES.items():
+                cursor.execute(IGSNReader_postgres.VALUE_MERGE_SQL.format(value_table=value_table.lower()), 
+                               {'value_key': value_key})
+            for checkpoint in self._pending_checkpoints.values():
+                cursor.execute(IGSNReader_postgres.CHECKPOINT_SQL, checkpoint)
+            cursor.execute('truncate sample_staging, sample_value_staging;')
+        if self._staged_count:
+            logger.info('Merged {} staged samples into {} written samples in {:.1f} seconds'.format(self._staged_count,
+                                                                                                   sum(written_counts.values()),
+                                                                                                   timer() - start_time))
+        
+        self._staged_count = 0
+        self._pending_checkpoints = {}
+        return written_counts
+    
+    def _write_samples(self, sample_rows, upsert=False, checkpoint=None):
+        '''
+        Function to write a batch of sample records to the database in a single transaction with one execution
+        of a prepared statement taking an array of values for each column.
+        Records which already exist are skipped, or updated in place if upsert is True or the stored sample is marked as deleted.
+        The values of the samples written are written to the value tables, and any checkpoint is stored, in the same transaction.
+        The transaction is retried once with a new connection if the connection is lost.
+        While writing in bulk, records are copied into the staging table instead. See _stage_samples.
+        Returns number of records written.
+        '''
+        if self._bulk_writes:
+            return self._stage_samples(sample_rows, upsert=upsert, checkpoint=checkpoint)
+        
+        column_values = [[sample_row.get(column.lower()) for sample_row in sample_rows] for column in SAMPLE_COLUMNS]
+        
+        def write_samples():
+            written_count = 0
+            start_time = timer()
+            with self._transaction() as cursor:
+                if sample_rows:
+                    self._execute_prepared(cursor, 'upsert_samples' if upsert else 'insert_samples', column_values)
+                    written_count = cursor.rowcount
+                    self._write_sample_values(cursor, 
+                                              sample_rows, 
+                                              {identifier: (sample_id, content_hash) 
+                                               for sample_id, identifier, content_hash in cursor.fetchall()})
+                if checkpoint:
+                    cursor.execute(IGSNReader_postgres.CHECKPOINT_SQL, checkpoint)
+                write_time = timer()
+            self._metrics.add('db_write', write_time - start_time)
+            self._metrics.add('db_commit', timer() - write_time)
+            return written_count
+        
+        return self._reconnecting(write_samples)
+    
+    def _insert_sample_values(self, cursor, sample_values):
+        '''
+        Function to insert a dict of lists of (sample_id, ordinal, value) tuples keyed by SAMPLE_VALUE_TABLES key
+        into the value tables with one statement per table, joining arrays of each column
+        '''
+        for value_key, value_table in SAMPLE_VALUE_TABLES.items():
+            if sample_values[value_key]:
+                cursor.execute('''insert into {} (sample_id, ordinal, value)
+select * 
+from unnest(%s::bigint[], %s::integer[], %s::text[])'''.format(value_table.lower()),
+                               [list(value_column) for value_column in zip(*sample_values[value_key])])
+    
+    def _write_sample_values(self, cursor, sample_rows, stored_samples):
+        '''
+        Function to write the values of the samples written from a batch of sample rows to the value tables, given a dict of
+        (sample_id, content_hash) tuples of the samples written keyed by identifier. Any values already stored for the
+        samples, e.g. those of a sample marked as deleted whose record has reappeared, are deleted first
+        '''
+        sample_ids, sample_values = get_sample_values(sample_rows, stored_samples)
+        if sample_ids:
+            for value_table in SAMPLE_VALUE_TABLES.values():
+                cursor.execute('delete from {} where sample_id = any(%(sample_ids)s)'.format(value_table.lower()), 
+                               {'sample_ids': sample_ids})
+        self._insert_sample_values(cursor, sample_values)
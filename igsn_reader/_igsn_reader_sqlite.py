@@ -2,16 +2,25 @@ import os
 import logging
 import sqlite3
 import re
-import requests
-from lxml import etree
-from time import sleep
+from timeit import default_timer as timer
 
-from ._igsn_reader import settings, IGSNReader
+from ._igsn_reader import (settings, IGSNDatabaseReader, SAMPLE_COLUMNS, HARVEST_STATE_COLUMNS, EXTENT_COLUMNS, SAMPLE_VALUE_TABLES,
+                           IDENTIFIER_CHUNK_SIZE, get_sample_values, get_stored_values)
+from ._coverage_parser import parse_coverage
 
-DEBUG_MAX_SAMPLES = 2500 # Number of samples to store before finishing while in debug mode
-REPORT_INCREMENT = 1000 # Number of records to insert before reporting progress
-MAX_RETRIES = 2 # Maximum number of times to retry request
-RETRY_SLEEP = 2 # Seconds to sleep before retrying request
+SQLITE_TIMEOUT = 60 # Seconds to wait for a database lock held by another process
+SEARCH_WEIGHTS = [10.0, 5.0, 1.0] # bm25 weights for TITLE, SUBJECT and DESCRIPTION matches in full-text search
+BULK_LOAD_JOURNAL_MODE = 'WAL' # Journal mode of the database for the duration of a bulk load
+
+# Types of SAMPLE columns which are not TEXT, used to add columns missing from an existing database
+SAMPLE_COLUMN_TYPES = {column: 'REAL' for column in EXTENT_COLUMNS}
+
+# PRAGMA settings of each harvest connection while writing in bulk, restored afterwards
+BULK_WRITE_PRAGMAS = {
+    'synchronous': 'NORMAL', # Only sync the WAL at checkpoints rather than on every commit
+    'cache_size': -262144, # 256MiB page cache
+    'temp_store': 'MEMORY', # Keep temporary indexes and tables in memory
+    }
 
 logger = logging.getLogger(__name__)
 
@@ -21,219 +30,620 @@ else:
     logger.setLevel(logging.INFO)
 logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
 
-class IGSNReader_SQLite(IGSNReader):
+class IGSNReader_SQLite(IGSNDatabaseReader):
+    
+    # Existing samples are left in place, unless they are marked as deleted and their records have reappeared
+    INSERT_SQL = '''insert or ignore into sample (
+    {columns}
+    )
+values (
+    {values}
+    )
+on conflict (IDENTIFIER) do update set
+    {updates}
+where SAMPLE.DELETED is not null;
+'''.format(columns=',\n    '.join(SAMPLE_COLUMNS),
+           values=',\n    '.join(':' + column.lower() for column in SAMPLE_COLUMNS),
+           updates=',\n    '.join('{0} = excluded.{0}'.format(column) for column in SAMPLE_COLUMNS if column != 'IDENTIFIER'))
+    
+    UPSERT_SQL = '''insert into sample (
+    {columns}
+    )
+values (
+    {values}
+    )
+on conflict (IDENTIFIER) do update set
+    {updates};
+'''.format(columns=',\n    '.join(SAMPLE_COLUMNS),
+           values=',\n    '.join(':' + column.lower() for column in SAMPLE_COLUMNS),
+           updates=',\n    '.join('{0} = excluded.{0}'.format(column) for column in SAMPLE_COLUMNS if column != 'IDENTIFIER'))
+    
+    CHECKPOINT_SQL = '''insert into harvest_state (
+    {columns},
+    UPDATED
+    )
+values (
+    {values},
+    strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+    )
+on conflict (OAIPMH_ID) do update set
+    {updates},
+    UPDATED = excluded.UPDATED;
+'''.format(columns=',\n    '.join(HARVEST_STATE_COLUMNS),
+           values=',\n    '.join(':' + column.lower() for column in HARVEST_STATE_COLUMNS),
+           updates=',\n    '.join('{0} = excluded.{0}'.format(column) for column in HARVEST_STATE_COLUMNS if column != 'OAIPMH_ID'))
+    
+    SEARCH_SQL = '''select 
+    -bm25(SAMPLE_FTS, {weights}) as RANK,
+    OAIPMH.OAIPMH_KEY,
+    {columns}
+from SAMPLE_FTS
+join SAMPLE on SAMPLE.SAMPLE_ID = SAMPLE_FTS.rowid
+join OAIPMH on OAIPMH.OAIPMH_ID = SAMPLE.OAIPMH_ID
+where SAMPLE_FTS match :fts_query
+    and SAMPLE.DELETED is null{{filters}}
+order by RANK desc, SAMPLE.IDENTIFIER
+limit :limit offset :offset;
+'''.format(weights=', '.join(str(weight) for weight in SEARCH_WEIGHTS),
+           columns=',\n    '.join('SAMPLE.' + column for column in SAMPLE_COLUMNS))
+    
+    # Samples whose extent intersects a bbox, found with the R*Tree index and checked against the exact SAMPLE extent
+    BBOX_SQL = '''select 
+    OAIPMH.OAIPMH_KEY,
+    {columns}
+from SAMPLE_RTREE
+join SAMPLE on SAMPLE.SAMPLE_ID = SAMPLE_RTREE.SAMPLE_ID
+join OAIPMH on OAIPMH.OAIPMH_ID = SAMPLE.OAIPMH_ID
+where SAMPLE_RTREE.MAX_LONGITUDE >= :min_longitude
+    and SAMPLE_RTREE.MIN_LONGITUDE <= :max_longitude
+    and SAMPLE_RTREE.MAX_LATITUDE >= :min_latitude
+    and SAMPLE_RTREE.MIN_LATITUDE <= :max_latitude
+    and SAMPLE.DELETED is null{{filters}}
+order by SAMPLE.IDENTIFIER
+limit :limit offset :offset;
+'''.format(columns=',\n    '.join('SAMPLE.' + column for column in SAMPLE_COLUMNS))
+    
+    # Samples with any of a list of identifiers, found with the SAMPLE_IDENTIFIER value index
+    RESOLVE_SQL = '''select 
+    SAMPLE_IDENTIFIER.VALUE,
+    SAMPLE.IDENTIFIER
+from SAMPLE_IDENTIFIER
+join SAMPLE on SAMPLE.SAMPLE_ID = SAMPLE_IDENTIFIER.SAMPLE_ID
+where SAMPLE_IDENTIFIER.VALUE in ({identifiers})
+    and SAMPLE.DELETED is null;
+'''
+    
+    # Samples with any of a list of identifiers, with the identifier each was found by
+    SAMPLES_SQL = '''select 
+    SAMPLE_IDENTIFIER.VALUE,
+    OAIPMH.OAIPMH_KEY,
+    {columns}
+from SAMPLE_IDENTIFIER
+join SAMPLE on SAMPLE.SAMPLE_ID = SAMPLE_IDENTIFIER.SAMPLE_ID
+join OAIPMH on OAIPMH.OAIPMH_ID = SAMPLE.OAIPMH_ID
+where SAMPLE_IDENTIFIER.VALUE in ({{identifiers}})
+    and SAMPLE.DELETED is null;
+'''.format(columns=',\n    '.join('SAMPLE.' + column for column in SAMPLE_COLUMNS))
+    
+    # Relations of a list of samples, with any samples they identify. A relation identifying no sample not marked as
+    # deleted is returned with a null RELATED_IDENTIFIER
+    RELATIONS_SQL = '''select 
+    SAMPLE.IDENTIFIER,
+    SAMPLE_RELATION.VALUE,
+    RELATED_SAMPLE.IDENTIFIER
+from SAMPLE
+join SAMPLE_RELATION on SAMPLE_RELATION.SAMPLE_ID = SAMPLE.SAMPLE_ID
+left join SAMPLE_IDENTIFIER on SAMPLE_IDENTIFIER.VALUE = SAMPLE_RELATION.VALUE
+left join SAMPLE as RELATED_SAMPLE on RELATED_SAMPLE.SAMPLE_ID = SAMPLE_IDENTIFIER.SAMPLE_ID
+    and RELATED_SAMPLE.DELETED is null
+where SAMPLE.IDENTIFIER in ({identifiers})
+    and SAMPLE.DELETED is null;
+'''
     
-    def __init__(self):
+    # Relations of other samples identifying any of a list of samples
+    INVERSE_RELATIONS_SQL = '''select 
+    RELATING_SAMPLE.IDENTIFIER,
+    SAMPLE_RELATION.VALUE,
+    SAMPLE.IDENTIFIER
+from SAMPLE
+join SAMPLE_IDENTIFIER on SAMPLE_IDENTIFIER.SAMPLE_ID = SAMPLE.SAMPLE_ID
+join SAMPLE_RELATION on SAMPLE_RELATION.VALUE = SAMPLE_IDENTIFIER.VALUE
+join SAMPLE as RELATING_SAMPLE on RELATING_SAMPLE.SAMPLE_ID = SAMPLE_RELATION.SAMPLE_ID
+where SAMPLE.IDENTIFIER in ({identifiers})
+    and SAMPLE.DELETED is null
+    and RELATING_SAMPLE.DELETED is null;
+'''
+    
+    def __init__(self, sqlite_db_path=None, defer_indexes=False):
         '''
         Constructor for IGSNReader class
+        If defer_indexes is True, indexes and triggers dropped for a bulk load in progress are not recreated on connection
         '''
         super(IGSNReader_SQLite, self).__init__()
         
-        self.sqlite_db_path = (settings.get('sqlite_db_path') 
+        self.sqlite_db_path = (sqlite_db_path
+                               or settings.get('sqlite_db_path') 
                                or os.path.join(os.path.dirname(os.path.realpath(__file__)), 
                                                'data', 'igsn_db.sqlite'))
         
-        if not os.path.isfile(self.sqlite_db_path):
-            self.db_connection = sqlite3.connect(self.sqlite_db_path)
-            cursor = self.db_connection.cursor()
-            
-            ddl_sql_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 
-                                        'data', 'igsn_reader_sqlite_ddl.sql')
-            
-            ddl_sql_file = open(ddl_sql_path, 'r')
-            script_sql = ddl_sql_file.read()
-            ddl_sql_file.close()
-            
-            # Strip comments using non-greedy regex substitutions
-            script_sql = re.sub('--.*?$', '', re.sub('/\*.*?\*/', '', script_sql, flags=re.DOTALL), flags=re.MULTILINE)
-            
-            ddl_queries = [ddl_query.strip() + ';\n' for ddl_query in script_sql.split(';') if ddl_query.strip()]
-            
-            logger.info('Executing DDL script {}'.format(ddl_sql_path))
-            for ddl_query in ddl_queries:
-                logger.debug('Executing query:\n{}'.format(ddl_query))
-                cursor.execute(ddl_query)
-                self.db_connection.commit()
-
-        else:
-            self.db_connection = sqlite3.connect(self.sqlite_db_path)
-            cursor = self.db_connection.cursor()
+        self.defer_indexes = defer_indexes
+        self._bulk_load_pragmas = {} # PRAGMA values to restore after a bulk load keyed by PRAGMA name
+                
+    def _connect(self):
+        '''
+        Function to open and return a new database connection, running the idempotent DDL script
+        and inserting any configured OAI-PMH endpoints not already in the OAIPMH table
+        '''
+        new_database = not os.path.isfile(self.sqlite_db_path)
+        # A harvest makes its database calls in a separate thread, but never at the same time as the calling thread
+        db_connection = sqlite3.connect(self.sqlite_db_path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        
+        if not self.defer_indexes:
+            self._execute_ddl(db_connection, new_database)
             
+        cursor = db_connection.cursor()
         for key, value in settings['oai_pmh_endpoints'].items():
             cursor.execute("""insert or ignore into OAIPMH (OAIPMH_KEY, OAIPMH_URL)
                 values (?, ?);
                 """, (key, value))
-            self.db_connection.commit()
+            db_connection.commit()
             if cursor.rowcount:
                 logger.info('"{}" inserted into OAIPMH table for key {}'.format(value, key))
                 
-                
-    def read_igsns(self, oaipmh_source=None, resumption_token=None):
-        '''
-        Function to read IGSNS into database
-        '''
-        print('blah')
-        insert_sql = '''insert or ignore into sample (
-    OAIPMH_ID,
-    IDENTIFIER,
-    DATESTAMP,
-    ALT_IDENTIFIERS,
-    TITLE,
-    SUBJECT,
-    DESCRIPTION,
-    TYPE,
-    FORMAT,
-    COVERAGE,
-    CREATOR,
-    PUBLISHER,
-    RIGHTS
-    )
-values (
-    :oaipmh_id,
-    :identifier,
-    :datestamp,
-    :alt_identifiers,
-    :title,
-    :subject,
-    :description,
-    :type,
-    :format,
-    :coverage,
-    :creator,
-    :publisher,
-    :rights
-    );
-'''                        
-
-        cursor = self.db_connection.cursor()
-        cursor.execute('select OAIPMH_ID, OAIPMH_KEY, OAIPMH_URL from OAIPMH')
+        return db_connection
+    
+    def _execute_ddl(self, db_connection, new_database=False):
+        '''
+        Function to run the idempotent DDL script, creating any missing tables, indexes and triggers,
+        and to build the full-text and spatial indexes and fill the value tables if they were missing from an existing database
+        '''
+        cursor = db_connection.cursor()
+        
+        ddl_sql_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 
+                                    'data', 'igsn_reader_sqlite_ddl.sql')
+        
+        ddl_sql_file = open(ddl_sql_path, 'r')
+        script_sql = ddl_sql_file.read()
+        ddl_sql_file.close()
+        
+        # Strip comments using non-greedy regex substitutions
+        script_sql = re.sub('--.*?$', '', re.sub('/\*.*?\*/', '', script_sql, flags=re.DOTALL), flags=re.MULTILINE)
+        
+        # Split script into complete statements, keeping trigger bodies containing semicolons together
+        ddl_queries = []
+        ddl_query = ''
+        for script_part in script_sql.split(';'):
+            ddl_query += script_part + ';'
+            if sqlite3.complete_statement(ddl_query):
+                if ddl_query.strip(' \t\r\n;'):
+                    ddl_queries.append(ddl_query.strip() + '\n')
+                ddl_query = ''
+        
+        cursor.execute("select count(*) from sqlite_master where name = 'SAMPLE_FTS'")
+        new_fts_index = not cursor.fetchone()[0]
+        cursor.execute("select count(*) from sqlite_master where name = 'SAMPLE_RTREE'")
+        new_rtree_index = not cursor.fetchone()[0]
+        cursor.execute("select count(*) from sqlite_master where name in ({})".format(', '.join("'{}'".format(value_table) 
+                                                                                               for value_table in SAMPLE_VALUE_TABLES.values())))
+        new_value_tables = cursor.fetchone()[0] < len(SAMPLE_VALUE_TABLES)
         
-        for oaipmh_id, oaipmh_key, oaipmh_url in cursor.fetchall():
-            # Skip any sources not in specified source list
-            if oaipmh_source and oaipmh_key != oaipmh_source:
-                continue
+        # DDL script is idempotent, so it is also run on existing databases to create any tables added since
+        if new_database:
+            logger.info('Executing DDL script {}'.format(ddl_sql_path))
+        else:
+            logger.debug('Executing DDL script {}'.format(ddl_sql_path))
+        for ddl_query in ddl_queries:
+            logger.debug('Executing query:\n{}'.format(ddl_query))
+            cursor.execute(ddl_query)
+            db_connection.commit()
+        
+        # CREATE TABLE IF NOT EXISTS does not add columns to existing tables
+        cursor.execute('pragma table_info(SAMPLE)')
+        table_columns = [table_info_row[1].upper() for table_info_row in cursor.fetchall()]
+        for column in SAMPLE_COLUMNS:
+            if column not in table_columns:
+                logger.info('Adding column {} to SAMPLE table'.format(column))
+                cursor.execute('alter table SAMPLE add column {} {}'.format(column, SAMPLE_COLUMN_TYPES.get(column, 'TEXT')))
+                db_connection.commit()
+        
+        # Unchanged samples are skipped by later harvests, so extents are parsed from the stored COVERAGE
+        if not new_database and any(column not in table_columns for column in EXTENT_COLUMNS):
+            self._parse_stored_coverage(db_connection)
             
-            logger.info('Querying records for {}'.format(oaipmh_key))
+        if new_value_tables and not new_database:
+            self._store_existing_values(db_connection)
             
-            http_params = {'verb': 'ListRecords',
-                           'metadataPrefix': 'oai_dc',
-                           'resumptionToken': resumption_token}
-        
-            sample_count = 0            
-            while not sample_count or resumption_token:
-                logger.debug('resumption_token = {}'.format(resumption_token))
-                if resumption_token:
-                    http_params = {'verb': 'ListRecords',
-                                   'resumptionToken': resumption_token}
-                    
-                retries = 0
-                while True:
-                    try:
-                        response_content = None
-                        logger.debug('oaipmh_url = {}, headers={}, params={}, data={}, timeout={}'.format(oaipmh_url, None, http_params, None, settings['timeout']))
-                        response = requests.get(oaipmh_url, headers=None, params=http_params, data=None, timeout=settings['timeout'])
-                        assert response.status_code == 200, 'Response status code {} != 200: {}'.format(response.status_code, response.content)
-                        
-                        # Hack to get around CSIRO namespace definition
-                        response_content = response.content.decode('utf-8')
-                        response_content = re.sub('xmlns:ns3="http://www.openarchives.org/OAI/2.0/"', '', re.sub('ns3:', '', response_content)).encode('utf-8')
-                        #logger.debug(response_content)
-                        
-                        response_tree = etree.fromstring(response_content)
-                        
-                        list_records_element = response_tree.find('./ListRecords', namespaces=response_tree.nsmap)
-                        assert list_records_element is not None, 'Unable to find OAI-PMH/ListRecords element'
-                        
-                        break # We have our list_records_element - proceed with parsing
-                    except Exception as e:
-                        logger.warning('HTTP get failed: {}'.format(e))
-                        if response_content is not None:
-                            logger.debug(response_content)
-
-                        if retries < MAX_RETRIES:
-                            retries += 1
-                            logger.warning('Waiting {} seconds before retrying...'.format(RETRY_SLEEP))
-                            sleep(RETRY_SLEEP)
-                            continue
-                        else:
-                            raise(e)
-                                        
-                resumption_token_element = list_records_element.find('./resumptionToken', namespaces=response_tree.nsmap)
-                if resumption_token_element is not None:
-                    resumption_token = resumption_token_element.text
-                    if resumption_token is not None:
-                        resumption_token = resumption_token.strip()
-                else:
-                    resumption_token = None
-                
-                # Read Dublin Core metadata for each record in response
-                for record_element in list_records_element.findall('./record', namespaces=response_tree.nsmap):
-                    insert_params = {'oaipmh_id': oaipmh_id}
-                    try:
-                        insert_params['identifier'] = record_element.find('./header/identifier', namespaces=response_tree.nsmap).text
-                        try:
-                            insert_params['datestamp'] = record_element.find('./header/datestamp', namespaces=response_tree.nsmap).text
-                        except:
-                            insert_params['datestamp'] = None
-                            
-                        # Find Dublin Core element
-                        dc_element = record_element.find('./metadata/{http://www.openarchives.org/OAI/2.0/oai_dc/}dc', namespaces=response_tree.nsmap) # CSIRO
-                        if dc_element is None:
-                            dc_element = record_element.find('./metadata', namespaces=response_tree.nsmap) # GA
-                        
-                        insert_params['alt_identifiers'] = ', '.join([alt_identifier_element.text
-                                                    for alt_identifier_element in dc_element.findall('./dc:identifier', 
-                                                                                                     namespaces=dc_element.nsmap)
-                                                    ])
-                        
-                        insert_params['relations'] = ', '.join([alt_identifier_element.text
-                                                    for alt_identifier_element in dc_element.findall('./dc:relation', 
-                                                                                                     namespaces=dc_element.nsmap)
-                                                    ])
-                        
-                        for dc_attribute in [
-                            'title',
-                            'subject',
-                            'description',
-                            'date',
-                            'type',
-                            'format',
-                            'coverage',
-                            'creator',
-                            'publisher',
-                            'rights',
-                            ]:
-                            try:                         
-                                insert_params[dc_attribute] = dc_element.find('./dc:{}'.format(dc_attribute), 
-                                                                                namespaces=dc_element.nsmap).text
-                            except Exception as e:
-                                #logger.debug('Dublin Core attribute read for {} failed: {}'.format(dc_attribute, e))
-                                insert_params[dc_attribute] = None
-                        
-                    except Exception as e:
-                        logger.warning('Attribute read failed: {}'.format(e))
-                        continue
-                            
-                    logger.debug('Inserting record for {}'.format(insert_params['identifier']))
-                    insert_cursor = self.db_connection.cursor()
-                    logger.debug(insert_params)
-                    try:
-                        insert_cursor.execute(insert_sql, insert_params)
-                        self.db_connection.commit()
-                    except Exception as e:
-                        logger.debug('Record insertion failed: {}'.format(e)) # OK: Record might already exist
-                        
-                    sample_count += 1
-                    
-                    if sample_count % REPORT_INCREMENT == 0:
-                        logger.info('{} samples updated'.format(sample_count))
-                    
-                    if settings['debug'] and DEBUG_MAX_SAMPLES > 0 and sample_count >= DEBUG_MAX_SAMPLES:
-                        break
+        if new_fts_index and not new_database:
+            logger.info('Building full-text index for existing samples')
+            cursor.execute("insert into SAMPLE_FTS (SAMPLE_FTS) values ('rebuild')")
+            db_connection.commit()
+            
+        if new_rtree_index and not new_database:
+            logger.info('Building spatial index for existing samples')
+            with db_connection:
+                cursor.execute('delete from SAMPLE_RTREE')
+                cursor.execute('''insert into SAMPLE_RTREE (SAMPLE_ID, MIN_LONGITUDE, MAX_LONGITUDE, MIN_LATITUDE, MAX_LATITUDE)
+select SAMPLE_ID, MIN_LONGITUDE, MAX_LONGITUDE, MIN_LATITUDE, MAX_LATITUDE
+from SAMPLE
+where MIN_LONGITUDE is not null''')
+    
+    def _parse_stored_coverage(self, db_connection):
+        '''
+        Function to set the extent columns of all stored samples from their COVERAGE in a single transaction
+        '''
+        start_time = timer()
+        cursor = db_connection.cursor()
+        cursor.execute('select SAMPLE_ID, COVERAGE from SAMPLE where COVERAGE is not null')
+        extent_rows = [extent + (sample_id,)
+                       for sample_id, extent in ((sample_id, parse_coverage(coverage)) for sample_id, coverage in cursor.fetchall())
+                       if extent]
+        with db_connection:
+            cursor.executemany('update SAMPLE set {} where SAMPLE_ID = ?'.format(', '.join('{} = ?'.format(column) 
+                                                                                           for column in EXTENT_COLUMNS)),
+                               extent_rows)
+        logger.info('Parsed extents of {} existing samples from coverage in {:.1f} seconds'.format(len(extent_rows), 
+                                                                                                   timer() - start_time))
+    
+    def _store_existing_values(self, db_connection):
+        '''
+        Function to fill the SAMPLE_VALUE_TABLES tables with the values recovered from the columns of all stored samples
+        in a single transaction. See get_stored_values
+        '''
+        start_time = timer()
+        cursor = db_connection.cursor()
+        cursor.execute('select SAMPLE_ID, IDENTIFIER, ALT_IDENTIFIERS, SUBJECT, CREATOR from SAMPLE')
+        sample_rows = cursor.fetchall()
+        with db_connection:
+            for value_key, value_table in SAMPLE_VALUE_TABLES.items():
+                cursor.executemany('insert or ignore into {} (SAMPLE_ID, ORDINAL, VALUE) values (?, ?, ?)'.format(value_table),
+                                   [(sample_id, ordinal, value)
+                                    for sample_id, *stored_columns in sample_rows
+                                    for ordinal, value in enumerate(get_stored_values(*stored_columns)[value_key], 1)])
+        logger.info('Stored identifiers, subjects and creators of {} existing samples in {:.1f} seconds'.format(len(sample_rows), 
+                                                                                                                timer() - start_time))
                 
-                if settings['debug'] and DEBUG_MAX_SAMPLES > 0 and sample_count >= DEBUG_MAX_SAMPLES:
-                    logger.debug('Debug limit reached')
+    def _get_reader_kwargs(self):
+        '''
+        Function to return dict of constructor keyword arguments to create an equivalent reader
+        '''
+        return {'sqlite_db_path': self.sqlite_db_path,
+                'defer_indexes': self.defer_indexes,
+                }
+    
+    def _get_oaipmh_endpoints(self):
+        '''
+        Function to return list of (oaipmh_id, oaipmh_key, oaipmh_url) tuples for all known OAI-PMH endpoints
+        '''
+        cursor = self.db_connection.cursor()
+        cursor.execute('select OAIPMH_ID, OAIPMH_KEY, OAIPMH_URL from OAIPMH')
+        return cursor.fetchall()
+    
+    def _get_latest_datestamp(self, oaipmh_id):
+        '''
+        Function to return the latest stored DATESTAMP for an endpoint, or None if no samples have been stored.
+        DATESTAMP values are stored as received, i.e. as OAI-PMH UTC datestamp strings
+        '''
+        cursor = self.db_connection.cursor()
+        cursor.execute('select max(DATESTAMP) from SAMPLE where OAIPMH_ID = ?', (oaipmh_id,))
+        return cursor.fetchone()[0]
+    
+    def _get_sample_count(self, oaipmh_id):
+        '''
+        Function to return the number of samples stored for an endpoint
+        '''
+        cursor = self.db_connection.cursor()
+        cursor.execute('select count(*) from SAMPLE where OAIPMH_ID = ?', (oaipmh_id,))
+        return cursor.fetchone()[0]
+    
+    def _get_harvest_checkpoint(self, oaipmh_id):
+        '''
+        Function to return the stored harvest checkpoint for an endpoint as a dict, or None if no checkpoint has been stored
+        '''
+        cursor = self.db_connection.cursor()
+        cursor.execute('''select RESUMPTION_TOKEN, CURSOR, COMPLETE_LIST_SIZE, UPDATED 
+from HARVEST_STATE 
+where OAIPMH_ID = ?''', (oaipmh_id,))
+        checkpoint_row = cursor.fetchone()
+        if checkpoint_row:
+            return dict(zip(['resumption_token', 'cursor', 'complete_list_size', 'updated'], checkpoint_row),
+                        oaipmh_id=oaipmh_id)
+    
+    def _iter_content_hashes(self, oaipmh_id):
+        '''
+        Generator to yield an (identifier, content_hash) tuple for each sample stored for an endpoint
+        '''
+        cursor = self.db_connection.cursor()
+        cursor.execute('select IDENTIFIER, CONTENT_HASH from SAMPLE where OAIPMH_ID = ?', (oaipmh_id,))
+        try:
+            for content_hash_row in cursor:
+                yield content_hash_row
+        finally:
+            cursor.close()
+    
+    def _iter_live_identifiers(self, oaipmh_id):
+        '''
+        Generator to yield the identifier of each sample stored for an endpoint which has not been marked as deleted
+        '''
+        cursor = self.db_connection.cursor()
+        cursor.execute('select IDENTIFIER from SAMPLE where OAIPMH_ID = ? and DELETED is null', (oaipmh_id,))
+        try:
+            for identifier, in cursor:
+                yield identifier
+        finally:
+            cursor.close()
+    
+    def _delete_samples(self, oaipmh_id, deleted_samples, remove=False):
+        '''
+        Function to mark stored samples as deleted, or remove them if remove is True, in a single transaction.
+        Returns number of samples marked or removed.
+        '''
+        start_time = timer()
+        with self.db_connection: # Commits on success or rolls back on exception
+            cursor = self.db_connection.cursor()
+            if remove:
+                sample_params = [(oaipmh_id, identifier) for identifier, _deleted_datestamp in deleted_samples]
+                for value_table in SAMPLE_VALUE_TABLES.values():
+                    cursor.executemany('''delete from {} 
+where SAMPLE_ID in (select SAMPLE_ID from SAMPLE where OAIPMH_ID = ? and IDENTIFIER = ?)'''.format(value_table),
+                                       sample_params)
+                cursor.executemany('delete from SAMPLE where OAIPMH_ID = ? and IDENTIFIER = ?', sample_params)
+            else:
+                cursor.executemany('''update SAMPLE
+set DELETED = ?, 
+    CONTENT_HASH = null
+where OAIPMH_ID = ? 
+    and IDENTIFIER = ?
+    and DELETED is null''', 
+                                   [(deleted_datestamp, oaipmh_id, identifier) 
+                                    for identifier, deleted_datestamp in deleted_samples])
+            deleted_count = cursor.rowcount
+        self._metrics.add('db_write', timer() - start_time)
+        return deleted_count
+    
+    def _search_samples(self, search_terms, oaipmh_ids=None, sample_type=None, from_datestamp=None, until_datestamp=None,
+                        limit=None, offset=0):
+        '''
+        Function to return list of (rank, oaipmh_key, *SAMPLE_COLUMNS) tuples for samples matching all search terms,
+        highest rank first
+        '''
+        # Quote each term so that it is matched as a word rather than read as FTS5 query syntax
+        query_params = {'fts_query': ' '.join('"{}"'.format(search_term) for search_term in search_terms),
+                        'limit': limit,
+                        'offset': offset,
+                        }
+        filters = []
+        if oaipmh_ids is not None:
+            oaipmh_id_params = {'oaipmh_id_{}'.format(index): oaipmh_id for index, oaipmh_id in enumerate(oaipmh_ids)}
+            filters.append('SAMPLE.OAIPMH_ID in ({})'.format(', '.join(':' + key for key in oaipmh_id_params.keys())))
+            query_params.update(oaipmh_id_params)
+        if sample_type:
+            filters.append('SAMPLE.TYPE = :sample_type')
+            query_params['sample_type'] = sample_type
+        if from_datestamp:
+            filters.append('SAMPLE.DATESTAMP >= :from_datestamp')
+            query_params['from_datestamp'] = from_datestamp
+        if until_datestamp:
+            filters.append('SAMPLE.DATESTAMP <= :until_datestamp')
+            query_params['until_datestamp'] = until_datestamp
+        
+        cursor = self.db_connection.cursor()
+        cursor.execute(IGSNReader_SQLite.SEARCH_SQL.format(filters=''.join('\n    and ' + search_filter 
+                                                                           for search_filter in filters)), 
+                       query_params)
+        return cursor.fetchall()
+    
+    def _search_bbox(self, bbox, within=False, oaipmh_ids=None, sample_type=None, limit=None, offset=0):
+        '''
+        Function to return list of (oaipmh_key, *SAMPLE_COLUMNS) tuples for samples whose extent intersects bbox,
+        or lies within it if within is True, in IDENTIFIER order
+        '''
+        query_params = dict(zip(['min_longitude', 'min_latitude', 'max_longitude', 'max_latitude'], bbox),
+                            limit=limit,
+                            offset=offset)
+        # R*Tree bounds are rounded outwards, so only the intersection test can be made on the index
+        if within:
+            filters = ['SAMPLE.MIN_LONGITUDE >= :min_longitude',
+                       'SAMPLE.MAX_LONGITUDE <= :max_longitude',
+                       'SAMPLE.MIN_LATITUDE >= :min_latitude',
+                       'SAMPLE.MAX_LATITUDE <= :max_latitude',
+                       ]
+        else:
+            filters = ['SAMPLE.MAX_LONGITUDE >= :min_longitude',
+                       'SAMPLE.MIN_LONGITUDE <= :max_longitude',
+                       'SAMPLE.MAX_LATITUDE >= :min_latitude',
+                       'SAMPLE.MIN_LATITUDE <= :max_latitude',
+                       ]
+        if oaipmh_ids is not None:
+            oaipmh_id_params = {'oaipmh_id_{}'.format(index): oaipmh_id for index, oaipmh_id in enumerate(oaipmh_ids)}
+            filters.append('SAMPLE.OAIPMH_ID in ({})'.format(', '.join(':' + key for key in oaipmh_id_params.keys())))
+            query_params.update(oaipmh_id_params)
+        if sample_type:
+            filters.append('SAMPLE.TYPE = :sample_type')
+            query_params['sample_type'] = sample_type
+        
+        cursor = self.db_connection.cursor()
+        cursor.execute(IGSNReader_SQLite.BBOX_SQL.format(filters=''.join('\n    and ' + bbox_filter 
+                                                                         for bbox_filter in filters)), 
+                       query_params)
+        return cursor.fetchall()
+    
+    def _resolve_identifiers(self, identifiers):
+        '''
+        Function to return list of (identifier, sample_identifier) tuples for each of identifiers which is any
+        identifier of a sample
+        '''
+        identifier_params = {'identifier_{}'.format(index): identifier for index, identifier in enumerate(identifiers)}
+        
+        cursor = self.db_connection.cursor()
+        cursor.execute(IGSNReader_SQLite.RESOLVE_SQL.format(identifiers=', '.join(':' + key for key in identifier_params.keys())), 
+                       identifier_params)
+        return cursor.fetchall()
+    
+    def _get_samples(self, identifiers):
+        '''
+        Function to return list of (identifier, oaipmh_key, *SAMPLE_COLUMNS) tuples for each of identifiers which is any
+        identifier of a sample
+        '''
+        identifier_params = {'identifier_{}'.format(index): identifier for index, identifier in enumerate(identifiers)}
+        
+        cursor = self.db_connection.cursor()
+        cursor.execute(IGSNReader_SQLite.SAMPLES_SQL.format(identifiers=', '.join(':' + key for key in identifier_params.keys())), 
+                       identifier_params)
+        return cursor.fetchall()
+    
+    def _get_relations(self, sample_identifiers, inverse=False):
+        '''
+        Function to return list of (identifier, relation, related_identifier) tuples for the relations of samples
+        in sample_identifiers, or for the relations of other samples identifying them if inverse is True
+        '''
+        identifier_params = {'identifier_{}'.format(index): identifier for index, identifier in enumerate(sample_identifiers)}
+        
+        cursor = self.db_connection.cursor()
+        cursor.execute((IGSNReader_SQLite.INVERSE_RELATIONS_SQL if inverse else IGSNReader_SQLite.RELATIONS_SQL).format(
+            identifiers=', '.join(':' + key for key in identifier_params.keys())), 
+                       identifier_params)
+        return cursor.fetchall()
+    
+    def _iter_sample_chunks(self, oaipmh_ids=None, from_datestamp=None, until_datestamp=None, chunk_size=None):
+        '''
+        Generator to yield lists of up to chunk_size (oaipmh_key, *SAMPLE_COLUMNS) tuples using fetchmany,
+        so that only one chunk is held in memory at a time
+        '''
+        query_params = {}
+        filters = []
+        if oaipmh_ids is not None:
+            oaipmh_id_params = {'oaipmh_id_{}'.format(index): oaipmh_id for index, oaipmh_id in enumerate(oaipmh_ids)}
+            filters.append('SAMPLE.OAIPMH_ID in ({})'.format(', '.join(':' + key for key in oaipmh_id_params.keys())))
+            query_params.update(oaipmh_id_params)
+        if from_datestamp:
+            filters.append('SAMPLE.DATESTAMP >= :from_datestamp')
+            query_params['from_datestamp'] = from_datestamp
+        if until_datestamp:
+            filters.append('SAMPLE.DATESTAMP <= :until_datestamp')
+            query_params['until_datestamp'] = until_datestamp
+        
+        cursor = self.db_connection.cursor()
+        cursor.execute('''select 
+    OAIPMH.OAIPMH_KEY,
+    {columns}
+from SAMPLE
+join OAIPMH on OAIPMH.OAIPMH_ID = SAMPLE.OAIPMH_ID{where}
+order by SAMPLE.SAMPLE_ID'''.format(columns=',\n    '.join('SAMPLE.' + column for column in SAMPLE_COLUMNS),
+                                    where='\nwhere ' + '\n    and '.join(filters) if filters else ''), 
+                       query_params)
+        try:
+            while True:
+                sample_chunk = cursor.fetchmany(chunk_size)
+                if not sample_chunk:
                     break
-
-                        
-            logger.info('{} samples updated for {}'.format(sample_count, oaipmh_key))            
\ No newline at end of file
+                yield sample_chunk
+        finally:
+            cursor.close()
+    
+    def _prepare_bulk_load(self):
+        '''
+        Function to prepare the database for a bulk load by switching it to WAL journal mode and dropping the secondary
+        indexes on SAMPLE and the value tables, the full-text and spatial indexes and their triggers, so that they are built once
+        from the loaded samples by _complete_bulk_load rather than updated for every inserted row.
+        If a bulk load is interrupted, anything dropped is recreated by the DDL script on the next connection
+        '''
+        cursor = self.db_connection.cursor()
+        cursor.execute('pragma journal_mode')
+        self._bulk_load_pragmas['journal_mode'] = cursor.fetchone()[0]
+        cursor.execute('pragma journal_mode = {}'.format(BULK_LOAD_JOURNAL_MODE))
+        
+        # The index enforcing the unique IDENTIFIER has no SQL and is kept to skip duplicate records
+        cursor.execute('''select type, name
+from sqlite_master
+where tbl_name in ('SAMPLE', {value_tables})
+    and type in ('index', 'trigger')
+    and sql is not null'''.format(value_tables=', '.join("'{}'".format(value_table) for value_table in SAMPLE_VALUE_TABLES.values())))
+        deferred_objects = cursor.fetchall()
+        
+        with self.db_connection:
+            for object_type, object_name in deferred_objects:
+                logger.debug('Dropping {} {} for bulk load'.format(object_type, object_name))
+                cursor.execute('drop {} if exists {}'.format(object_type, object_name))
+            cursor.execute('drop table if exists SAMPLE_FTS')
+            cursor.execute('drop table if exists SAMPLE_RTREE')
+        self.defer_indexes = True
+        logger.info('Deferred {} indexes and triggers and the full-text and spatial indexes until bulk load completes'.format(len(deferred_objects)))
+    
+    def _complete_bulk_load(self):
+        '''
+        Function to rebuild the indexes, full-text and spatial indexes and triggers dropped by _prepare_bulk_load
+        and restore the journal mode of the database
+        '''
+        start_time = timer()
+        self._execute_ddl(self.db_connection)
+        self.defer_indexes = False
+        logger.info('Built indexes after bulk load in {:.1f} seconds'.format(timer() - start_time))
+        
+        cursor = self.db_connection.cursor()
+        journal_mode = self._bulk_load_pragmas.pop('journal_mode', None)
+        if journal_mode:
+            cursor.execute('pragma journal_mode = {}'.format(journal_mode))
+    
+    def _start_bulk_writes(self):
+        '''
+        Function to apply BULK_WRITE_PRAGMAS to the database connection, keeping the previous values to restore
+        '''
+        cursor = self.db_connection.cursor()
+        for pragma_name, pragma_value in BULK_WRITE_PRAGMAS.items():
+            cursor.execute('pragma {}'.format(pragma_name))
+            self._bulk_load_pragmas[pragma_name] = cursor.fetchone()[0]
+            cursor.execute('pragma {} = {}'.format(pragma_name, pragma_value))
+    
+    def _stop_bulk_writes(self):
+        '''
+        Function to restore the connection PRAGMA values changed by _start_bulk_writes
+        '''
+        cursor = self.db_connection.cursor()
+        for pragma_name in BULK_WRITE_PRAGMAS.keys():
+            if pragma_name in self._bulk_load_pragmas:
+                cursor.execute('pragma {} = {}'.format(pragma_name, self._bulk_load_pragmas.pop(pragma_name)))
+    
+    def _write_samples(self, sample_rows, upsert=False, checkpoint=None):
+        '''
+        Function to write a batch of sample records to the database in a single transaction.
+        Records which already exist are ignored, or updated in place if upsert is True or the stored sample is marked as deleted.
+        The values of the samples stored are written to the value tables, and any checkpoint is stored, in the same transaction.
+        Returns number of records written.
+        '''
+        written_count = 0
+        start_time = timer()
+        with self.db_connection: # Commits on success or rolls back on exception
+            cursor = self.db_connection.cursor()
+            if sample_rows:
+                cursor.executemany(IGSNReader_SQLite.UPSERT_SQL if upsert else IGSNReader_SQLite.INSERT_SQL, 
+                                   sample_rows)
+                written_count = cursor.rowcount
+                self._write_sample_values(cursor, sample_rows)
+            if checkpoint:
+                cursor.execute(IGSNReader_SQLite.CHECKPOINT_SQL, checkpoint)
+            write_time = timer()
+        self._metrics.add('db_write', write_time - start_time)
+        self._metrics.add('db_commit', timer() - write_time)
+        return written_count
+    
+    def _write_sample_values(self, cursor, sample_rows):
+        '''
+        Function to replace the values in the SAMPLE_VALUE_TABLES tables of the samples stored from a batch of
+        sample rows, within the transaction writing the samples. Samples stored from the rows are those whose stored
+        CONTENT_HASH matches that of a row, so that an existing sample left in place by an insert keeps its values
+        '''
+        identifiers = list({sample_row['identifier']: None for sample_row in sample_rows}.keys())
+        stored_samples = {}
+        for chunk_start in range(0, len(identifiers), IDENTIFIER_CHUNK_SIZE):
+            chunk_identifiers = identifiers[chunk_start:chunk_start + IDENTIFIER_CHUNK_SIZE]
+            cursor.execute('select IDENTIFIER, SAMPLE_ID, CONTENT_HASH from SAMPLE where IDENTIFIER in ({})'.format(
+                ', '.join(['?'] * len(chunk_identifiers))), 
+                           chunk_identifiers)
+            stored_samples.update((identifier, (sample_id, content_hash)) for identifier, sample_id, content_hash in cursor.fetchall())
+        
+        sample_ids, sample_values = get_sample_values(sample_rows, stored_samples)
+        for value_key, value_table in SAMPLE_VALUE_TABLES.items():
+            cursor.executemany('delete from {} where SAMPLE_ID = ?'.format(value_table), 
+                               [(sample_id,) for sample_id in sample_ids])
+            cursor.executemany('insert into {} (SAMPLE_ID, ORDINAL, VALUE) values (?, ?, ?)'.format(value_table), 
+                               sample_values[value_key])
@@ -0,0 +1,211 @@
+import logging
+import random
+import threading
+from time import sleep, monotonic
+from timeit import default_timer as timer
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+from ._igsn_reader import settings
+
+DEFAULT_MAX_RETRIES = 5 # Maximum number of times to retry a failed request
+DEFAULT_BACKOFF_BASE = 1.0 # Seconds to back off before the first retry, doubling for each subsequent retry
+DEFAULT_BACKOFF_MAX = 300.0 # Maximum seconds to back off before any retry, including any Retry-After delay
+DEFAULT_POOL_SIZE = 4 # Maximum number of keep-alive connections held per host by each thread's session
+RETRY_STATUS_CODES = [429] # HTTP client error status codes for which a request is retried
+SERVER_ERROR_STATUS_CODE = 500 # Lowest HTTP server error status code. Requests are retried for all server errors
+RETRY_EXCEPTIONS = (requests.ConnectionError, # Exceptions for which a request is retried, including those reading a streamed body
+                    requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    )
+THROTTLE_STATUS_CODES = [429, 503] # HTTP status codes for which all requests to an endpoint are held back
+ACCEPT_ENCODING = 'gzip, deflate' # Compressed transfer encodings accepted
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+
+class OAIPMHClient(object):
+    '''
+    Shared HTTP client for OAI-PMH requests.
+    Each thread keeps its own requests.Session so that connections are kept alive between pages without
+    sharing a session across threads. Requests failing with a connection error, a timeout, a 429 status or a server error
+    are retried with exponential backoff and full jitter, or after the delay given by any Retry-After header. When an endpoint throttles a request with 429 or 503,
+    all other requests to the same endpoint are also held back for the backoff period.
+    Requests to each endpoint URL may also be limited to a maximum rate.
+    If a PageCache is given, each successfully read response is also stored in the cache, and in replay mode
+    responses are read from the cache instead of making any HTTP requests.
+    N.B: Rate limits apply within a single process only.
+    '''
+
+    def __init__(self,
+                 max_retries=None,
+                 backoff_base=None,
+                 backoff_max=None,
+                 timeout=None,
+                 rate_limits=None,
+                 page_cache=None,
+                 replay=False,
+                 metrics=None
+                 ):
+        '''
+        OAIPMHClient class Constructor
+        rate_limits: dict of maximum requests per second keyed by endpoint URL
+        page_cache: PageCache to record responses to, or to replay responses from if replay is True
+        metrics: HarvestMetrics to add http_wait times to, including rate limit and retry waits
+        '''
+        self.max_retries = max_retries if max_retries is not None else (settings.get('http_max_retries')
+                                                                        if settings.get('http_max_retries') is not None
+                                                                        else DEFAULT_MAX_RETRIES)
+        self.backoff_base = backoff_base if backoff_base is not None else (settings.get('http_backoff_base')
+                                                                           if settings.get('http_backoff_base') is not None
+                                                                           else DEFAULT_BACKOFF_BASE)
+        self.backoff_max = backoff_max or settings.get('http_backoff_max') or DEFAULT_BACKOFF_MAX
+        self.timeout = timeout or settings.get('timeout')
+        self.rate_limits = dict(rate_limits or {})
+        self.page_cache = page_cache
+        self.replay = replay
+        self.metrics = metrics
+
+        self._thread_local = threading.local()
+        self._rate_lock = threading.Lock()
+        self._next_request_times = {} # Earliest monotonic time for next request keyed by endpoint URL
+
+    def _get_session(self):
+        '''
+        Function to return the keep-alive session for the current thread, creating it on first use
+        '''
+        session = getattr(self._thread_local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            http_adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=DEFAULT_POOL_SIZE)
+            session.mount('http://', http_adapter)
+            session.mount('https://', http_adapter)
+            session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+            self._thread_local.session = session
+        return session
+
+    def _wait_for_endpoint(self, oaipmh_url):
+        '''
+        Function to block until a request may be made to an endpoint, reserving the next request slot
+        according to the endpoint's rate limit
+        '''
+        rate_limit = self.rate_limits.get(oaipmh_url)
+        with self._rate_lock:
+            now = monotonic()
+            request_time = max(now, self._next_request_times.get(oaipmh_url, now))
+            self._next_request_times[oaipmh_url] = request_time + (1.0 / rate_limit if rate_limit else 0.0)
+
+        if request_time > now:
+            sleep(request_time - now)
+
+    def _hold_endpoint(self, oaipmh_url, delay):
+        '''
+        Function to hold back all requests to an endpoint for delay seconds
+        '''
+        with self._rate_lock:
+            self._next_request_times[oaipmh_url] = max(self._next_request_times.get(oaipmh_url, 0.0),
+                                                       monotonic() + delay)
+
+    def get_retry_after(self, response):
+        '''
+        Function to return the number of seconds given by a Retry-After response header in either
+        delay-seconds or HTTP-date form, or None if not present or unreadable
+        '''
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if not retry_after:
+            return None
+
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+
+        try:
+            return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except Exception:
+            return None
+
+    def get_backoff(self, retry, response=None):
+        '''
+        Function to return the number of seconds to wait before retry number retry (starting from 0),
+        using any Retry-After delay from the failed response or exponential backoff with full jitter otherwise
+        '''
+        retry_after = self.get_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_base * 2 ** retry, self.backoff_max))
+
+    def get(self, oaipmh_url, http_params, read_response, stream=False):
+        '''
+        Function to make a GET request and return the result of read_response(response) for a successful response.
+        The request is retried up to self.max_retries times if it fails with one of RETRY_EXCEPTIONS, e.g. a connection error
+        while the response is read, or if the status code is in RETRY_STATUS_CODES or is a server error.
+        Other status codes, and other exceptions raised by read_response, fail immediately with no retries.
+        If stream is True, the response body is not read before read_response is called.
+        In replay mode, the stored response is read from the page cache with no retries.
+        '''
+        if self.replay:
+            assert self.page_cache is not None, 'No page cache to replay from'
+            response = self.page_cache.get_response(oaipmh_url, http_params)
+            try:
+                return read_response(response)
+            finally:
+                response.close()
+
+        retry = 0
+        while True:
+            response = None
+            retryable = False
+            recording_response = None
+            try:
+                start_time = timer()
+                self._wait_for_endpoint(oaipmh_url)
+
+                logger.debug('oaipmh_url = %s, params=%s, timeout=%s, stream=%s', oaipmh_url, http_params, self.timeout, stream)
+                response = self._get_session().get(oaipmh_url, params=http_params, timeout=self.timeout, stream=stream)
+                if self.metrics is not None:
+                    self.metrics.add('http_wait', timer() - start_time)
+                if response.status_code != 200:
+                    retryable = (response.status_code in RETRY_STATUS_CODES
+                                 or response.status_code >= SERVER_ERROR_STATUS_CODE)
+                    raise requests.HTTPError('Response status code {} != 200: {}'.format(response.status_code,
+                                                                                         response.content),
+                                             response=response)
+
+                if self.page_cache is not None:
+                    response = recording_response = self.page_cache.record(oaipmh_url, http_params, response)
+
+                result = read_response(response)
+
+                if recording_response is not None:
+                    recording_response.commit()
+                return result
+            except Exception as e:
+                logger.warning('HTTP get failed: {}'.format(e))
+                if recording_response is not None:
+                    recording_response.discard()
+
+                if not (retryable or isinstance(e, RETRY_EXCEPTIONS)) or retry >= self.max_retries:
+                    raise
+
+                backoff = self.get_backoff(retry, response)
+                if response is not None and response.status_code in THROTTLE_STATUS_CODES:
+                    self._hold_endpoint(oaipmh_url, backoff)
+
+                retry += 1
+                logger.warning('Waiting {:.1f} seconds before retry {} of {}...'.format(backoff, retry, self.max_retries))
+                sleep(backoff)
+                if self.metrics is not None:
+                    self.metrics.add('http_wait', backoff)
+            finally:
+                if response is not None:
+                    response.close()
@@ -0,0 +1,188 @@
+import os
+import json
+import gzip
+import logging
+import hashlib
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from ._igsn_reader import settings
+
+INDEX_FILE_NAME = 'index.jsonl' # Name of index file in cache directory, with one JSON entry per stored response
+PAGE_FILE_EXTENSION = '.xml.gz' # Extension of compressed response files
+COMPRESS_LEVEL = 6 # gzip compression level for stored responses
+READ_CHUNK_SIZE = 65536 # Number of bytes to read from a stored response at a time when streaming
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+
+def get_request_key(oaipmh_url, http_params):
+    '''
+    Function to return the canonical cache key for a request, i.e. the endpoint URL with sorted query parameters,
+    so that each page is keyed by endpoint and resumptionToken (or initial request parameters)
+    '''
+    return '{}?{}'.format(oaipmh_url, urlencode(sorted(http_params.items())))
+
+
+class RecordingResponse(object):
+    '''
+    Wrapper for a requests.Response which writes the raw response body to a temporary compressed file
+    as it is read, either all at once through content or in chunks through iter_content.
+    The file is only added to the cache by commit(), i.e. once the response has been read successfully
+    '''
+
+    def __init__(self, page_cache, request_key, response):
+        '''
+        RecordingResponse class Constructor
+        '''
+        self.page_cache = page_cache
+        self.request_key = request_key
+        self.response = response
+
+        self.page_path = page_cache.get_page_path(request_key)
+        self.temp_path = '{}.{}.{}.tmp'.format(self.page_path, os.getpid(), threading.get_ident())
+        os.makedirs(os.path.dirname(self.page_path), exist_ok=True)
+        self._page_file = gzip.open(self.temp_path, 'wb', compresslevel=COMPRESS_LEVEL)
+        self._byte_count = 0
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    @property
+    def content(self):
+        content = self.response.content
+        if not self._byte_count:
+            self._page_file.write(content)
+            self._byte_count = len(content)
+        return content
+
+    def iter_content(self, chunk_size=1):
+        for chunk in self.response.iter_content(chunk_size=chunk_size):
+            self._page_file.write(chunk)
+            self._byte_count += len(chunk)
+            yield chunk
+
+    def commit(self):
+        '''
+        Function to move the completed response file into the cache and add it to the index
+        '''
+        self._page_file.close()
+        os.replace(self.temp_path, self.page_path)
+        self.page_cache.add_index_entry(self.request_key, self.page_path, self._byte_count)
+
+    def discard(self):
+        '''
+        Function to remove the temporary file for a response which could not be read
+        '''
+        self._page_file.close()
+        if os.path.isfile(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class CachedResponse(object):
+    '''
+    Minimal stand-in for a successful requests.Response read from a stored compressed response file
+    '''
+    status_code = 200
+
+    def __init__(self, page_path):
+        '''
+        CachedResponse class Constructor
+        '''
+        self.page_path = page_path
+        self.headers = {}
+        self._page_file = gzip.open(page_path, 'rb')
+
+    @property
+    def content(self):
+        return self._page_file.read()
+
+    def iter_content(self, chunk_size=READ_CHUNK_SIZE):
+        while True:
+            chunk = self._page_file.read(chunk_size or READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._page_file.close()
+
+
+class PageCache(object):
+    '''
+    On-disk store of raw OAI-PMH responses, each gzip compressed in its own file named by a hash of the
+    request key, with an append-only JSON lines index file recording the request key, file, size and fetch time
+    of each stored response. Responses can be recorded while harvesting and replayed later without any HTTP
+    requests, e.g. to re-ingest after changes to extraction or schema, or for reproducible profiling.
+    '''
+
+    def __init__(self, cache_dir=None):
+        '''
+        PageCache class Constructor
+        '''
+        self.cache_dir = cache_dir or settings.get('page_cache_dir')
+        assert self.cache_dir, 'No page cache directory specified'
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.index_path = os.path.join(self.cache_dir, INDEX_FILE_NAME)
+        self._index_lock = threading.Lock()
+
+    def get_page_path(self, request_key):
+        '''
+        Function to return the path of the stored response file for a request key
+        '''
+        key_hash = hashlib.sha1(request_key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key_hash[:2], key_hash + PAGE_FILE_EXTENSION)
+
+    def add_index_entry(self, request_key, page_path, byte_count):
+        '''
+        Function to append an entry for a stored response to the index file
+        '''
+        index_entry = {'request_key': request_key,
+                       'file': os.path.relpath(page_path, self.cache_dir),
+                       'bytes': byte_count,
+                       'compressed_bytes': os.path.getsize(page_path),
+                       'fetched': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                       }
+        with self._index_lock:
+            with open(self.index_path, 'a') as index_file:
+                index_file.write(json.dumps(index_entry) + '\n')
+
+    def get_index(self):
+        '''
+        Function to return dict of the latest index entry for each stored response keyed by request key
+        '''
+        index = {}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r') as index_file:
+                for line in index_file:
+                    if line.strip():
+                        index_entry = json.loads(line)
+                        index[index_entry['request_key']] = index_entry
+        return index
+
+    def record(self, oaipmh_url, http_params, response):
+        '''
+        Function to return a RecordingResponse wrapping a live response
+        '''
+        return RecordingResponse(self, get_request_key(oaipmh_url, http_params), response)
+
+    def get_response(self, oaipmh_url, http_params):
+        '''
+        Function to return a CachedResponse for a stored response.
+        Raises KeyError if the request has not been stored
+        '''
+        request_key = get_request_key(oaipmh_url, http_params)
+        page_path = self.get_page_path(request_key)
+        if not os.path.isfile(page_path):
+            raise KeyError('{} not found in page cache {}'.format(request_key, self.cache_dir))
+
+        logger.debug('Replaying %s from %s', request_key, page_path)
+        return CachedResponse(page_path)
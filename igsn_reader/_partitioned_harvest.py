@@ -0,0 +1,204 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+from ._igsn_reader import settings, DAY_GRANULARITY
+from ._harvest_engine import HarvestEngine
+
+DEFAULT_PARTITION_WINDOWS = 16 # Number of from/until windows to split an endpoint's datestamp range into
+DEFAULT_PARTITION_WORKERS = 4 # Number of worker processes harvesting windows in parallel
+DAY_DATESTAMP_FORMAT = '%Y-%m-%d' # OAI-PMH datestamp format for day granularity
+SECOND_DATESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ' # OAI-PMH datestamp format for seconds granularity
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+
+def parse_datestamp(datestamp):
+    '''
+    Function to return a UTC datetime from an OAI-PMH datestamp string at either granularity
+    '''
+    datestamp_format = DAY_DATESTAMP_FORMAT if len(datestamp) == len(DAY_GRANULARITY) else SECOND_DATESTAMP_FORMAT
+    return datetime.strptime(datestamp, datestamp_format).replace(tzinfo=timezone.utc)
+
+
+def get_windows(start_datetime, end_datetime, window_count, granularity):
+    '''
+    Function to split the inclusive range from start_datetime to end_datetime into at most window_count
+    non-overlapping inclusive (from_datestamp, until_datestamp) windows at the given OAI-PMH granularity.
+    The first window has no from_datestamp and the last window has no until_datestamp so that records with
+    datestamps outside the range, e.g. records changed during the harvest, are not missed
+    '''
+    if granularity == DAY_GRANULARITY:
+        unit = timedelta(days=1)
+        datestamp_format = DAY_DATESTAMP_FORMAT
+        start_datetime = start_datetime.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        unit = timedelta(seconds=1)
+        datestamp_format = SECOND_DATESTAMP_FORMAT
+        start_datetime = start_datetime.replace(microsecond=0)
+
+    unit_count = max((end_datetime - start_datetime) // unit + 1, 1)
+    window_count = max(min(window_count, unit_count), 1)
+
+    window_starts = [start_datetime + unit * (unit_count * window_index // window_count)
+                     for window_index in range(window_count)
+                     ]
+
+    windows = []
+    for window_index, window_start in enumerate(window_starts):
+        from_datestamp = window_start.strftime(datestamp_format) if window_index else None
+        until_datestamp = ((window_starts[window_index + 1] - unit).strftime(datestamp_format)
+                           if window_index < window_count - 1 else None)
+        windows.append((from_datestamp, until_datestamp))
+    return windows
+
+
+def harvest_window(igsn_reader_class, reader_kwargs, oaipmh_key, from_datestamp, until_datestamp, engine_kwargs):
+    '''
+    Function to harvest a single datestamp window of an endpoint in a worker process with its own reader
+    and database connection.
+    Returns (sample_count, written_count) tuple
+    '''
+    igsn_reader = igsn_reader_class(**reader_kwargs)
+    endpoints = [endpoint for endpoint in igsn_reader._get_oaipmh_endpoints() if endpoint[1] == oaipmh_key]
+
+    harvest_engine = HarvestEngine(igsn_reader, **engine_kwargs)
+    return harvest_engine.harvest(endpoints,
+                                  from_datestamp=from_datestamp,
+                                  until_datestamp=until_datestamp)[oaipmh_key]
+
+
+class PartitionedHarvest(object):
+    '''
+    Harvest of a single OAI-PMH endpoint split into from/until datestamp windows, each harvested with its own
+    resumptionToken chain in a pool of worker processes.
+    Resumption tokens depend on the previous page, so a single chain can only have one request in flight.
+    Splitting the datestamp range allows one large endpoint to be harvested with several requests in flight.
+    Records are merged into the shared SAMPLE table by identifier, so a record which moves between windows
+    during the harvest is only written once.
+    '''
+
+    def __init__(self,
+                 igsn_reader,
+                 window_count=None,
+                 worker_count=None,
+                 batch_size=None,
+                 page_queue_size=None,
+                 write_queue_size=None,
+                 streaming_parse=None,
+                 incremental=None,
+                 bulk_load=None,
+                 skip_unchanged=None,
+                 remove_deleted=None
+                 ):
+        '''
+        PartitionedHarvest class Constructor
+        '''
+        self.igsn_reader = igsn_reader
+        self.window_count = window_count or settings.get('partition_window_count') or DEFAULT_PARTITION_WINDOWS
+        self.worker_count = worker_count or settings.get('partition_worker_count') or DEFAULT_PARTITION_WORKERS
+        self.incremental = incremental if incremental is not None else bool(settings.get('incremental'))
+        self.bulk_load = bulk_load if bulk_load is not None else bool(settings.get('bulk_load'))
+
+        # Each window is a single resumptionToken chain, so only one request can be in flight per worker
+        self.engine_kwargs = {'batch_size': batch_size,
+                              'max_concurrent_requests': 1,
+                              'page_queue_size': page_queue_size,
+                              'write_queue_size': write_queue_size,
+                              'streaming_parse': streaming_parse,
+                              'incremental': self.incremental,
+                              'bulk_load': self.bulk_load,
+                              'skip_unchanged': skip_unchanged,
+                              'remove_deleted': remove_deleted,
+                              }
+
+    def get_windows(self, oaipmh_id, oaipmh_url):
+        '''
+        Function to return list of (from_datestamp, until_datestamp) windows covering an endpoint's datestamp range,
+        starting from the latest stored datestamp if incremental or the endpoint's earliestDatestamp otherwise
+        '''
+        identify = self.igsn_reader._get_identify(oaipmh_url)
+        granularity = identify.get('granularity')
+
+        start_datestamp = None
+        if self.incremental:
+            start_datestamp = self.igsn_reader._get_latest_datestamp(oaipmh_id)
+        start_datestamp = start_datestamp or identify.get('earliestDatestamp')
+        assert start_datestamp, 'Unable to determine earliestDatestamp for {}'.format(oaipmh_url)
+
+        if granularity == DAY_GRANULARITY:
+            start_datestamp = start_datestamp[:len(DAY_GRANULARITY)]
+
+        windows = get_windows(parse_datestamp(start_datestamp),
+                              datetime.now(timezone.utc),
+                              self.window_count,
+                              granularity)
+
+        if self.incremental:
+            # First window must start from the latest stored datestamp rather than being open-ended
+            windows[0] = (start_datestamp, windows[0][1])
+        return windows
+
+    def harvest(self, oaipmh_id, oaipmh_key, oaipmh_url):
+        '''
+        Function to harvest all windows of an endpoint in the process pool.
+        Returns dict containing (sample_count, written_count) tuple keyed by OAI-PMH key
+        '''
+        windows = self.get_windows(oaipmh_id, oaipmh_url)
+        logger.info('Harvesting {} in {} windows with {} worker processes'.format(oaipmh_key,
+                                                                                 len(windows),
+                                                                                 self.worker_count))
+
+        # Database-wide bulk load changes are made once here, while each worker switches its own connection
+        if self.bulk_load:
+            self.igsn_reader._prepare_bulk_load()
+        try:
+            with ProcessPoolExecutor(max_workers=self.worker_count) as process_pool:
+                futures = [process_pool.submit(harvest_window,
+                                               type(self.igsn_reader),
+                                               self.igsn_reader._get_reader_kwargs(),
+                                               oaipmh_key,
+                                               from_datestamp,
+                                               until_datestamp,
+                                               self.engine_kwargs)
+                           for from_datestamp, until_datestamp in windows
+                           ]
+
+                sample_count = 0
+                written_count = 0
+                failures = []
+                for (from_datestamp, until_datestamp), future in zip(windows, futures):
+                    try:
+                        window_sample_count, window_written_count = future.result()
+                    except Exception as e:
+                        logger.error('Harvest failed for {} window {} to {}: {}'.format(oaipmh_key,
+                                                                                        from_datestamp,
+                                                                                        until_datestamp,
+                                                                                        e))
+                        failures.append(e)
+                        continue
+
+                    sample_count += window_sample_count
+                    written_count += window_written_count
+                    logger.debug('{} samples read and {} samples written for {} window {} to {}'.format(window_sample_count,
+                                                                                                       window_written_count,
+                                                                                                       oaipmh_key,
+                                                                                                       from_datestamp,
+                                                                                                       until_datestamp))
+        finally:
+            if self.bulk_load:
+                self.igsn_reader._complete_bulk_load()
+
+        logger.info('{} samples read and {} samples written for {}'.format(sample_count, written_count, oaipmh_key))
+
+        # Re-raise the first failure only after all other windows have been harvested
+        if failures:
+            raise failures[0]
+
+        return {oaipmh_key: (sample_count, written_count)}
@@ -0,0 +1,133 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from ._igsn_reader import settings, SAMPLE_COLUMNS
+
+DEFAULT_SAMPLE_CACHE_SIZE = 10000 # Maximum number of looked up identifiers held in the sample cache
+
+IDENTIFIER_INDEX = SAMPLE_COLUMNS.index('IDENTIFIER') + 1 # Index of IDENTIFIER in cached (oaipmh_key, *SAMPLE_COLUMNS) tuples
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+
+class SampleCache(object):
+    '''
+    Thread-safe, size-bounded least recently used cache of stored samples keyed by looked up identifier, each of which
+    may be the OAI-PMH identifier of a sample or any of its dc:identifier values. Each entry holds a tuple of
+    (oaipmh_key, *SAMPLE_COLUMNS) tuples for the samples the identifier resolves to, which is empty for an identifier
+    which resolves to no sample, so that repeated lookups of unknown identifiers are also answered from the cache.
+    Entries are invalidated by the IDENTIFIER of any sample they hold, or by any identifier they are keyed by,
+    e.g. when a harvest writes or deletes a sample. Results of a lookup which overlapped an invalidation are not stored,
+    so that a lookup cannot replace an invalidated entry with samples read before they were updated.
+    '''
+
+    def __init__(self, max_size=None):
+        '''
+        SampleCache class Constructor
+        A max_size of 0 disables caching
+        '''
+        self.max_size = (max_size if max_size is not None
+                         else settings.get('sample_cache_size') if settings.get('sample_cache_size') is not None
+                         else DEFAULT_SAMPLE_CACHE_SIZE)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # Tuples of sample tuples keyed by looked up identifier, least recently used first
+        self._entry_keys = {} # Sets of looked up identifiers keyed by the IDENTIFIER of each sample they resolve to
+        self._generation = 0 # Number of invalidations, used to discard the results of lookups which overlapped one
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self):
+        '''
+        Number of invalidations so far, to be passed to put() with the results of a lookup started after reading it
+        '''
+        return self._generation
+
+    def get(self, identifiers):
+        '''
+        Function to return a dict of tuples of (oaipmh_key, *SAMPLE_COLUMNS) tuples keyed by each of identifiers
+        held in the cache, marking them as most recently used, and count hits and misses
+        '''
+        cached_samples = {}
+        with self._lock:
+            for identifier in identifiers:
+                samples = self._entries.get(identifier)
+                if samples is not None:
+                    self._entries.move_to_end(identifier)
+                    cached_samples[identifier] = samples
+            self.hits += len(cached_samples)
+            self.misses += len(identifiers) - len(cached_samples)
+        return cached_samples
+
+    def put(self, resolved_samples, generation):
+        '''
+        Function to store a dict of tuples of (oaipmh_key, *SAMPLE_COLUMNS) tuples keyed by looked up identifier,
+        evicting the least recently used entries beyond max_size.
+        Nothing is stored if the cache has been invalidated since generation was read
+        '''
+        with self._lock:
+            if generation != self._generation or not self.max_size:
+                return
+
+            for identifier, samples in resolved_samples.items():
+                self._remove_entry(identifier)
+                self._entries[identifier] = samples
+                for sample in samples:
+                    self._entry_keys.setdefault(sample[IDENTIFIER_INDEX], set()).add(identifier)
+
+            while len(self._entries) > self.max_size:
+                self._remove_entry(next(iter(self._entries)))
+
+    def invalidate(self, identifiers):
+        '''
+        Function to remove the entries keyed by any of identifiers, and all entries holding a sample with
+        an IDENTIFIER in identifiers
+        '''
+        with self._lock:
+            self._generation += 1
+            for identifier in identifiers:
+                self._remove_entry(identifier)
+                for entry_key in list(self._entry_keys.get(identifier, ())):
+                    self._remove_entry(entry_key)
+
+    def clear(self):
+        '''
+        Function to remove all entries, e.g. after samples have been written by another process
+        '''
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._entry_keys.clear()
+
+    def get_stats(self):
+        '''
+        Function to return a dict of cache statistics with keys size, max_size, hits, misses and hit_ratio
+        '''
+        with self._lock:
+            lookup_count = self.hits + self.misses
+            return {'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': self.hits / lookup_count if lookup_count else None,
+                    }
+
+    def _remove_entry(self, identifier):
+        '''
+        Function to remove the entry keyed by a looked up identifier, if any. Must be called holding the lock
+        '''
+        samples = self._entries.pop(identifier, None)
+        for sample in samples or ():
+            entry_keys = self._entry_keys.get(sample[IDENTIFIER_INDEX])
+            if entry_keys is not None:
+                entry_keys.discard(identifier)
+                if not entry_keys:
+                    del self._entry_keys[sample[IDENTIFIER_INDEX]]
@@ -0,0 +1,139 @@
+import os
+import csv
+import json
+import logging
+
+from ._igsn_reader import settings, SAMPLE_COLUMNS, EXTENT_COLUMNS
+
+DEFAULT_EXPORT_CHUNK_SIZE = 10000 # Number of rows read from the database and written as one Parquet row group at a time
+
+# Export formats keyed by file extension
+EXPORT_FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.parquet': 'parquet',
+    }
+
+# Names of exported fields, in order, matching the (oaipmh_key, *SAMPLE_COLUMNS) rows read for export
+EXPORT_COLUMNS = ['oaipmh_key'] + [column.lower() for column in SAMPLE_COLUMNS if column != 'OAIPMH_ID']
+
+FLOAT_COLUMNS = [column.lower() for column in EXTENT_COLUMNS] # Exported fields stored as doubles rather than strings in Parquet
+
+logger = logging.getLogger(__name__)
+
+if settings['debug']:
+    logger.setLevel(logging.DEBUG)
+else:
+    logger.setLevel(logging.INFO)
+logger.debug('Logger {} set to level {}'.format(logger.name, logger.level))
+
+
+def get_export_rows(sample_chunk):
+    '''
+    Function to return a list of export rows from a chunk of (oaipmh_key, *SAMPLE_COLUMNS) tuples,
+    dropping the database-specific OAIPMH_ID
+    '''
+    oaipmh_id_index = SAMPLE_COLUMNS.index('OAIPMH_ID') + 1
+    return [sample_row[:oaipmh_id_index] + sample_row[oaipmh_id_index + 1:] for sample_row in sample_chunk]
+
+
+def get_parquet_schema(columns=None):
+    '''
+    Function to return the pyarrow schema for exported samples, or for the specified columns,
+    with FLOAT_COLUMNS stored as doubles and all other fields stored as strings
+    '''
+    import pyarrow
+
+    return pyarrow.schema([(column, pyarrow.float64() if column in FLOAT_COLUMNS else pyarrow.string())
+                           for column in (columns or EXPORT_COLUMNS)])
+
+
+def get_parquet_table(export_rows, parquet_schema):
+    '''
+    Function to return a pyarrow Table of export rows, converted column by column
+    '''
+    import pyarrow
+
+    return pyarrow.Table.from_arrays([pyarrow.array([export_row[column_index] for export_row in export_rows],
+                                                    type=parquet_schema.field(column_index).type)
+                                      for column_index in range(len(parquet_schema))
+                                      ],
+                                     schema=parquet_schema)
+
+
+def write_csv(sample_chunks, export_file_path):
+    '''
+    Function to write chunks of samples to a CSV file with a header row and return the number of rows written
+    '''
+    row_count = 0
+    with open(export_file_path, 'w', newline='', encoding='utf-8') as export_file:
+        csv_writer = csv.writer(export_file)
+        csv_writer.writerow(EXPORT_COLUMNS)
+        for sample_chunk in sample_chunks:
+            export_rows = get_export_rows(sample_chunk)
+            csv_writer.writerows(export_rows)
+            row_count += len(export_rows)
+    return row_count
+
+
+def write_jsonl(sample_chunks, export_file_path):
+    '''
+    Function to write chunks of samples to a JSON lines file with one object per sample
+    and return the number of rows written
+    '''
+    row_count = 0
+    with open(export_file_path, 'w', encoding='utf-8') as export_file:
+        for sample_chunk in sample_chunks:
+            export_rows = get_export_rows(sample_chunk)
+            export_file.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, export_row)), ensure_ascii=False) + '\n'
+                                   for export_row in export_rows)
+            row_count += len(export_rows)
+    return row_count
+
+
+def write_parquet(sample_chunks, export_file_path):
+    '''
+    Function to write chunks of samples to a Parquet file with one row group per chunk
+    and return the number of rows written. Requires pyarrow
+    '''
+    import pyarrow.parquet
+
+    parquet_schema = get_parquet_schema()
+    row_count = 0
+    with pyarrow.parquet.ParquetWriter(export_file_path, parquet_schema) as parquet_writer:
+        for sample_chunk in sample_chunks:
+            export_rows = get_export_rows(sample_chunk)
+            if export_rows:
+                parquet_writer.write_table(get_parquet_table(export_rows, parquet_schema),
+                                           row_group_size=len(export_rows))
+                row_count += len(export_rows)
+    return row_count
+
+
+# Writer functions keyed by export format
+EXPORT_WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'parquet': write_parquet,
+    }
+
+
+def export_sample_chunks(sample_chunks, export_path, export_format=None):
+    '''
+    Function to write chunks of (oaipmh_key, *SAMPLE_COLUMNS) tuples to export_path in export_format,
+    determined from the file extension if not specified, and return the number of rows written.
+    The file is written under a temporary name and only replaces any existing file once complete
+    '''
+    export_format = export_format or EXPORT_FORMATS.get(os.path.splitext(export_path)[1].lower())
+    assert export_format in EXPORT_WRITERS, 'Unknown export format for "{}". Must be one of {}'.format(export_path,
+                                                                                                     sorted(EXPORT_WRITERS.keys()))
+
+    temp_path = '{}.{}.tmp'.format(export_path, os.getpid())
+    try:
+        logger.debug('Writing {} export to {}'.format(export_format, temp_path))
+        row_count = EXPORT_WRITERS[export_format](sample_chunks, temp_path)
+        os.replace(temp_path, export_path)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+    return row_count
@@ -17,6 +17,24 @@ SET check_function_bodies = false;
 SET client_min_messages = warning;
 SET row_security = off;
 
+--
+-- Name: sample_search_vector_update(); Type: FUNCTION; Schema: public; Owner: postgres
+--
+
+CREATE FUNCTION public.sample_search_vector_update() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+begin
+    new.search_vector := setweight(to_tsvector('english', coalesce(new.title, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(new.subject, '')), 'B')
+        || setweight(to_tsvector('english', coalesce(new.description, '')), 'C');
+    return new;
+end
+$$;
+
+
+ALTER FUNCTION public.sample_search_vector_update() OWNER TO postgres;
+
 --
 -- TOC entry 196 (class 1259 OID 19083)
 -- Name: OAIPMH_ID_SEQ; Type: SEQUENCE; Schema: public; Owner: postgres
@@ -82,14 +100,96 @@ CREATE TABLE public.sample (
     "type" text,
     format text,
     coverage text,
+    min_longitude double precision,
+    min_latitude double precision,
+    max_longitude double precision,
+    max_latitude double precision,
     creator text,
     publisher text,
-    rights text
+    rights text,
+    search_vector tsvector,
+    content_hash text,
+    deleted timestamp with time zone
 );
 
 
 ALTER TABLE public.sample OWNER TO postgres;
 
+--
+-- Name: harvest_state; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.harvest_state (
+    oaipmh_id bigint NOT NULL,
+    resumption_token text,
+    cursor bigint,
+    complete_list_size bigint,
+    updated timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.harvest_state OWNER TO postgres;
+
+--
+-- Name: sample_creator; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.sample_creator (
+    sample_id bigint NOT NULL,
+    ordinal integer NOT NULL,
+    value text NOT NULL
+);
+
+
+ALTER TABLE public.sample_creator OWNER TO postgres;
+
+--
+-- Name: sample_identifier; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.sample_identifier (
+    sample_id bigint NOT NULL,
+    ordinal integer NOT NULL,
+    value text NOT NULL
+);
+
+
+ALTER TABLE public.sample_identifier OWNER TO postgres;
+
+--
+-- Name: sample_relation; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.sample_relation (
+    sample_id bigint NOT NULL,
+    ordinal integer NOT NULL,
+    value text NOT NULL
+);
+
+
+ALTER TABLE public.sample_relation OWNER TO postgres;
+
+--
+-- Name: sample_subject; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.sample_subject (
+    sample_id bigint NOT NULL,
+    ordinal integer NOT NULL,
+    value text NOT NULL
+);
+
+
+ALTER TABLE public.sample_subject OWNER TO postgres;
+
+--
+-- Name: harvest_state harvest_state_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.harvest_state
+    ADD CONSTRAINT harvest_state_pkey PRIMARY KEY (oaipmh_id);
+
+
 --
 -- TOC entry 2681 (class 2606 OID 19102)
 -- Name: oaipmh oaipmh_oaipmh_key_key; Type: CONSTRAINT; Schema: public; Owner: postgres
@@ -135,6 +235,108 @@ ALTER TABLE ONLY public.sample
     ADD CONSTRAINT sample_pkey PRIMARY KEY (sample_id);
 
 
+--
+-- Name: sample_creator sample_creator_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.sample_creator
+    ADD CONSTRAINT sample_creator_pkey PRIMARY KEY (sample_id, ordinal);
+
+
+--
+-- Name: sample_identifier sample_identifier_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.sample_identifier
+    ADD CONSTRAINT sample_identifier_pkey PRIMARY KEY (sample_id, ordinal);
+
+
+--
+-- Name: sample_relation sample_relation_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.sample_relation
+    ADD CONSTRAINT sample_relation_pkey PRIMARY KEY (sample_id, ordinal);
+
+
+--
+-- Name: sample_subject sample_subject_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.sample_subject
+    ADD CONSTRAINT sample_subject_pkey PRIMARY KEY (sample_id, ordinal);
+
+
+--
+-- Name: sample_creator_value_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_creator_value_idx ON public.sample_creator USING btree (value);
+
+
+--
+-- Name: sample_datestamp_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_datestamp_idx ON public.sample USING btree (datestamp);
+
+
+--
+-- Name: sample_extent_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_extent_idx ON public.sample USING gist (box(point(min_longitude, min_latitude), point(max_longitude, max_latitude)));
+
+
+--
+-- Name: sample_identifier_value_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_identifier_value_idx ON public.sample_identifier USING btree (value);
+
+
+--
+-- Name: sample_oaipmh_id_datestamp_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_oaipmh_id_datestamp_idx ON public.sample USING btree (oaipmh_id, datestamp);
+
+
+--
+-- Name: sample_relation_value_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_relation_value_idx ON public.sample_relation USING btree (value);
+
+
+--
+-- Name: sample_search_vector_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_search_vector_idx ON public.sample USING gin (search_vector);
+
+
+--
+-- Name: sample_subject_value_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_subject_value_idx ON public.sample_subject USING btree (value);
+
+
+--
+-- Name: sample_type_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX sample_type_idx ON public.sample USING btree ("type");
+
+
+--
+-- Name: sample sample_search_vector_update; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER sample_search_vector_update BEFORE INSERT OR UPDATE OF title, subject, description ON public.sample FOR EACH ROW EXECUTE PROCEDURE public.sample_search_vector_update();
+
+
 --
 -- TOC entry 2690 (class 2606 OID 19111)
 -- Name: sample sample_oaipmh_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
@@ -144,6 +346,46 @@ ALTER TABLE ONLY public.sample
     ADD CONSTRAINT sample_oaipmh_id_fkey FOREIGN KEY (oaipmh_id) REFERENCES public.oaipmh(oaipmh_id);
 
 
+--
+-- Name: harvest_state harvest_state_oaipmh_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.harvest_state
+    ADD CONSTRAINT harvest_state_oaipmh_id_fkey FOREIGN KEY (oaipmh_id) REFERENCES public.oaipmh(oaipmh_id);
+
+
+--
+-- Name: sample_creator sample_creator_sample_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.sample_creator
+    ADD CONSTRAINT sample_creator_sample_id_fkey FOREIGN KEY (sample_id) REFERENCES public.sample(sample_id) ON DELETE CASCADE;
+
+
+--
+-- Name: sample_identifier sample_identifier_sample_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.sample_identifier
+    ADD CONSTRAINT sample_identifier_sample_id_fkey FOREIGN KEY (sample_id) REFERENCES public.sample(sample_id) ON DELETE CASCADE;
+
+
+--
+-- Name: sample_relation sample_relation_sample_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.sample_relation
+    ADD CONSTRAINT sample_relation_sample_id_fkey FOREIGN KEY (sample_id) REFERENCES public.sample(sample_id) ON DELETE CASCADE;
+
+
+--
+-- Name: sample_subject sample_subject_sample_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.sample_subject
+    ADD CONSTRAINT sample_subject_sample_id_fkey FOREIGN KEY (sample_id) REFERENCES public.sample(sample_id) ON DELETE CASCADE;
+
+
 --
 -- TOC entry 2817 (class 0 OID 0)
 -- Dependencies: 196
@@ -180,6 +422,41 @@ GRANT ALL ON TABLE public.oaipmh TO db_users;
 GRANT ALL ON TABLE public.sample TO db_users;
 
 
+--
+-- Name: TABLE harvest_state; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON TABLE public.harvest_state TO db_users;
+
+
+--
+-- Name: TABLE sample_creator; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON TABLE public.sample_creator TO db_users;
+
+
+--
+-- Name: TABLE sample_identifier; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON TABLE public.sample_identifier TO db_users;
+
+
+--
+-- Name: TABLE sample_relation; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON TABLE public.sample_relation TO db_users;
+
+
+--
+-- Name: TABLE sample_subject; Type: ACL; Schema: public; Owner: postgres
+--
+
+GRANT ALL ON TABLE public.sample_subject TO db_users;
+
+
 -- Completed on 2019-05-03 17:20:22
 
 --
@@ -1,11 +1,11 @@
-CREATE TABLE OAIPMH 
+CREATE TABLE IF NOT EXISTS OAIPMH 
 (
 	OAIPMH_ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE,
 	OAIPMH_KEY TEXT NOT NULL UNIQUE,
 	OAIPMH_URL TEXT NOT NULL UNIQUE
 );
 
-CREATE TABLE SAMPLE 
+CREATE TABLE IF NOT EXISTS SAMPLE 
 (
 	SAMPLE_ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE,
 	OAIPMH_ID INTEGER NOT NULL,
@@ -18,8 +18,137 @@ CREATE TABLE SAMPLE
 	TYPE TEXT,
 	FORMAT TEXT,
 	COVERAGE TEXT,
+	MIN_LONGITUDE REAL,
+	MIN_LATITUDE REAL,
+	MAX_LONGITUDE REAL,
+	MAX_LATITUDE REAL,
 	CREATOR	TEXT,
 	PUBLISHER TEXT,
 	RIGHTS TEXT,
+	CONTENT_HASH TEXT,
+	DELETED DATETIME,
 	FOREIGN KEY(OAIPMH_ID) REFERENCES OAIPMH(OAIPMH_ID)
-);
\ No newline at end of file
+);
+
+-- Every distinct value of the multi-valued elements of each SAMPLE, in document order, clustered by SAMPLE_ID.
+-- SAMPLE_IDENTIFIER also holds the SAMPLE IDENTIFIER, so any identifier of a sample can be found with one index
+CREATE TABLE IF NOT EXISTS SAMPLE_IDENTIFIER
+(
+	SAMPLE_ID INTEGER NOT NULL,
+	ORDINAL INTEGER NOT NULL,
+	VALUE TEXT NOT NULL,
+	PRIMARY KEY (SAMPLE_ID, ORDINAL),
+	FOREIGN KEY(SAMPLE_ID) REFERENCES SAMPLE(SAMPLE_ID)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS SAMPLE_RELATION
+(
+	SAMPLE_ID INTEGER NOT NULL,
+	ORDINAL INTEGER NOT NULL,
+	VALUE TEXT NOT NULL,
+	PRIMARY KEY (SAMPLE_ID, ORDINAL),
+	FOREIGN KEY(SAMPLE_ID) REFERENCES SAMPLE(SAMPLE_ID)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS SAMPLE_SUBJECT
+(
+	SAMPLE_ID INTEGER NOT NULL,
+	ORDINAL INTEGER NOT NULL,
+	VALUE TEXT NOT NULL,
+	PRIMARY KEY (SAMPLE_ID, ORDINAL),
+	FOREIGN KEY(SAMPLE_ID) REFERENCES SAMPLE(SAMPLE_ID)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS SAMPLE_CREATOR
+(
+	SAMPLE_ID INTEGER NOT NULL,
+	ORDINAL INTEGER NOT NULL,
+	VALUE TEXT NOT NULL,
+	PRIMARY KEY (SAMPLE_ID, ORDINAL),
+	FOREIGN KEY(SAMPLE_ID) REFERENCES SAMPLE(SAMPLE_ID)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS HARVEST_STATE
+(
+	OAIPMH_ID INTEGER PRIMARY KEY NOT NULL,
+	RESUMPTION_TOKEN TEXT,
+	CURSOR INTEGER,
+	COMPLETE_LIST_SIZE INTEGER,
+	UPDATED DATETIME NOT NULL,
+	FOREIGN KEY(OAIPMH_ID) REFERENCES OAIPMH(OAIPMH_ID)
+);
+
+CREATE INDEX IF NOT EXISTS SAMPLE_OAIPMH_ID_DATESTAMP_IDX ON SAMPLE (OAIPMH_ID, DATESTAMP);
+
+CREATE INDEX IF NOT EXISTS SAMPLE_DATESTAMP_IDX ON SAMPLE (DATESTAMP);
+
+CREATE INDEX IF NOT EXISTS SAMPLE_TYPE_IDX ON SAMPLE (TYPE);
+
+CREATE INDEX IF NOT EXISTS SAMPLE_IDENTIFIER_VALUE_IDX ON SAMPLE_IDENTIFIER (VALUE);
+
+CREATE INDEX IF NOT EXISTS SAMPLE_RELATION_VALUE_IDX ON SAMPLE_RELATION (VALUE);
+
+CREATE INDEX IF NOT EXISTS SAMPLE_SUBJECT_VALUE_IDX ON SAMPLE_SUBJECT (VALUE);
+
+CREATE INDEX IF NOT EXISTS SAMPLE_CREATOR_VALUE_IDX ON SAMPLE_CREATOR (VALUE);
+
+-- Full-text index over SAMPLE, storing no content of its own, kept up to date by the triggers below
+CREATE VIRTUAL TABLE IF NOT EXISTS SAMPLE_FTS USING fts5
+(
+	TITLE,
+	SUBJECT,
+	DESCRIPTION,
+	content='SAMPLE',
+	content_rowid='SAMPLE_ID',
+	tokenize='porter unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS SAMPLE_FTS_INSERT AFTER INSERT ON SAMPLE
+BEGIN
+	INSERT INTO SAMPLE_FTS (rowid, TITLE, SUBJECT, DESCRIPTION)
+	VALUES (new.SAMPLE_ID, new.TITLE, new.SUBJECT, new.DESCRIPTION);
+END;
+
+CREATE TRIGGER IF NOT EXISTS SAMPLE_FTS_DELETE AFTER DELETE ON SAMPLE
+BEGIN
+	INSERT INTO SAMPLE_FTS (SAMPLE_FTS, rowid, TITLE, SUBJECT, DESCRIPTION)
+	VALUES ('delete', old.SAMPLE_ID, old.TITLE, old.SUBJECT, old.DESCRIPTION);
+END;
+
+CREATE TRIGGER IF NOT EXISTS SAMPLE_FTS_UPDATE AFTER UPDATE OF TITLE, SUBJECT, DESCRIPTION ON SAMPLE
+BEGIN
+	INSERT INTO SAMPLE_FTS (SAMPLE_FTS, rowid, TITLE, SUBJECT, DESCRIPTION)
+	VALUES ('delete', old.SAMPLE_ID, old.TITLE, old.SUBJECT, old.DESCRIPTION);
+	INSERT INTO SAMPLE_FTS (rowid, TITLE, SUBJECT, DESCRIPTION)
+	VALUES (new.SAMPLE_ID, new.TITLE, new.SUBJECT, new.DESCRIPTION);
+END;
+
+-- Spatial index of the extent of each SAMPLE with a parsed COVERAGE, kept up to date by the triggers below.
+-- Bounds are stored as 32-bit floats rounded outwards, so matches must be checked against the SAMPLE extent
+CREATE VIRTUAL TABLE IF NOT EXISTS SAMPLE_RTREE USING rtree
+(
+	SAMPLE_ID,
+	MIN_LONGITUDE, MAX_LONGITUDE,
+	MIN_LATITUDE, MAX_LATITUDE
+);
+
+CREATE TRIGGER IF NOT EXISTS SAMPLE_RTREE_INSERT AFTER INSERT ON SAMPLE
+WHEN new.MIN_LONGITUDE IS NOT NULL
+BEGIN
+	INSERT INTO SAMPLE_RTREE (SAMPLE_ID, MIN_LONGITUDE, MAX_LONGITUDE, MIN_LATITUDE, MAX_LATITUDE)
+	VALUES (new.SAMPLE_ID, new.MIN_LONGITUDE, new.MAX_LONGITUDE, new.MIN_LATITUDE, new.MAX_LATITUDE);
+END;
+
+CREATE TRIGGER IF NOT EXISTS SAMPLE_RTREE_DELETE AFTER DELETE ON SAMPLE
+WHEN old.MIN_LONGITUDE IS NOT NULL
+BEGIN
+	DELETE FROM SAMPLE_RTREE WHERE SAMPLE_ID = old.SAMPLE_ID;
+END;
+
+CREATE TRIGGER IF NOT EXISTS SAMPLE_RTREE_UPDATE AFTER UPDATE OF MIN_LONGITUDE, MIN_LATITUDE, MAX_LONGITUDE, MAX_LATITUDE ON SAMPLE
+BEGIN
+	DELETE FROM SAMPLE_RTREE WHERE SAMPLE_ID = old.SAMPLE_ID;
+	INSERT INTO SAMPLE_RTREE (SAMPLE_ID, MIN_LONGITUDE, MAX_LONGITUDE, MIN_LATITUDE, MAX_LATITUDE)
+	SELECT new.SAMPLE_ID, new.MIN_LONGITUDE, new.MAX_LONGITUDE, new.MIN_LATITUDE, new.MAX_LATITUDE
+	WHERE new.MIN_LONGITUDE IS NOT NULL;
+END;
\ No newline at end of file
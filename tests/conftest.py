@@ -0,0 +1,62 @@
+'''
+Fixtures for behaviour tests harvesting from a local synthetic OAI-PMH server into a temporary SQLite database
+'''
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks')) # synthetic_oaipmh and synthetic_server are plain modules
+
+from synthetic_oaipmh import SyntheticEndpoint
+from synthetic_server import SyntheticOAIPMHServer
+
+import igsn_reader
+from igsn_reader import settings
+
+RECORD_COUNT = 1000 # Number of records served by each synthetic endpoint
+PAGE_SIZE = 100 # Number of records in each synthetic ListRecords page
+BATCH_SIZE = 200 # Minimum number of records written in each batch, so that each harvest writes several batches
+
+
+@pytest.fixture
+def record_count():
+    '''
+    Number of records served by each synthetic endpoint
+    '''
+    return RECORD_COUNT
+
+
+@pytest.fixture
+def batch_size():
+    '''
+    Minimum number of records written in each batch by the sqlite_reader fixture
+    '''
+    return BATCH_SIZE
+
+
+@pytest.fixture
+def synthetic_endpoints(record_count):
+    '''
+    Dict of SyntheticEndpoint objects keyed by OAI-PMH key, which tests may modify between harvests
+    '''
+    return {'GA': SyntheticEndpoint('GA', record_count, page_size=PAGE_SIZE)}
+
+
+@pytest.fixture
+def sqlite_reader(synthetic_endpoints, batch_size, tmp_path, monkeypatch):
+    '''
+    IGSNReader_SQLite writing to a temporary database and harvesting from a synthetic server serving synthetic_endpoints
+    '''
+    with SyntheticOAIPMHServer(synthetic_endpoints) as synthetic_server:
+        monkeypatch.setitem(settings, 'debug', False)
+        monkeypatch.setitem(settings, 'batch_size', batch_size)
+        monkeypatch.setitem(settings, 'oai_pmh_endpoints', {oaipmh_key: synthetic_server.get_url(oaipmh_key)
+                                                            for oaipmh_key in synthetic_endpoints.keys()})
+        igsn_reader_object = igsn_reader.get_IGSNReader('SQLite', sqlite_db_path=str(tmp_path / 'igsn_db.sqlite'))
+        try:
+            yield igsn_reader_object
+        finally:
+            igsn_reader_object.close()
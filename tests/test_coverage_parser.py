@@ -0,0 +1,130 @@
+'''
+Tests of parsing Dublin Core coverages into extents, and of bounding box searches of the extents stored in SQLite
+'''
+import re
+
+import pytest
+
+from igsn_reader._coverage_parser import parse_coverage
+
+TARGET_IDENTIFIER = 'au.ga.00000000' # Identifier of the one synthetic sample given TARGET_COVERAGE
+TARGET_COVERAGE = 'POINT(147.0000001 -18.0000001)' # Not exactly representable by the 32-bit floats of an R*Tree
+ANTIMERIDIAN_IDENTIFIER = 'au.ga.00000001' # Identifier of the one synthetic sample given ANTIMERIDIAN_COVERAGE
+ANTIMERIDIAN_COVERAGE = 'northlimit=-39; southlimit=-40; westlimit=179; eastlimit=-179'
+OTHER_COVERAGE = 'POINT(120 -30)' # Coverage of all other synthetic samples, well away from TARGET_COVERAGE
+
+
+@pytest.mark.parametrize('coverage, extent', [
+    ('POINT(147.5 -18.2)', (147.5, -18.2, 147.5, -18.2)),
+    ('point (147.5 -18.2)', (147.5, -18.2, 147.5, -18.2)),
+    ('POINT Z (147.5 -18.2 10)', (147.5, -18.2, 147.5, -18.2)),
+    ('POLYGON((147 -18, 148 -18, 148 -19, 147 -18))', (147.0, -19.0, 148.0, -18.0)),
+    ('MULTIPOINT((147 -18), (148 -19))', (147.0, -19.0, 148.0, -18.0)),
+    ('LINESTRING ZM (147 -18 5 1, 148 -19 6 2)', (147.0, -19.0, 148.0, -18.0)),
+    ])
+def test_wkt(coverage, extent):
+    assert parse_coverage(coverage) == extent
+
+
+@pytest.mark.parametrize('coverage, extent', [
+    ('SRID=4326;POINT(147.5 -18.2)', (147.5, -18.2, 147.5, -18.2)),
+    ('SRID=4326; LINESTRING Z (147 -18 5, 148 -19 6)', (147.0, -19.0, 148.0, -18.0)),
+    ])
+def test_ewkt(coverage, extent):
+    assert parse_coverage(coverage) == extent
+
+
+@pytest.mark.parametrize('coverage, extent', [
+    ('east=147.5; north=-18.2', (147.5, -18.2, 147.5, -18.2)),
+    ('North=-18.2;East=147.5', (147.5, -18.2, 147.5, -18.2)),
+    ('name=Site A; east=147.5 degrees; north=-18.2 degrees; projection=WGS84', (147.5, -18.2, 147.5, -18.2)),
+    ])
+def test_dcmi_point(coverage, extent):
+    assert parse_coverage(coverage) == extent
+
+
+@pytest.mark.parametrize('coverage, extent', [
+    ('northlimit=-18; southlimit=-19; westlimit=147; eastlimit=148', (147.0, -19.0, 148.0, -18.0)),
+    ('westlimit=147; eastlimit=148; southlimit=-19; northlimit=-18; uplimit=0', (147.0, -19.0, 148.0, -18.0)),
+    # Box with southlimit north of northlimit
+    ('northlimit=-19; southlimit=-18; westlimit=147; eastlimit=148', (147.0, -19.0, 148.0, -18.0)),
+    # Box crossing the antimeridian
+    ('northlimit=-18; southlimit=-19; westlimit=179; eastlimit=-179', (-180.0, -19.0, 180.0, -18.0)),
+    ])
+def test_dcmi_box(coverage, extent):
+    assert parse_coverage(coverage) == extent
+
+
+@pytest.mark.parametrize('coverage', [
+    None,
+    '',
+    'Western Australia',
+    'POINT()',
+    'POINT EMPTY',
+    'POINT(147)',
+    'POINT(147 -18',
+    'POINT(500000 7000000)', # Projected coordinates
+    'east=147.5',
+    'east=unknown; north=-18.2',
+    'northlimit=-18; southlimit=-19; westlimit=147',
+    'east=147.5; north=-95',
+    'northlimit=-18; southlimit=-19; westlimit=147; eastlimit=190',
+    ])
+def test_malformed_coverage(coverage):
+    assert parse_coverage(coverage) is None
+
+
+@pytest.fixture
+def record_count():
+    '''
+    Number of records served by each synthetic endpoint, overridden so that each test harvests only a few samples
+    '''
+    return 10
+
+
+@pytest.fixture
+def bbox_reader(sqlite_reader, synthetic_endpoints):
+    '''
+    sqlite_reader which has harvested one sample with TARGET_COVERAGE, one with ANTIMERIDIAN_COVERAGE
+    and other samples with OTHER_COVERAGE
+    '''
+    coverages = {0: TARGET_COVERAGE, 1: ANTIMERIDIAN_COVERAGE}
+    synthetic_endpoint = synthetic_endpoints['GA']
+    get_record_xml = synthetic_endpoint.get_record_xml
+    synthetic_endpoint.get_record_xml = lambda index: re.sub('<dc:coverage>.*?</dc:coverage>',
+                                                             '<dc:coverage>{}</dc:coverage>'.format(coverages.get(index, OTHER_COVERAGE)),
+                                                             get_record_xml(index))
+    sqlite_reader.read_igsns()
+    return sqlite_reader
+
+
+def test_search_bbox_rechecks_rtree_candidates_against_sample_extent(bbox_reader):
+    bbox = (146.9, -18.1, 147.00000005, -17.9)
+
+    # The R*Tree bounds of the sample are rounded outwards, so the index alone would find it
+    [(rtree_candidate_count,)] = bbox_reader.db_connection.cursor().execute(
+        '''select count(*) from SAMPLE_RTREE
+        where MAX_LONGITUDE >= :min_longitude and MIN_LONGITUDE <= :max_longitude
+            and MAX_LATITUDE >= :min_latitude and MIN_LATITUDE <= :max_latitude''',
+        dict(zip(['min_longitude', 'min_latitude', 'max_longitude', 'max_latitude'], bbox))).fetchall()
+    assert rtree_candidate_count == 1
+
+    assert bbox_reader.search_bbox(bbox) == []
+    assert [sample['identifier'] for sample in bbox_reader.search_bbox((146.9, -18.1, 147.0000001, -17.9))] == [TARGET_IDENTIFIER]
+
+
+def test_search_bbox_within(bbox_reader):
+    assert [sample['identifier'] for sample in bbox_reader.search_bbox((146, -19, 148, -17), within=True)] == [TARGET_IDENTIFIER]
+    assert len(bbox_reader.search_bbox((100, -40, 150, -10), within=True)) == 9
+    assert bbox_reader.search_bbox((147.0000001, -18.0000001, 150, -10), within=True)[0]['identifier'] == TARGET_IDENTIFIER
+
+
+def test_search_bbox_finds_box_crossing_antimeridian(bbox_reader):
+    assert [sample['identifier'] for sample in bbox_reader.search_bbox((-179.5, -39.5, -179.2, -39.2))] == [ANTIMERIDIAN_IDENTIFIER]
+    assert [sample['identifier'] for sample in bbox_reader.search_bbox((0, -39.5, 1, -39.2))] == [ANTIMERIDIAN_IDENTIFIER]
+    assert not bbox_reader.search_bbox((-179.5, -39.5, -179.2, -39.2), within=True)
+
+
+def test_search_bbox_rejects_inverted_bbox(bbox_reader):
+    with pytest.raises(AssertionError):
+        bbox_reader.search_bbox((148, -19, 147, -18))
@@ -0,0 +1,141 @@
+'''
+Tests of Dublin Core extraction from ListRecords responses of each endpoint profile
+'''
+from lxml import etree
+import pytest
+
+from igsn_reader._dc_extractor import DublinCoreExtractor
+
+# Dublin Core elements of the first record of each response, including an element which is not read
+DC_XML = ('<dc:identifier>http://pid.example.org/au.ga.00000001</dc:identifier>'
+          '<dc:identifier>IGSN:AU.GA.00000001</dc:identifier>'
+          '<dc:title>Sample 1 &amp; friends</dc:title>'
+          '<dc:subject>geology</dc:subject><dc:subject>borehole</dc:subject><dc:subject>geology</dc:subject>'
+          '<dc:description>Sample 1 core interval</dc:description>'
+          '<dc:date>2015-01-01</dc:date>'
+          '<dc:type>core</dc:type>'
+          '<dc:format>physical</dc:format>'
+          '<dc:coverage>POINT(147.5 -18.2)</dc:coverage>'
+          '<dc:creator>Survey 1</dc:creator><dc:creator>Driller 1</dc:creator>'
+          '<dc:contributor>Laboratory 1</dc:contributor>'
+          '<dc:publisher>Example Survey</dc:publisher>'
+          '<dc:relation>au.ga.00000000</dc:relation><dc:relation>au.ga.00000002</dc:relation>'
+          '<dc:rights>CC-BY 4.0</dc:rights>')
+
+# Complete ListRecords responses, with a record, a deleted record and a resumptionToken, keyed by endpoint shape
+RESPONSES = {
+    'GA': ('<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+           '<responseDate>2019-01-01T00:00:00Z</responseDate><request verb="ListRecords">http://example.org/oai</request>'
+           '<ListRecords>'
+           '<record><header><identifier>au.ga.00000001</identifier><datestamp>2015-01-01T00:00:00Z</datestamp></header>'
+           '<metadata>{dc}</metadata></record>'
+           '<record><header status="deleted"><identifier>au.ga.00000002</identifier>'
+           '<datestamp>2015-01-02T00:00:00Z</datestamp></header></record>'
+           '<resumptionToken cursor="0" completeListSize="3">2||</resumptionToken>'
+           '</ListRecords></OAI-PMH>'),
+    'ARDC': ('<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+             '<responseDate>2019-01-01T00:00:00Z</responseDate><request verb="ListRecords">http://example.org/oai</request>'
+             '<ListRecords>'
+             '<record><header><identifier>au.ga.00000001</identifier><datestamp>2015-01-01T00:00:00Z</datestamp></header>'
+             '<metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+             'xmlns:dc="http://purl.org/dc/elements/1.1/">{dc}</oai_dc:dc></metadata></record>'
+             '<record><header status="deleted"><identifier>au.ga.00000002</identifier>'
+             '<datestamp>2015-01-02T00:00:00Z</datestamp></header></record>'
+             '<resumptionToken cursor="0" completeListSize="3">2||</resumptionToken>'
+             '</ListRecords></OAI-PMH>'),
+    'CSIRO': ('<ns3:OAI-PMH xmlns:ns3="http://www.openarchives.org/OAI/2.0/">'
+              '<ns3:responseDate>2019-01-01T00:00:00Z</ns3:responseDate>'
+              '<ns3:request verb="ListRecords">http://example.org/oai</ns3:request>'
+              '<ns3:ListRecords>'
+              '<ns3:record><ns3:header><ns3:identifier>au.ga.00000001</ns3:identifier>'
+              '<ns3:datestamp>2015-01-01T00:00:00Z</ns3:datestamp></ns3:header>'
+              '<ns3:metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+              'xmlns:dc="http://purl.org/dc/elements/1.1/">{dc}</oai_dc:dc></ns3:metadata></ns3:record>'
+              '<ns3:record><ns3:header status="deleted"><ns3:identifier>au.ga.00000002</ns3:identifier>'
+              '<ns3:datestamp>2015-01-02T00:00:00Z</ns3:datestamp></ns3:header></ns3:record>'
+              '<ns3:resumptionToken cursor="0" completeListSize="3">2||</ns3:resumptionToken>'
+              '</ns3:ListRecords></ns3:OAI-PMH>'),
+    }
+
+PROFILES = {'GA': 'bare', 'ARDC': 'oai_dc', 'CSIRO': 'oai_dc'} # Dublin Core profile of each endpoint shape
+
+# Sample row read from the first record of each response by the extraction which preceded DublinCoreExtractor,
+# which kept relations as a comma-separated string
+BASELINE_SAMPLE_ROW = {
+    'identifier': 'au.ga.00000001',
+    'datestamp': '2015-01-01T00:00:00Z',
+    'alt_identifiers': 'http://pid.example.org/au.ga.00000001, IGSN:AU.GA.00000001',
+    'relations': 'au.ga.00000000, au.ga.00000002',
+    'title': 'Sample 1 & friends',
+    'subject': 'geology',
+    'description': 'Sample 1 core interval',
+    'date': '2015-01-01',
+    'type': 'core',
+    'format': 'physical',
+    'coverage': 'POINT(147.5 -18.2)',
+    'creator': 'Survey 1',
+    'publisher': 'Example Survey',
+    'rights': 'CC-BY 4.0',
+    }
+
+
+@pytest.fixture(params=sorted(RESPONSES.keys()))
+def shape(request):
+    '''
+    Endpoint shape, i.e. a key of RESPONSES
+    '''
+    return request.param
+
+
+@pytest.fixture
+def list_records_element(shape):
+    '''
+    ListRecords element of the parsed response for shape
+    '''
+    response_tree = etree.fromstring(RESPONSES[shape].format(dc=DC_XML).encode('utf-8'))
+    return DublinCoreExtractor().get_list_records_element(response_tree)
+
+
+def test_extraction_matches_baseline(shape, list_records_element):
+    dc_extractor = DublinCoreExtractor()
+    record = dc_extractor.extract(dc_extractor.get_records(list_records_element)[0])
+
+    assert dc_extractor.profile == PROFILES[shape]
+    assert dict({key: record[key] for key in BASELINE_SAMPLE_ROW.keys()},
+                relations=', '.join(record['relations'])) == BASELINE_SAMPLE_ROW
+
+
+def test_multi_values_and_extent(list_records_element):
+    dc_extractor = DublinCoreExtractor()
+    record = dc_extractor.extract(dc_extractor.get_records(list_records_element)[0])
+
+    assert record['deleted'] is None
+    assert record['identifiers'] == ['au.ga.00000001', 'http://pid.example.org/au.ga.00000001', 'IGSN:AU.GA.00000001']
+    assert record['subjects'] == ['geology', 'borehole']
+    assert record['creators'] == ['Survey 1', 'Driller 1']
+    assert record['relations'] == ['au.ga.00000000', 'au.ga.00000002']
+    assert (record['min_longitude'], record['min_latitude'], record['max_longitude'], record['max_latitude']
+            ) == (147.5, -18.2, 147.5, -18.2)
+
+
+def test_deleted_record(list_records_element):
+    dc_extractor = DublinCoreExtractor()
+
+    assert dc_extractor.extract(dc_extractor.get_records(list_records_element)[1]) == {
+        'identifier': 'au.ga.00000002',
+        'datestamp': '2015-01-02T00:00:00Z',
+        'deleted': '2015-01-02T00:00:00Z',
+        }
+
+
+def test_resumption_token(list_records_element):
+    assert DublinCoreExtractor().get_resumption_token(list_records_element) == ('2||', 0, 3)
+
+
+def test_record_without_metadata_for_fixed_profile():
+    response_tree = etree.fromstring(RESPONSES['GA'].format(dc=DC_XML).encode('utf-8'))
+    dc_extractor = DublinCoreExtractor(profile='oai_dc')
+    record_element = dc_extractor.get_records(dc_extractor.get_list_records_element(response_tree))[0]
+
+    with pytest.raises(ValueError, match='No Dublin Core metadata found for au.ga.00000001'):
+        dc_extractor.extract(record_element)
@@ -0,0 +1,138 @@
+'''
+Behaviour tests for change detection, checkpoints and resumption of harvests into SQLite
+'''
+import threading
+
+import pytest
+
+from igsn_reader import settings, _harvest_engine
+
+
+def get_rows(igsn_reader_object, sql, params=()):
+    '''
+    Function to return all rows of a query against the reader's database
+    '''
+    return igsn_reader_object.db_connection.cursor().execute(sql, params).fetchall()
+
+
+def test_unchanged_records_are_skipped(sqlite_reader, record_count):
+    assert sqlite_reader.read_igsns(skip_unchanged=True) == {'GA': (record_count, record_count)}
+
+    assert sqlite_reader.read_igsns(skip_unchanged=True) == {'GA': (record_count, 0)}
+    assert sqlite_reader._metrics.get_summary()['GA']['skipped'] == record_count
+
+
+def test_changed_records_are_updated_in_place(sqlite_reader, synthetic_endpoints, record_count):
+    sqlite_reader.read_igsns(skip_unchanged=True)
+
+    synthetic_endpoint = synthetic_endpoints['GA']
+    get_record_xml = synthetic_endpoint.get_record_xml
+    synthetic_endpoint.get_record_xml = lambda index: (get_record_xml(index).replace('&amp; friends', 'revised')
+                                                       if index % 10 == 0 else get_record_xml(index))
+
+    assert sqlite_reader.read_igsns(skip_unchanged=True) == {'GA': (record_count, record_count // 10)}
+    assert get_rows(sqlite_reader, "select count(*), sum(TITLE like '%revised') from SAMPLE") == [(record_count, record_count // 10)]
+
+
+@pytest.mark.parametrize('skip_unchanged', [True, False])
+def test_deleted_records_are_stored_again_when_they_reappear(sqlite_reader, synthetic_endpoints, record_count, skip_unchanged):
+    sqlite_reader.read_igsns(skip_unchanged=skip_unchanged)
+
+    synthetic_endpoint = synthetic_endpoints['GA']
+    synthetic_endpoint.deleted_every = 10
+    sqlite_reader.read_igsns(skip_unchanged=skip_unchanged)
+    assert get_rows(sqlite_reader, 'select count(*) from SAMPLE where DELETED is not null') == [(record_count // 10,)]
+    assert not sqlite_reader.get_samples(['IGSN:AU.GA.00000009'])
+
+    synthetic_endpoint.deleted_every = 0
+    assert sqlite_reader.read_igsns(skip_unchanged=skip_unchanged)['GA'][1] >= record_count // 10
+
+    assert get_rows(sqlite_reader, 'select count(*) from SAMPLE where DELETED is not null') == [(0,)]
+    assert sqlite_reader.get_samples(['IGSN:AU.GA.00000009'])['IGSN:AU.GA.00000009'][0]['title'] == 'Sample 9 & friends'
+
+
+def test_resume_after_failed_batch(sqlite_reader, record_count, batch_size):
+    write_samples = sqlite_reader._write_samples
+    written_batches = []
+
+    def fail_after_first_batch(sample_rows, upsert=False, checkpoint=None):
+        # Fail every write, including per-record retries, once one batch has been written
+        if written_batches:
+            raise RuntimeError('Simulated write failure')
+        written_batches.append(len(sample_rows))
+        return write_samples(sample_rows, upsert=upsert, checkpoint=checkpoint)
+
+    sqlite_reader._write_samples = fail_after_first_batch
+    with pytest.raises(RuntimeError, match='{0} of {0} records could not be written'.format(batch_size)):
+        sqlite_reader.read_igsns()
+
+    # No checkpoint may be stored past the lost batch
+    assert get_rows(sqlite_reader, 'select count(*) from SAMPLE') == [(batch_size,)]
+    [(resumption_token,)] = get_rows(sqlite_reader, 'select RESUMPTION_TOKEN from HARVEST_STATE')
+    assert resumption_token
+
+    # The resumed harvest starts with the first record not written
+    sqlite_reader._write_samples = write_samples
+    remaining_count = record_count - batch_size
+    assert sqlite_reader.read_igsns(resume=True) == {'GA': (remaining_count, remaining_count)}
+
+    assert get_rows(sqlite_reader, 'select count(*), count(distinct IDENTIFIER) from SAMPLE') == [(record_count, record_count)]
+    assert get_rows(sqlite_reader, 'select RESUMPTION_TOKEN from HARVEST_STATE') == [(None,)]
+
+
+def test_resume_after_failed_record(sqlite_reader, record_count, batch_size):
+    write_samples = sqlite_reader._write_samples
+    failed_identifier = 'au.ga.{:08d}'.format(batch_size + 50) # Record in the second batch
+
+    def fail_record(sample_rows, upsert=False, checkpoint=None):
+        if any(sample_row['identifier'] == failed_identifier for sample_row in sample_rows):
+            raise RuntimeError('Simulated record write failure')
+        return write_samples(sample_rows, upsert=upsert, checkpoint=checkpoint)
+
+    sqlite_reader._write_samples = fail_record
+    with pytest.raises(RuntimeError, match='1 of {} records could not be written'.format(batch_size)):
+        sqlite_reader.read_igsns()
+
+    # The other records of the batch are written, but its checkpoint is not
+    assert get_rows(sqlite_reader, 'select count(*) from SAMPLE') == [(2 * batch_size - 1,)]
+    [(resumption_token,)] = get_rows(sqlite_reader, 'select RESUMPTION_TOKEN from HARVEST_STATE')
+    assert resumption_token.startswith('{}|'.format(batch_size))
+
+    sqlite_reader._write_samples = write_samples
+    assert sqlite_reader.read_igsns(resume=True)['GA'][0] == record_count - batch_size
+
+    assert get_rows(sqlite_reader, 'select count(*), count(distinct IDENTIFIER) from SAMPLE') == [(record_count, record_count)]
+    assert get_rows(sqlite_reader, 'select RESUMPTION_TOKEN from HARVEST_STATE') == [(None,)]
+
+
+@pytest.mark.parametrize('debug_max_samples, resumption_token', [
+    (150, '100||'), # Limit within the first batch, so the checkpoint is from before the page cut short
+    (200, '200||'), # Limit at the end of a batch, so no records are left unwritten
+    (250, '200||'), # Limit after the first batch, whose checkpoint is kept
+    ])
+def test_debug_limit_checkpoint(sqlite_reader, record_count, monkeypatch, debug_max_samples, resumption_token):
+    monkeypatch.setitem(settings, 'debug', True)
+    monkeypatch.setattr(_harvest_engine, 'DEBUG_MAX_SAMPLES', debug_max_samples)
+    assert sqlite_reader.read_igsns() == {'GA': (debug_max_samples, debug_max_samples)}
+    assert get_rows(sqlite_reader, 'select RESUMPTION_TOKEN from HARVEST_STATE') == [(resumption_token,)]
+
+    monkeypatch.setitem(settings, 'debug', False)
+    sqlite_reader.read_igsns(resume=True)
+
+    assert get_rows(sqlite_reader, 'select count(*), count(distinct IDENTIFIER) from SAMPLE') == [(record_count, record_count)]
+
+
+def test_batches_are_written_outside_event_loop_thread(sqlite_reader, record_count):
+    write_samples = sqlite_reader._write_samples
+    write_threads = set()
+
+    def record_write_thread(sample_rows, upsert=False, checkpoint=None):
+        write_threads.add(threading.current_thread())
+        return write_samples(sample_rows, upsert=upsert, checkpoint=checkpoint)
+
+    sqlite_reader._write_samples = record_write_thread
+    assert sqlite_reader.read_igsns() == {'GA': (record_count, record_count)}
+
+    # All batches are written by one database thread, and the connection can still be used by the calling thread
+    assert len(write_threads) == 1 and threading.current_thread() not in write_threads
+    assert get_rows(sqlite_reader, 'select count(*) from SAMPLE') == [(record_count,)]
@@ -0,0 +1,188 @@
+'''
+Tests of the retry, backoff and rate limiting policies of the OAI-PMH HTTP client, using a scripted session and a fake clock
+'''
+import io
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from igsn_reader import _oaipmh_client
+from igsn_reader._oaipmh_client import OAIPMHClient
+
+OAIPMH_URL = 'http://example.org/oai' # URL of the endpoint requested in each test
+OTHER_OAIPMH_URL = 'http://example.com/oai' # URL of another endpoint, which is not held back with OAIPMH_URL
+
+
+class FakeClock(object):
+    '''
+    Monotonic clock which only advances when slept on, recording each sleep
+    '''
+    def __init__(self):
+        self.time = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.time += seconds
+
+
+class FakeSession(object):
+    '''
+    Session returning a scripted response, or raising a scripted exception, for each request in turn
+    '''
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.request_count = 0
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        self.request_count += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def get_response(status_code, retry_after=None):
+    '''
+    Function to return a requests.Response with a status code and an optional Retry-After header
+    '''
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b'<OAI-PMH/>' if status_code == 200 else b''
+    response.raw = io.BytesIO(response._content)
+    if retry_after is not None:
+        response.headers['Retry-After'] = retry_after
+    return response
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    '''
+    FakeClock used by the client for all waits, with full jitter disabled so that each backoff is its upper bound
+    '''
+    fake_clock = FakeClock()
+    monkeypatch.setattr(_oaipmh_client, 'monotonic', fake_clock.monotonic)
+    monkeypatch.setattr(_oaipmh_client, 'sleep', fake_clock.sleep)
+    monkeypatch.setattr(_oaipmh_client.random, 'uniform', lambda low, high: high)
+    return fake_clock
+
+
+def get_client(monkeypatch, outcomes, **client_kwargs):
+    '''
+    Function to return an OAIPMHClient and the FakeSession scripted with outcomes which it makes all requests with
+    '''
+    client_kwargs = dict(dict(max_retries=3, backoff_base=1.0, backoff_max=10.0, timeout=1), **client_kwargs)
+    client = OAIPMHClient(**client_kwargs)
+    fake_session = FakeSession(outcomes)
+    monkeypatch.setattr(client, '_get_session', lambda: fake_session)
+    return client, fake_session
+
+
+def test_backoff_doubles_up_to_backoff_max(fake_clock):
+    client = OAIPMHClient(backoff_base=1.0, backoff_max=10.0)
+
+    assert [client.get_backoff(retry) for retry in range(6)] == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+
+
+def test_backoff_has_full_jitter():
+    client = OAIPMHClient(backoff_base=1.0, backoff_max=10.0)
+    backoffs = [client.get_backoff(3) for _index in range(100)]
+
+    assert all(0.0 <= backoff <= 8.0 for backoff in backoffs)
+    assert len(set(backoffs)) > 1
+
+
+@pytest.mark.parametrize('retry_after, seconds', [
+    ('7', 7.0),
+    ('2.5', 2.5),
+    ('-3', 0.0),
+    ('soon', None),
+    (None, None),
+    ])
+def test_retry_after(retry_after, seconds):
+    assert OAIPMHClient().get_retry_after(get_response(503, retry_after)) == seconds
+
+
+def test_retry_after_http_date():
+    client = OAIPMHClient()
+    get_http_date = lambda seconds: format_datetime(datetime.now(timezone.utc) + timedelta(seconds=seconds), usegmt=True)
+
+    assert client.get_retry_after(get_response(503, get_http_date(30))) == pytest.approx(30.0, abs=2.0)
+    assert client.get_retry_after(get_response(503, get_http_date(-30))) == 0.0
+
+
+def test_retry_after_is_capped_by_backoff_max():
+    client = OAIPMHClient(backoff_base=1.0, backoff_max=10.0)
+
+    assert client.get_backoff(0, get_response(429, '3600')) == 10.0
+    assert client.get_backoff(0, get_response(429, '3')) == 3.0
+
+
+def test_server_errors_throttling_and_connection_errors_are_retried(monkeypatch, fake_clock):
+    client, fake_session = get_client(monkeypatch, [get_response(503, retry_after='5'),
+                                                    requests.ConnectionError('Connection refused'),
+                                                    get_response(429),
+                                                    requests.Timeout('Read timed out'),
+                                                    get_response(200),
+                                                    ],
+                                      max_retries=4)
+
+    assert client.get(OAIPMH_URL, {}, lambda response: response.content) == b'<OAI-PMH/>'
+    assert fake_session.request_count == 5
+    assert fake_clock.sleeps == [5.0, 2.0, 4.0, 8.0]
+
+
+@pytest.mark.parametrize('status_code', [400, 403, 404, 408])
+def test_client_errors_fail_immediately(monkeypatch, fake_clock, status_code):
+    client, fake_session = get_client(monkeypatch, [get_response(status_code), get_response(200)])
+
+    with pytest.raises(requests.HTTPError, match='Response status code {} != 200'.format(status_code)):
+        client.get(OAIPMH_URL, {}, lambda response: response.content)
+    assert fake_session.request_count == 1
+    assert not fake_clock.sleeps
+
+
+def test_read_response_errors_fail_immediately(monkeypatch, fake_clock):
+    client, fake_session = get_client(monkeypatch, [get_response(200), get_response(200)])
+
+    def read_response(response):
+        raise AssertionError('OAI-PMH error "badResumptionToken"')
+
+    with pytest.raises(AssertionError, match='badResumptionToken'):
+        client.get(OAIPMH_URL, {}, read_response)
+    assert fake_session.request_count == 1
+
+
+def test_retries_are_limited_to_max_retries(monkeypatch, fake_clock):
+    client, fake_session = get_client(monkeypatch, [get_response(500)] * 4, max_retries=2)
+
+    with pytest.raises(requests.HTTPError, match='Response status code 500 != 200'):
+        client.get(OAIPMH_URL, {}, lambda response: response.content)
+    assert fake_session.request_count == 3
+    assert fake_clock.sleeps == [1.0, 2.0]
+
+
+def test_rate_limit_spaces_requests_to_each_endpoint(monkeypatch, fake_clock):
+    client, fake_session = get_client(monkeypatch, [get_response(200)] * 4, rate_limits={OAIPMH_URL: 4})
+
+    for oaipmh_url in [OAIPMH_URL, OTHER_OAIPMH_URL, OAIPMH_URL, OAIPMH_URL]:
+        client.get(oaipmh_url, {}, lambda response: response.content)
+
+    assert fake_clock.sleeps == [0.25, 0.25]
+
+
+def test_held_endpoint_delays_requests_to_that_endpoint_only(fake_clock):
+    client = OAIPMHClient()
+    client._hold_endpoint(OAIPMH_URL, 5.0)
+
+    client._wait_for_endpoint(OTHER_OAIPMH_URL)
+    assert not fake_clock.sleeps
+
+    client._wait_for_endpoint(OAIPMH_URL)
+    client._wait_for_endpoint(OAIPMH_URL)
+    assert fake_clock.sleeps == [5.0]
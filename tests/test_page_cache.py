@@ -0,0 +1,124 @@
+'''
+Tests of recording OAI-PMH responses to the page cache while harvesting, and replaying them with no network access
+'''
+import io
+import json
+import os
+
+import pytest
+import requests
+
+import igsn_reader
+from igsn_reader import settings
+from igsn_reader._page_cache import PageCache, CachedResponse, INDEX_FILE_NAME, get_request_key
+
+OAIPMH_URL = 'http://example.org/oai' # URL of the endpoint recorded in unit tests
+HTTP_PARAMS = {'verb': 'ListRecords', 'resumptionToken': '100||'} # Parameters of the request recorded in unit tests
+
+
+def get_response(content):
+    '''
+    Function to return a successful requests.Response whose body, content, has not yet been read
+    '''
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(content)
+    return response
+
+
+def get_rows(igsn_reader_object):
+    '''
+    Function to return all stored samples of a reader's database in IDENTIFIER order
+    '''
+    return igsn_reader_object.db_connection.cursor().execute('select * from SAMPLE order by IDENTIFIER').fetchall()
+
+
+@pytest.fixture
+def page_cache_dir(tmp_path, monkeypatch):
+    '''
+    Page cache directory set in the settings of all readers and clients created by a test
+    '''
+    page_cache_dir = str(tmp_path / 'page_cache')
+    monkeypatch.setitem(settings, 'page_cache_dir', page_cache_dir)
+    return page_cache_dir
+
+
+def test_request_key_sorts_parameters():
+    assert get_request_key(OAIPMH_URL, {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}) == (
+        'http://example.org/oai?metadataPrefix=oai_dc&verb=ListRecords')
+
+
+@pytest.mark.parametrize('streamed', [True, False])
+def test_recorded_response_is_replayed(page_cache_dir, streamed):
+    page_cache = PageCache()
+    recording_response = page_cache.record(OAIPMH_URL, HTTP_PARAMS, get_response(b'<OAI-PMH>page</OAI-PMH>'))
+    if streamed:
+        assert b''.join(recording_response.iter_content(chunk_size=4)) == b'<OAI-PMH>page</OAI-PMH>'
+    else:
+        assert recording_response.content == b'<OAI-PMH>page</OAI-PMH>'
+    recording_response.commit()
+
+    [index_entry] = page_cache.get_index().values()
+    assert index_entry['request_key'] == get_request_key(OAIPMH_URL, HTTP_PARAMS)
+    assert index_entry['bytes'] == len(b'<OAI-PMH>page</OAI-PMH>')
+    assert os.path.isfile(os.path.join(page_cache_dir, index_entry['file']))
+
+    cached_response = page_cache.get_response(OAIPMH_URL, dict(reversed(list(HTTP_PARAMS.items()))))
+    assert isinstance(cached_response, CachedResponse)
+    try:
+        assert cached_response.content == b'<OAI-PMH>page</OAI-PMH>'
+    finally:
+        cached_response.close()
+
+
+def test_discarded_response_is_not_stored(page_cache_dir):
+    page_cache = PageCache()
+    recording_response = page_cache.record(OAIPMH_URL, HTTP_PARAMS, get_response(b'<OAI-PMH>trunc'))
+    assert recording_response.content == b'<OAI-PMH>trunc'
+    recording_response.discard()
+
+    assert not page_cache.get_index()
+    assert [file_names for _dir_path, _dir_names, file_names in os.walk(page_cache_dir) if file_names] == []
+    with pytest.raises(KeyError, match='not found in page cache'):
+        page_cache.get_response(OAIPMH_URL, HTTP_PARAMS)
+
+
+def test_latest_recording_of_request_is_replayed(page_cache_dir):
+    page_cache = PageCache()
+    for content in [b'<OAI-PMH>first</OAI-PMH>', b'<OAI-PMH>second</OAI-PMH>']:
+        recording_response = page_cache.record(OAIPMH_URL, HTTP_PARAMS, get_response(content))
+        recording_response.content # Read the whole response, as a non-streaming harvest does
+        recording_response.commit()
+
+    with open(os.path.join(page_cache_dir, INDEX_FILE_NAME)) as index_file:
+        assert len([json.loads(line) for line in index_file]) == 2
+    assert page_cache.get_index()[get_request_key(OAIPMH_URL, HTTP_PARAMS)]['bytes'] == len(b'<OAI-PMH>second</OAI-PMH>')
+
+    cached_response = page_cache.get_response(OAIPMH_URL, HTTP_PARAMS)
+    try:
+        assert b''.join(cached_response.iter_content()) == b'<OAI-PMH>second</OAI-PMH>'
+    finally:
+        cached_response.close()
+
+
+@pytest.mark.parametrize('streaming_parse', [True, False])
+def test_recorded_harvest_is_replayed_without_network_access(page_cache_dir, sqlite_reader, synthetic_endpoints, tmp_path,
+                                                             monkeypatch, record_count, streaming_parse):
+    assert sqlite_reader.read_igsns(streaming_parse=streaming_parse) == {'GA': (record_count, record_count)}
+    recorded_request_keys = set(PageCache(page_cache_dir).get_index().keys())
+    assert len(recorded_request_keys) == record_count // synthetic_endpoints['GA'].page_size # One response for each page
+
+    def fail_request(*args, **kwargs):
+        raise AssertionError('HTTP request made while replaying')
+
+    monkeypatch.setattr(requests.Session, 'get', fail_request)
+    replay_reader = igsn_reader.get_IGSNReader('SQLite', sqlite_db_path=str(tmp_path / 'replay.sqlite'))
+    try:
+        assert replay_reader.read_igsns(streaming_parse=streaming_parse, replay=True) == {'GA': (record_count, record_count)}
+
+        assert get_rows(replay_reader) == get_rows(sqlite_reader)
+    finally:
+        replay_reader.close()
+
+    # Replaying stores no further responses
+    assert set(PageCache(page_cache_dir).get_index().keys()) == recorded_request_keys
@@ -0,0 +1,67 @@
+'''
+Tests of the least recently used sample cache and its invalidation when a harvest writes samples
+'''
+from igsn_reader._igsn_reader import SAMPLE_COLUMNS
+from igsn_reader._sample_cache import SampleCache
+
+
+def get_sample(identifier):
+    '''
+    Function to return a cached (oaipmh_key, *SAMPLE_COLUMNS) tuple for a sample with the given IDENTIFIER
+    '''
+    return ('GA',) + tuple(identifier if column == 'IDENTIFIER' else None for column in SAMPLE_COLUMNS)
+
+
+def test_least_recently_used_entries_are_evicted():
+    sample_cache = SampleCache(max_size=2)
+    sample_cache.put({'a': (get_sample('a'),), 'b': (get_sample('b'),)}, sample_cache.generation)
+    assert set(sample_cache.get(['a'])) == {'a'}
+
+    sample_cache.put({'c': (get_sample('c'),)}, sample_cache.generation)
+
+    assert set(sample_cache.get(['a', 'b', 'c'])) == {'a', 'c'}
+    assert sample_cache.get_stats() == {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1, 'hit_ratio': 0.75}
+
+
+def test_invalidation_removes_entries_keyed_by_alternate_identifiers():
+    sample_cache = SampleCache(max_size=10)
+    sample_cache.put({'au.ga.1': (get_sample('au.ga.1'),),
+                      'IGSN:AU.GA.1': (get_sample('au.ga.1'),),
+                      'au.ga.2': (get_sample('au.ga.2'),),
+                      'IGSN:UNKNOWN': (),
+                      }, sample_cache.generation)
+
+    sample_cache.invalidate(['au.ga.1', 'IGSN:UNKNOWN'])
+
+    assert set(sample_cache.get(['au.ga.1', 'IGSN:AU.GA.1', 'au.ga.2', 'IGSN:UNKNOWN'])) == {'au.ga.2'}
+
+
+def test_results_of_lookup_overlapping_invalidation_are_discarded():
+    sample_cache = SampleCache(max_size=10)
+    generation = sample_cache.generation
+    sample_cache.invalidate(['au.ga.1'])
+
+    sample_cache.put({'au.ga.1': (get_sample('au.ga.1'),)}, generation)
+
+    assert sample_cache.get_stats()['size'] == 0
+
+
+def test_zero_size_disables_caching():
+    sample_cache = SampleCache(max_size=0)
+    sample_cache.put({'au.ga.1': (get_sample('au.ga.1'),)}, sample_cache.generation)
+
+    assert not sample_cache.get(['au.ga.1'])
+
+
+def test_harvested_changes_invalidate_cached_lookups(sqlite_reader, synthetic_endpoints, record_count):
+    sqlite_reader.read_igsns(skip_unchanged=True)
+    alternate_identifier = 'http://pid.example.org/au.ga.00000010'
+    assert sqlite_reader.get_samples([alternate_identifier])[alternate_identifier][0]['title'] == 'Sample 10 & friends'
+
+    synthetic_endpoint = synthetic_endpoints['GA']
+    get_record_xml = synthetic_endpoint.get_record_xml
+    synthetic_endpoint.get_record_xml = lambda index: (get_record_xml(index).replace('&amp; friends', 'revised')
+                                                       if index == 10 else get_record_xml(index))
+    assert sqlite_reader.read_igsns(skip_unchanged=True) == {'GA': (record_count, 1)}
+
+    assert sqlite_reader.get_samples([alternate_identifier])[alternate_identifier][0]['title'] == 'Sample 10 revised'
@@ -0,0 +1,127 @@
+'''
+Tests of exporting stored samples to CSV, JSON lines and Parquet files
+'''
+import csv
+import json
+import os
+
+import pytest
+
+from igsn_reader._igsn_reader import SAMPLE_COLUMNS
+from igsn_reader._sample_export import EXPORT_COLUMNS, export_sample_chunks
+
+
+def get_sample(index, **values):
+    '''
+    Function to return an (oaipmh_key, *SAMPLE_COLUMNS) tuple as read for export, with any values given by lower case column
+    '''
+    values = dict({'oaipmh_id': 1,
+                   'identifier': 'au.ga.{:08d}'.format(index),
+                   'datestamp': '2015-01-01T00:00:00Z',
+                   'title': 'Sample {} & friends'.format(index),
+                   'min_longitude': 147.5,
+                   'min_latitude': -18.25,
+                   'max_longitude': 147.5,
+                   'max_latitude': -18.25,
+                   }, **values)
+    return ('GA',) + tuple(values.get(column.lower()) for column in SAMPLE_COLUMNS)
+
+
+# Two chunks of samples, including an empty chunk, a sample with no extent and a title which is not ASCII
+SAMPLE_CHUNKS = [[get_sample(0), get_sample(1, title='Échantillon, "quoted"')],
+                 [],
+                 [get_sample(2, min_longitude=None, min_latitude=None, max_longitude=None, max_latitude=None)],
+                 ]
+
+
+def test_csv(tmp_path):
+    export_path = str(tmp_path / 'samples.csv')
+    assert export_sample_chunks(iter(SAMPLE_CHUNKS), export_path) == 3
+
+    with open(export_path, newline='', encoding='utf-8') as export_file:
+        csv_rows = list(csv.reader(export_file))
+    assert csv_rows[0] == EXPORT_COLUMNS
+    assert 'oaipmh_id' not in csv_rows[0]
+    export_rows = [dict(zip(csv_rows[0], csv_row)) for csv_row in csv_rows[1:]]
+    assert [export_row['identifier'] for export_row in export_rows] == ['au.ga.00000000', 'au.ga.00000001', 'au.ga.00000002']
+    assert export_rows[1]['title'] == 'Échantillon, "quoted"'
+    assert (export_rows[0]['min_latitude'], export_rows[2]['min_latitude']) == ('-18.25', '')
+
+
+def test_jsonl(tmp_path):
+    export_path = str(tmp_path / 'samples.jsonl')
+    assert export_sample_chunks(iter(SAMPLE_CHUNKS), export_path) == 3
+
+    with open(export_path, encoding='utf-8') as export_file:
+        lines = export_file.readlines()
+    assert 'Échantillon' in lines[1]
+    export_rows = [json.loads(line) for line in lines]
+    assert list(export_rows[0].keys()) == EXPORT_COLUMNS
+    assert export_rows[0]['oaipmh_key'] == 'GA'
+    assert (export_rows[0]['min_latitude'], export_rows[2]['min_latitude']) == (-18.25, None)
+    assert export_rows[1]['title'] == 'Échantillon, "quoted"'
+
+
+def test_parquet(tmp_path):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    export_path = str(tmp_path / 'samples.parquet')
+    assert export_sample_chunks(iter(SAMPLE_CHUNKS), export_path) == 3
+
+    parquet_file = pyarrow_parquet.ParquetFile(export_path)
+    assert parquet_file.metadata.num_row_groups == 2 # One for each chunk with samples
+    assert parquet_file.schema_arrow.names == EXPORT_COLUMNS
+    assert str(parquet_file.schema_arrow.field('min_latitude').type) == 'double'
+    assert str(parquet_file.schema_arrow.field('title').type) == 'string'
+
+    export_rows = parquet_file.read().to_pylist()
+    assert [export_row['identifier'] for export_row in export_rows] == ['au.ga.00000000', 'au.ga.00000001', 'au.ga.00000002']
+    assert (export_rows[0]['min_latitude'], export_rows[2]['min_latitude']) == (-18.25, None)
+
+
+def test_export_format_overrides_extension(tmp_path):
+    export_path = str(tmp_path / 'samples.txt')
+    assert export_sample_chunks(iter(SAMPLE_CHUNKS), export_path, export_format='jsonl') == 3
+
+    with open(export_path, encoding='utf-8') as export_file:
+        assert json.loads(export_file.readline())['identifier'] == 'au.ga.00000000'
+
+
+def test_unknown_export_format(tmp_path):
+    with pytest.raises(AssertionError, match='Unknown export format'):
+        export_sample_chunks(iter(SAMPLE_CHUNKS), str(tmp_path / 'samples.txt'))
+
+
+def test_existing_file_is_replaced_only_once_export_is_complete(tmp_path):
+    export_path = str(tmp_path / 'samples.csv')
+    with open(export_path, 'w') as export_file:
+        export_file.write('previous export\n')
+
+    def fail_after_first_chunk():
+        yield SAMPLE_CHUNKS[0]
+        raise RuntimeError('Simulated database failure')
+
+    with pytest.raises(RuntimeError, match='Simulated database failure'):
+        export_sample_chunks(fail_after_first_chunk(), export_path)
+
+    # The previous export is left in place, and the partly written file is removed
+    with open(export_path) as export_file:
+        assert export_file.read() == 'previous export\n'
+    assert os.listdir(str(tmp_path)) == ['samples.csv']
+
+    assert export_sample_chunks(iter(SAMPLE_CHUNKS), export_path) == 3
+    with open(export_path, encoding='utf-8') as export_file:
+        assert len(export_file.readlines()) == 4
+    assert os.listdir(str(tmp_path)) == ['samples.csv']
+
+
+def test_export_stored_samples(sqlite_reader, record_count, tmp_path):
+    sqlite_reader.read_igsns()
+    export_path = str(tmp_path / 'samples.jsonl')
+
+    assert sqlite_reader.export_samples(export_path, chunk_size=300) == record_count
+    with open(export_path, encoding='utf-8') as export_file:
+        export_rows = [json.loads(line) for line in export_file]
+    assert len({export_row['identifier'] for export_row in export_rows}) == record_count
+    assert export_rows[0]['title'] == 'Sample 0 & friends'
+
+    assert sqlite_reader.export_samples(export_path, until_datestamp='2014-12-31') == 0